@@ -6,8 +6,9 @@ from math import exp, log, fabs
 import numpy as np
 from numba import jit, njit, vectorize, void, prange
 from warnings import warn
+from scipy.sparse import issparse
 
-from ._utils import NOPYTHON, NOGIL, BOUNDSCHECK, FASTMATH, nb_float, fast_median, fast_trimmed_mean, sum_sq, argmedian
+from ._utils import NOPYTHON, NOGIL, BOUNDSCHECK, FASTMATH, nb_float, fast_median, fast_trimmed_mean, sum_sq, spectral_norm_sq, argmedian, get_kernel
 from scipy.special import expit
 
 # Options passed to the @jit decorator within this module
@@ -31,29 +32,67 @@ jit_kwargs = {
 #
 
 
-def decision_function_factory(X, fit_intercept):
+def decision_function_factory(fit_intercept, mtype="c"):
 
-    if fit_intercept:
+    if mtype == "csc":
+
+        @jit(**jit_kwargs)
+        def decision_function(X, w, out):
+            n_features = X.shape[1]
+            n_classes = out.shape[1]
+            indptr, indices, data = X.indptr, X.indices, X.data
+            if fit_intercept:
+                for k in range(n_classes):
+                    out[:, k] = w[0, k]
+            else:
+                out.fill(0.0)
+            for j in range(n_features):
+                w_j = w[j + int(fit_intercept)]
+                for idx in range(indptr[j], indptr[j + 1]):
+                    i = indices[idx]
+                    for k in range(n_classes):
+                        out[i, k] += data[idx] * w_j[k]
+
+    elif mtype == "csr":
+
+        @jit(**jit_kwargs)
+        def decision_function(X, w, out):
+            n_samples = X.shape[0]
+            n_classes = out.shape[1]
+            indptr, indices, data = X.indptr, X.indices, X.data
+            for i in range(n_samples):
+                for k in range(n_classes):
+                    if fit_intercept:
+                        out[i, k] = w[0, k]
+                    else:
+                        out[i, k] = 0.0
+                for idx in range(indptr[i], indptr[i + 1]):
+                    w_j = w[indices[idx] + int(fit_intercept)]
+                    for k in range(n_classes):
+                        out[i, k] += data[idx] * w_j[k]
+
+    elif fit_intercept:
 
         @jit(**jit_kwargs)  # void(nb_float[::1], nb_float[::1]),
-        def decision_function(w, out):
+        def decision_function(X, w, out):
             out[:] = X.dot(w[1:])
             out += w[0]
 
     else:
 
         @jit(**jit_kwargs)  # void(nb_float[::1], nb_float[::1]),
-        def decision_function(w, out):
+        def decision_function(X, w, out):
             out[:] = X.dot(w)
 
-    return decision_function
+    return get_kernel(decision_function)
 
-def batch_decision_function_factory(X, fit_intercept, n_classes, n_features):
+def batch_decision_function_factory(fit_intercept, n_classes):
 
     if fit_intercept:
 
         @jit(**jit_kwargs)  # void(nb_float[::1], nb_float[::1]),
-        def decision_function(w, out, indices_batch):
+        def decision_function(X, w, out, indices_batch):
+            n_features = X.shape[1]
             for ind in indices_batch:
                 for k in range(n_classes):
                     out[ind, k] = w[0, k]
@@ -64,14 +103,15 @@ def batch_decision_function_factory(X, fit_intercept, n_classes, n_features):
     else:
 
         @jit(**jit_kwargs)  # void(nb_float[::1], nb_float[::1]),
-        def decision_function(w, out, indices_batch):
+        def decision_function(X, w, out, indices_batch):
+            n_features = X.shape[1]
             for ind in indices_batch:
                 for k in range(n_classes):
                     out[ind, k] = 0.0
                     for j in range(n_features):
                         out[ind, k] += X[ind, j] * w[j, k]
 
-    return decision_function
+    return get_kernel(decision_function)
 
 
 @njit
@@ -137,10 +177,14 @@ def compute_steps_cgd(
                 "You should provide n_samples_in_block for mom/gmom estimator"
             )
         for j in range(n_features):
+            if issparse(X):
+                X_j = X[:, j].toarray().ravel()
+            else:
+                X_j = X[:, j]
             steps[j + int_fit_intercept] = 1 / (
                 max(
                     median_of_means(
-                        X[:, j] * X[:, j], n_samples_in_block
+                        X_j * X_j, n_samples_in_block
                     ),
                     1e-8,
                 )
@@ -176,7 +220,16 @@ def compute_steps_cgd(
     #     raise ValueError("Unknown estimator")
 
 #@jit(**jit_kwargs)
-def compute_steps(X, solver, estimator, fit_intercept, lip, percentage=0.0, n_blocks=0, eps=0.0):
+def compute_steps(
+    X,
+    solver,
+    estimator,
+    fit_intercept,
+    lip,
+    percentage=0.0,
+    n_blocks=0,
+    eps=0.0,
+):
     n_samples, n_features = X.shape
     int_fit_intercept = int(fit_intercept)
     if not np.isfinite(lip):
@@ -192,10 +245,11 @@ def compute_steps(X, solver, estimator, fit_intercept, lip, percentage=0.0, n_bl
         #         sum_sq_norms += X[i, j] * X[i, j]
         step = 1 / (lip_const * max(int_fit_intercept, mean_sq_norms))
         return step
-    elif solver in ["gd", "batch_gd", "llc"]:
+    elif solver in ["gd", "agd", "lbfgs", "batch_gd", "llc"]:
         if estimator == "erm":
-            cov = X.T @ X
-            step = n_samples / (lip_const * max(int_fit_intercept * n_samples, np.linalg.norm(cov, 2)))
+            # Matrix-free computation of the spectral norm of X.T @ X
+            norm_sq = spectral_norm_sq(X)
+            step = n_samples / (lip_const * max(int_fit_intercept * n_samples, norm_sq))
             return step
         elif estimator == "mom":
             if n_blocks == 0:
@@ -225,6 +279,7 @@ def compute_steps(X, solver, estimator, fit_intercept, lip, percentage=0.0, n_bl
                 n_blocks = n_samples - (n_samples % 2 + 1)
             n_samples_in_block = n_samples // n_blocks
             block_means = np.empty(n_blocks, dtype=X.dtype)
+            block_indices = np.empty(n_blocks, dtype=np.uintp)
             # sum_sq = np.zeros(n_samples)
             # for i in range(n_samples):
             #     for j in range(n_features):
@@ -238,19 +293,21 @@ def compute_steps(X, solver, estimator, fit_intercept, lip, percentage=0.0, n_bl
             counter = 0
             for i, idx in enumerate(sample_indices[:n_blocks*n_samples_in_block]):
                 sum_block += square_norms[idx]
-                if (i != 0) and ((i + 1) % n_samples_in_block == 0):
+                if (i + 1) % n_samples_in_block == 0:
                     block_means[counter] = sum_block / n_samples_in_block
                     counter += 1
                     sum_block = 0.0
-            argmed = argmedian(block_means)
-
-            cov = np.zeros((n_features, n_features))
-            for i in sample_indices[
-                     argmed * n_samples_in_block: (argmed + 1) * n_samples_in_block
-                     ]:
-                cov += np.outer(X[i], X[i])
-
-            step = n_samples_in_block / (lip_const * max(int_fit_intercept * n_samples_in_block, np.linalg.norm(cov, 2)))
+            argmed = argmedian(block_means, block_indices)
+
+            # Spectral norm of the covariance of the median block, which is computed
+            # matrix-free from the rows of the block
+            block = np.sort(
+                sample_indices[
+                    argmed * n_samples_in_block: (argmed + 1) * n_samples_in_block
+                ]
+            )
+            norm_sq = spectral_norm_sq(X[block])
+            step = n_samples_in_block / (lip_const * max(int_fit_intercept * n_samples_in_block, norm_sq))
             return step
     elif solver in ["md", "da"]:
 
@@ -282,6 +339,7 @@ def compute_steps(X, solver, estimator, fit_intercept, lip, percentage=0.0, n_bl
                 n_blocks = n_samples - (1 - (n_samples % 2))
             n_samples_in_block = n_samples // n_blocks
             block_means = np.empty(n_blocks, dtype=X.dtype)
+            block_indices = np.empty(n_blocks, dtype=np.uintp)
             # sum_sq = np.zeros(n_samples)
             # for i in range(n_samples):
             #     for j in range(n_features):
@@ -295,11 +353,11 @@ def compute_steps(X, solver, estimator, fit_intercept, lip, percentage=0.0, n_bl
             counter = 0
             for i, idx in enumerate(sample_indices[:n_blocks * n_samples_in_block]):
                 sum_block += inf_norms[idx]
-                if (i != 0) and ((i + 1) % n_samples_in_block == 0):
+                if (i + 1) % n_samples_in_block == 0:
                     block_means[counter] = sum_block / n_samples_in_block
                     counter += 1
                     sum_block = 0.0
-            argmed = argmedian(block_means)
+            argmed = argmedian(block_means, block_indices)
 
             # medblock_sum_inf_norms = 0.0
             # for i in sample_indices[
@@ -362,6 +420,10 @@ def compute_steps(X, solver, estimator, fit_intercept, lip, percentage=0.0, n_bl
 
 
 class Loss(ABC):
+    # Whether the derivative involves transcendental functions, in which case the
+    # estimators cache it per sample between two coordinate updates
+    costly_deriv = False
+
     @abstractmethod
     def value_factory(self):
         pass
@@ -415,6 +477,8 @@ def sigmoid(z):
 
 
 class Logistic(Loss):
+    costly_deriv = True
+
     def __init__(self):
         self.lip = 0.25
 
@@ -443,6 +507,8 @@ class Logistic(Loss):
 
 
 class MultiLogistic(Loss):
+    costly_deriv = True
+
     def __init__(self, n_classes):
         self.lip = 0.25
         self.n_classes = n_classes
@@ -2,7 +2,7 @@
 #          Ibrahim Merad <imerad7@gmail.com>
 # License: BSD 3 clause
 from abc import ABC, abstractmethod
-from math import fabs
+from math import fabs, log, ceil
 from numba import jit
 from ._utils import NOPYTHON, NOGIL, BOUNDSCHECK, FASTMATH
 
@@ -16,6 +16,11 @@ jit_kwargs = {
 
 
 class Penalty(ABC):
+    # The function returned by apply_one_unscaled_factory is
+    # x -> soft_thresh(x, scale_l1 * t) / (1 + scale_l2sq * t) for all penalizations
+    scale_l1 = 0.0
+    scale_l2sq = 0.0
+
     def __init__(self, strength):
         self.strength = strength
 
@@ -62,6 +67,63 @@ class Penalty(ABC):
 
         return apply
 
+    def apply_one_unscaled_lazy_factory(self):
+        """Returns a jit-compiled function computing in closed form the result of
+        n_steps successive proximal gradient steps x -> apply_one_unscaled(x - drift, t)
+        with a constant drift. This is used by the solvers to catch up lazily with the
+        updates of the coordinates that are not involved in the last iterations.
+
+        Returns
+        -------
+        output : function
+            A jit-compiled function with signature (x, drift, t, n_steps)
+        """
+        scale_l1 = self.scale_l1
+        scale_l2sq = self.scale_l2sq
+
+        @jit(**jit_kwargs)
+        def apply_one_unscaled_lazy(x, drift, t, n_steps):
+            thresh_l1 = scale_l1 * t
+            thresh_l2sq = scale_l2sq * t
+            # The iterates are monotone, so that they go at most once through each
+            # of the three pieces of the map
+            while n_steps > 0:
+                if x - drift > thresh_l1:
+                    sign = 1.0
+                elif x - drift < -thresh_l1:
+                    sign = -1.0
+                else:
+                    x = 0.0
+                    n_steps -= 1
+                    if fabs(drift) <= thresh_l1:
+                        # The iterates stay at zero
+                        return 0.0
+                    continue
+                # On this piece, v = sign * x follows v -> (v - b) / (1 + thresh_l2sq)
+                # as long as v > b
+                v = sign * x
+                b = sign * drift + thresh_l1
+                if thresh_l2sq > 0.0:
+                    a = 1.0 / (1.0 + thresh_l2sq)
+                    fixed_point = -b / thresh_l2sq
+                    if b > 0.0:
+                        n_piece = ceil(log((b - fixed_point) / (v - fixed_point)) / log(a))
+                        n_piece = min(max(n_piece, 1), n_steps)
+                    else:
+                        n_piece = n_steps
+                    v = fixed_point + (v - fixed_point) * a ** n_piece
+                else:
+                    if b > 0.0:
+                        n_piece = min(max(ceil(v / b - 1.0), 1), n_steps)
+                    else:
+                        n_piece = n_steps
+                    v -= n_piece * b
+                x = sign * v
+                n_steps -= n_piece
+            return x
+
+        return apply_one_unscaled_lazy
+
 
 ################################################################
 # no penalization
@@ -107,6 +169,8 @@ class NoPen(Penalty):
 
 
 class L2Sq(Penalty):
+    scale_l2sq = 1.0
+
     def __init__(self, strength):
         Penalty.__init__(self, strength)
 
@@ -149,6 +213,8 @@ class L2Sq(Penalty):
 
 
 class L1(Penalty):
+    scale_l1 = 1.0
+
     def __init__(self, strength):
         Penalty.__init__(self, strength)
 
@@ -205,6 +271,8 @@ class ElasticNet(Penalty):
     def __init__(self, strength, l1_ratio):
         Penalty.__init__(self, strength)
         self.l1_ratio = l1_ratio
+        self.scale_l1 = l1_ratio
+        self.scale_l2sq = 1.0 - l1_ratio
 
     def value_one_unscaled_factory(self):
         l1_ratio = self.l1_ratio
@@ -7,10 +7,15 @@ This module contains some utilities used throughout linlearn.
 # License: BSD 3 clause
 
 
+import hashlib
+import marshal
+import threading
+from collections import namedtuple
 import numpy as np
 from numpy.random import randint
-from scipy.sparse import issparse, isspmatrix_csr, isspmatrix_csc
+from scipy.sparse import issparse
 from numba import jit, void, uintp, prange, float64
+from numba.core.dispatcher import Dispatcher
 
 
 # Numba flags applied to all jit decorators
@@ -19,6 +24,10 @@ NOGIL = True
 BOUNDSCHECK = False
 FASTMATH = True
 PARALLEL = False
+# Number of samples in the chunks of the reductions computed by the parallel kernels
+# (used when n_jobs > 1). Partial sums are computed by chunks and then added in a fixed
+# order, so that the results do not depend on the number of threads
+PARALLEL_CHUNK_SIZE = 2048
 
 jit_kwargs = {
     "nopython": NOPYTHON,
@@ -50,7 +59,7 @@ def grad_omega(th, p, C):
     #     euc_norms[i] = np.sqrt(euc_norms[i])
 
     #euc_norms = np.sqrt(np.power(th, 2).sum(axis=1))
-    scaled_th = th.copy()
+    scaled_th = th.astype(np.float64)
     # for i in range(d):
     #     if euc_norms[i] > 0:
     #         for j in range(k):
@@ -233,18 +242,41 @@ def findK2(A, n, k1, k2):
             N = kk1 - 1
 
 
-# Better implementation of argmedian ??
 @jit(**jit_kwargs)
-def argmedian(x):
-    med = np.median(x)
-    id = 0
-    for a in x:
-        if a == med:
-            return id
-        id += 1
-    raise ValueError("Failed argmedian")
+def argmedian(x, indices):
+    """Returns the index of the median of x, namely the value of rank n // 2 (starting
+    from 0) of x with n = x.shape[0], which is the upper median when n is even. The
+    index is found by a quickselect on the indices of x, stored in `indices` (an
+    array of shape (n,) used as scratch space), so that x is not modified."""
+    n = x.shape[0]
+    for i in range(n):
+        indices[i] = i
+    rank = n // 2
+    left = 0
+    right = n - 1
+    while left < right:
+        pivot = x[indices[(left + right) // 2]]
+        i = left
+        j = right
+        while i <= j:
+            while x[indices[i]] < pivot:
+                i += 1
+            while x[indices[j]] > pivot:
+                j -= 1
+            if i <= j:
+                indices[i], indices[j] = indices[j], indices[i]
+                i += 1
+                j -= 1
+        # The values at [left, j] are <= pivot, the ones at [i, right] are >= pivot
+        # and the ones in between are equal to pivot
+        if rank <= j:
+            right = j
+        elif rank >= i:
+            left = i
+        else:
+            break
+    return indices[rank]
 
-    # return np.argpartition(x, len(x) // 2)[len(x) // 2]
 
 @jit(**jit_kwargs)
 def trimmed_mean(x, n_samples, n_excluded_tails):  # , percentage):
@@ -306,6 +338,133 @@ def fast_trimmed_mean(x, n_samples, n_excluded_tails):  # , percentage):
 
     return result
 
+@jit(**jit_kwargs)
+def select_rank(x, rank, many_ties):
+    """Returns the value of rank `rank` (starting from 0) of x, which is partitioned
+    in place unless many_ties is True (quickselect being slow with many ties)."""
+    if many_ties:
+        return np.partition(x, rank)[rank]
+    findKth_QS(x, x.shape[0], rank + 1)
+    return x[rank]
+
+
+@jit(**jit_kwargs)
+def warm_trimmed_mean(
+    x, n_samples, n_excluded_tails, bounds, widths, buffer, many_ties
+):
+    """Trimmed mean of x, as computed by fast_trimmed_mean (or trimmed_mean when
+    many_ties is True), warm-started from the bounds of the previous call.
+
+    The trimmed mean is the mean of x clipped to [a, b], where a and b are the values
+    of ranks n_excluded_tails and n_samples - n_excluded_tails - 1 of x, so that only
+    a and b must be selected. They are searched in the intervals of half-widths
+    `widths` around their previous values `bounds`: a single pass over x counts the
+    samples below, between and above the intervals and copies the ones inside them to
+    `buffer`, and the ranks are selected among these. When a rank falls outside of its
+    interval (the bounds moved too much), a full selection is used instead. The
+    bounds and the widths are updated in place, the widths following the last moves
+    of the bounds, and negative widths mean that there are no previous bounds.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        A numpy array of shape (n_samples,), which is modified in place.
+
+    n_samples : int
+        The number of samples.
+
+    n_excluded_tails : int
+        The number of samples excluded from each tail.
+
+    bounds : numpy.ndarray
+        A numpy array of shape (2,) containing the previous values of a and b.
+
+    widths : numpy.ndarray
+        A numpy array of shape (2,) containing the half-widths of the intervals.
+
+    buffer : numpy.ndarray
+        A numpy array of shape (n_samples,) used as scratch space.
+
+    many_ties : bool
+        If True, x contains many equal values (for instance zeros).
+
+    Returns
+    -------
+    output : float
+        The trimmed mean of x
+    """
+    k = int(n_excluded_tails)
+    upper_rank = n_samples - k - 1
+    found = False
+    if widths[0] >= 0.0:
+        lower_left = bounds[0] - widths[0]
+        lower_right = bounds[0] + widths[0]
+        upper_left = bounds[1] - widths[1]
+        upper_right = bounds[1] + widths[1]
+        if lower_right < upper_left:
+            n_below = 0
+            n_above = 0
+            n_lower = 0
+            n_upper = 0
+            sum_middle = 0.0
+            for i in range(n_samples):
+                x_i = x[i]
+                if x_i < lower_left:
+                    n_below += 1
+                elif x_i <= lower_right:
+                    buffer[n_lower] = x_i
+                    n_lower += 1
+                elif x_i < upper_left:
+                    sum_middle += x_i
+                elif x_i <= upper_right:
+                    n_upper += 1
+                    buffer[n_samples - n_upper] = x_i
+                else:
+                    n_above += 1
+            first_upper = n_samples - n_above - n_upper
+            if (n_below <= k < n_below + n_lower) and (
+                first_upper <= upper_rank < n_samples - n_above
+            ):
+                found = True
+                a = select_rank(buffer[:n_lower], k - n_below, many_ties)
+                b = select_rank(
+                    buffer[n_samples - n_upper :], upper_rank - first_upper, many_ties
+                )
+                result = sum_middle + n_below * a + n_above * b
+                for i in range(n_lower):
+                    result += max(buffer[i], a)
+                for i in range(n_samples - n_upper, n_samples):
+                    result += min(buffer[i], b)
+                result /= n_samples
+
+    if not found:
+        if many_ties:
+            # Same as trimmed_mean, which does not give the bounds
+            partitioned = np.partition(x, [k, upper_rank])
+            a = partitioned[k]
+            b = partitioned[upper_rank]
+            result = 0.0
+            for i in range(k, upper_rank + 1):
+                result += partitioned[i]
+            result += a * k
+            result += b * k
+            result /= n_samples
+        else:
+            result = fast_trimmed_mean(x, n_samples, k)
+            a = x[k]
+            b = x[upper_rank]
+
+    if widths[0] >= 0.0:
+        widths[0] = max(2.0 * abs(a - bounds[0]), 0.5 * widths[0])
+        widths[1] = max(2.0 * abs(b - bounds[1]), 0.5 * widths[1])
+    else:
+        widths[0] = 0.0
+        widths[1] = 0.0
+    bounds[0] = a
+    bounds[1] = b
+    return result
+
+
 @jit(**jit_kwargs)
 def fast_median(A, n):
     n2 = n//2
@@ -455,9 +614,9 @@ def matrix_type(X):
         - 'f' if it is dense (a 2D numpy array) and F-major
     """
     if issparse(X):
-        if isspmatrix_csc(X):
+        if X.format == "csc":
             return "csc"
-        elif isspmatrix_csr(X):
+        elif X.format == "csr":
             return "csr"
         else:
             raise ValueError("Only sparse CSC and CSR matrices are supported.")
@@ -470,6 +629,48 @@ def matrix_type(X):
             raise ValueError("Only C and F-major numpy arrays are supported.")
 
 
+# Sparse CSC matrix in the form given to jit-compiled kernels, whose shape is
+# (n_samples, n_features) and the column j is given by the entries
+# data[indptr[j]:indptr[j + 1]] at rows indices[indptr[j]:indptr[j + 1]]
+CSCMatrix = namedtuple("CSCMatrix", ["shape", "indptr", "indices", "data"])
+
+# Same thing for a sparse CSR matrix, where the row i is given by the entries
+# data[indptr[i]:indptr[i + 1]] at columns indices[indptr[i]:indptr[i + 1]]
+CSRMatrix = namedtuple("CSRMatrix", ["shape", "indptr", "indices", "data"])
+
+
+def kernel_matrix(X):
+    """Returns the matrix X in the form expected by the jit-compiled kernels: dense
+    numpy arrays are returned as is, while sparse CSC and CSR matrices are returned as
+    a ``CSCMatrix`` or a ``CSRMatrix`` containing their shape, indptr, indices and
+    data arrays.
+
+    This function must be used internally only.
+
+    Parameters
+    ----------
+    X : {array-like, sparse matrix} of shape (n_samples, n_features)
+        Matrix of training vectors, where n_samples is the number of samples and
+        n_features is the number of features.
+
+    Returns
+    -------
+    output : {numpy.ndarray, CSCMatrix, CSRMatrix}
+        The matrix X to be given to the kernels
+    """
+    mtype = matrix_type(X)
+    if mtype == "csc":
+        return CSCMatrix(
+            shape=X.shape, indptr=X.indptr, indices=X.indices, data=X.data
+        )
+    elif mtype == "csr":
+        return CSRMatrix(
+            shape=X.shape, indptr=X.indptr, indices=X.indices, data=X.data
+        )
+    else:
+        return X
+
+
 @jit(**jit_kwargs, parallel=PARALLEL)
 def col_sq_sum_f(X, out):
     """Computes the sums of squares of the columns of the F-major matrix X.
@@ -745,6 +946,137 @@ def sum_sq(X, axis, out=None):
     return out
 
 
+@jit(**jit_kwargs)
+def xt_dot_c(X, D, blocks, out):
+    """Computes the products X[block].T @ D[block] for the blocks of samples of the
+    C-major matrix X, where blocks[i] is the block of the sample i, transposed in out
+    so that out[b, k, j] is the sum of X[i, j] * D[i, k] over the samples i in the
+    block b. The rows of X are read once and in order, and added to the rows of out.
+
+    Parameters
+    ----------
+    X : numpy.ndarray of shape (n_samples, n_features)
+        Input C-major matrix
+
+    D : numpy.ndarray of shape (n_samples, n_classes)
+        Input C-major matrix
+
+    blocks : numpy.ndarray of shape (n_samples,)
+        The blocks of the samples
+
+    out : numpy.ndarray of shape (n_blocks, n_classes, n_features)
+        Array containing the products
+    """
+    n_samples, n_features = X.shape
+    n_blocks, n_classes, _ = out.shape
+    for b in range(n_blocks):
+        for k in range(n_classes):
+            for j in range(n_features):
+                out[b, k, j] = 0.0
+    for i in range(n_samples):
+        b = blocks[i]
+        for k in range(n_classes):
+            d_ik = D[i, k]
+            for j in range(n_features):
+                out[b, k, j] += X[i, j] * d_ik
+
+
+@jit(**jit_kwargs)
+def xt_dot_f(X, D, blocks, out):
+    """Same as xt_dot_c for the F-major matrix X, whose columns are read once and in
+    order."""
+    n_samples, n_features = X.shape
+    n_blocks, n_classes, _ = out.shape
+    for b in range(n_blocks):
+        for k in range(n_classes):
+            for j in range(n_features):
+                out[b, k, j] = 0.0
+    for j in range(n_features):
+        for i in range(n_samples):
+            b = blocks[i]
+            x_ij = X[i, j]
+            for k in range(n_classes):
+                out[b, k, j] += x_ij * D[i, k]
+
+
+def xt_dot_factory(X):
+    """Returns the jit-compiled function xt_dot(X, D, blocks, out) computing the
+    products of the blocks of X.T @ D in out, with loops following the memory layout
+    of the dense matrix X (see xt_dot_c and xt_dot_f).
+
+    This function must be used internally only.
+
+    Parameters
+    ----------
+    X : numpy.ndarray of shape (n_samples, n_features)
+        Matrix of training vectors, where n_samples is the number of samples and
+        n_features is the number of features.
+
+    Returns
+    -------
+    output : function
+        The function xt_dot
+    """
+    if matrix_type(X) == "f":
+        return xt_dot_f
+    else:
+        return xt_dot_c
+
+
+def spectral_norm_sq(X, tol=1e-4, max_iter=100):
+    """Computes an upper bound of the squared spectral norm of X, namely of the
+    largest eigenvalue of X.T @ X, using power iterations. Only the products X @ v and
+    X.T @ u are used, so that X.T @ X is never computed, which requires O(nnz(X))
+    operations by iteration and no extra memory beyond a few vectors.
+
+    The Rayleigh quotient rho of the unit vector v of the iterations is a lower bound
+    of the eigenvalue, while rho + ||r||, where r = X.T @ X @ v - rho * v is the
+    residual, is an upper bound as soon as v has at least half of its squared norm
+    along the leading eigenvector, which the iterations ensure. The iterations stop
+    when ||r|| <= tol * rho, and the squared Frobenius norm of X, which is always an
+    upper bound, is returned when they do not within max_iter iterations. This keeps
+    the step sizes computed from this bound below the inverse Lipschitz constants.
+
+    Parameters
+    ----------
+    X : {array-like, sparse matrix} of shape (n_samples, n_features)
+        Matrix of training vectors, where n_samples is the number of samples and
+        n_features is the number of features.
+
+    tol : float, default=1e-4
+        The iterations stop when the norm of the residual is smaller than tol times
+        the estimated eigenvalue, so that the upper bound is within a factor 1 + tol
+        of the eigenvalue.
+
+    max_iter : int, default=100
+        Maximum number of power iterations.
+
+    Returns
+    -------
+    output : float
+        An upper bound of the largest eigenvalue of X.T @ X.
+    """
+    n_features = X.shape[1]
+    frobenius_sq = float(sum_sq(X, 1).sum())
+    # A fixed random start, so that the global random state is left untouched
+    v = np.random.RandomState(0).randn(n_features).astype(X.dtype)
+    v /= np.linalg.norm(v)
+    for _ in range(max_iter):
+        w = X.T @ (X @ v)
+        # Rayleigh quotient of X.T @ X and residual, since v has unit norm (computed
+        # in float64, since they are small differences)
+        w64, v64 = w.astype(np.float64), v.astype(np.float64)
+        eigenvalue = float(v64 @ w64)
+        norm_residual = float(np.linalg.norm(w64 - eigenvalue * v64))
+        norm_w = np.linalg.norm(w)
+        if norm_w == 0.0:
+            return 0.0
+        if norm_residual <= tol * eigenvalue:
+            return min(eigenvalue + norm_residual, frobenius_sq)
+        v = w / norm_w
+    return frobenius_sq
+
+
 def get_type(class_):
     """Gives the numba type of an object if numba.jit decorators are enabled and None
     otherwise. This helps to get correct coverage of the code
@@ -811,3 +1143,82 @@ def rand_choice_nb(size, csum_probs, out):
 @jit(**jit_kwargs)
 def numba_seed_numpy(rnd_state):
     np.random.seed(rnd_state)
+
+
+################################################################
+# Process-wide registry of jit-compiled kernels
+################################################################
+
+# Kernels handed out by get_kernel, indexed by their structural key
+_kernels = {}
+_kernels_lock = threading.Lock()
+
+
+def _kernel_key(kernel):
+    """Computes the structural key of a jit-compiled function: its bytecode and jit
+    options, together with the keys of the values captured in its closure. Raises
+    TypeError if the closure captures a value that cannot be part of a key (such
+    as a numpy array).
+    """
+    py_func = kernel.py_func
+    cells = tuple(
+        _value_key(cell.cell_contents) for cell in (py_func.__closure__ or ())
+    )
+    return (
+        py_func.__module__,
+        py_func.__qualname__,
+        hashlib.sha1(marshal.dumps(py_func.__code__)).hexdigest(),
+        repr(sorted(kernel.targetoptions.items())),
+        _value_key(py_func.__defaults__),
+        cells,
+    )
+
+
+def _value_key(value):
+    if isinstance(value, Dispatcher):
+        return _kernel_key(value)
+    elif value is None or isinstance(value, (bool, int, float, str)):
+        return type(value).__name__, value
+    elif isinstance(value, np.generic):
+        return value.dtype.str, value.item()
+    elif isinstance(value, tuple):
+        return tuple(_value_key(v) for v in value)
+    else:
+        raise TypeError("Cannot compute a kernel key for %r" % type(value))
+
+
+def get_kernel(kernel):
+    """Returns the process-wide kernel equivalent to the given jit-compiled function.
+
+    Kernels built by the ``*_factory`` methods are closures, so that calling a factory
+    twice gives two distinct functions that numba compiles twice. This function
+    indexes kernels by their structural key (bytecode, jit options and captured
+    values, including the kernels they call), so that equivalent kernels built by
+    successive fits are compiled only once per process. The specializations for the
+    data dtype and memory layout are handled by the dispatcher itself.
+
+    Kernels must receive the data (and everything depending on it) as arguments: a
+    kernel capturing a numpy array is not indexed and is returned unchanged, and so is
+    a Python function (such as a cycle dispatching kernels to worker threads).
+
+    Parameters
+    ----------
+    kernel : numba.core.dispatcher.Dispatcher
+        A jit-compiled function
+
+    Returns
+    -------
+    output : numba.core.dispatcher.Dispatcher
+        A jit-compiled function equivalent to ``kernel``
+    """
+    if not isinstance(kernel, Dispatcher):
+        return kernel
+    try:
+        key = _kernel_key(kernel)
+    except TypeError:
+        return kernel
+    with _kernels_lock:
+        shared = _kernels.get(key)
+        if shared is None:
+            shared = _kernels[key] = kernel
+    return shared
@@ -19,6 +19,11 @@ jit_kwargs = {
 }
 
 
+# Options passed to the @jit decorator of the kernels splitting their loops over the
+# samples across threads
+jit_parallel_kwargs = {**jit_kwargs, "parallel": True}
+
+
 # Options passed to the @vectorize decorator within this module
 vectorize_kwargs = {
     "nopython": NOPYTHON,
@@ -51,6 +56,10 @@ class Estimator(ABC):
         Specifies if a constant (a.k.a. bias or intercept) should be added to the
         decision function.
 
+    parallel : bool, default=False
+        If True, estimators supporting it split their loops over the samples across
+        threads.
+
     Attributes
     ----------
     n_samples : int
@@ -63,7 +72,7 @@ class Estimator(ABC):
         This is `n_features` if `fit_intercept=False` and `n_features` otherwise.
     """
 
-    def __init__(self, X, y, loss, n_classes, fit_intercept):
+    def __init__(self, X, y, loss, n_classes, fit_intercept, parallel=False):
         self.X = X
         self.y = y
         self.loss = loss
@@ -71,6 +80,7 @@ class Estimator(ABC):
         self.n_samples, self.n_features = X.shape
         self.n_classes = n_classes
         self.n_weights = self.n_features + int(self.fit_intercept)
+        self.parallel = parallel
 
     @abstractmethod
     def get_state(self):
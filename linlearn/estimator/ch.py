@@ -5,24 +5,60 @@
 """
 This module implement the ``CH`` class for the Catoni-Holland robust estimator.
 
+The estimator uses the scale and the location of the previous estimate of the same
+coordinate as a starting point (see ``warm_holland_catoni``), so that only a few Newton
+iterations are needed once the solver is close to convergence. The gradient computes
+the products of the loss derivatives with blocks of features, reading the features
+matrix by rows, and the estimates of the columns of a block run in parallel when
+parallel is True.
+
 ``StateCH`` is a place-holder for the CH estimator containing:
 
+    deriv_samples : numpy.ndarray
+        A numpy array of shape (n_samples, n_classes) containing the loss derivatives
+        of the samples.
+
+    deriv_samples_outer_prods : numpy.ndarray
+        A numpy array of shape (n_samples, n_block_columns) containing the products of
+        the loss derivatives with a block of features, where n_block_columns is at
+        most N_FEATURES_BLOCK * n_classes.
+
+    gradient : numpy.ndarray
+        A numpy array of shape (n_weights, n_classes) containing gradients computed by
+        the `grad` function returned by the `grad_factory` factory function.
+
+    loss_derivative : numpy.ndarray
+        A numpy array of shape (n_classes,) containing a loss derivative.
 
-    gradient: numpy.ndarray
-        A numpy array of shape (n_weights,) containing gradients computed by the
-        `grad` function returned by the `grad_factory` factory function.
+    partial_derivative : numpy.ndarray
+        A numpy array of shape (n_classes,) containing a partial derivative.
 
-    TODO: fill the missing things in StateCH
+    scales : numpy.ndarray
+        A numpy array of shape (n_weights, n_classes) containing the last scales of
+        the coordinates (zero before the first estimate).
+
+    locations : numpy.ndarray
+        A numpy array of shape (n_weights, n_classes) containing the last estimates of
+        the coordinates.
 """
 
 from collections import namedtuple
+from math import atan, exp, fabs, log, pi, sqrt
 import numpy as np
-from numba import jit
-from ._base import Estimator, jit_kwargs, vectorize_kwargs
-from .._utils import np_float
+from numba import jit, prange
+from ._base import Estimator, jit_kwargs, jit_parallel_kwargs, vectorize_kwargs
+from .._utils import np_float, matrix_type
 from numba import vectorize
 
 
+# Number of features whose products with the loss derivatives are computed together by
+# the gradient
+N_FEATURES_BLOCK = 32
+
+# Constant in the khi function used by the scale equation
+KHI_SHIFT = 0.62
+
+
 @vectorize(**vectorize_kwargs)
 def catoni(x):
     return np.sign(x) * np.log(1 + np.sign(x) * x + x * x / 2)
@@ -75,6 +111,111 @@ def holland_catoni_estimator(x, eps=0.001, max_iter=30):
     return m
 
 
+@jit(**jit_kwargs)
+def warm_holland_catoni(x, eps, sigma, location, max_iter=30):
+    """Holland-Catoni estimator of the mean of x, warm-started from the scale sigma
+    and the location of a previous estimate (sigma <= 0 for a cold start). The scale
+    and the location solve the same equations as in holland_catoni_estimator, using
+    safeguarded Newton iterations which do not allocate memory, and which stop when
+    the steps are below eps times the scale (or eps for scales larger than 1).
+
+    Returns
+    -------
+    output : tuple
+        The estimate and the scale
+    """
+    n_samples = x.shape[0]
+    x_0 = x[0]
+    constant = True
+    x_mean = 0.0
+    x_min = x_0
+    x_max = x_0
+    for i in range(n_samples):
+        x_i = x[i]
+        x_mean += x_i
+        x_min = min(x_min, x_i)
+        x_max = max(x_max, x_i)
+        if fabs(x_0 - x_i) > 1e-8 + 1e-5 * fabs(x_0):
+            constant = False
+    if constant:
+        return x_0, sigma
+    x_mean /= n_samples
+
+    if sigma > 0.0:
+        m = min(max(location, x_min), x_max)
+    else:
+        sigma = 1.0
+        m = x_mean
+
+    # The scale is the root of the mean of khi((x - x_mean) / sigma), which
+    # decreases with sigma. The Newton steps on log(sigma) are at most 1.
+    for _ in range(max_iter):
+        value = 0.0
+        slope = 0.0
+        for i in range(n_samples):
+            u = (x[i] - x_mean) / sigma
+            v = 1.0 / (1.0 + u * u)
+            value += KHI_SHIFT - v
+            slope += u * u * v * v
+        if slope > 0.0:
+            step = min(max(value / (2.0 * slope), -1.0), 1.0)
+        elif value > 0.0:
+            step = 1.0
+        else:
+            step = -1.0
+        sigma_new = sigma * exp(step)
+        delta = fabs(sigma_new - sigma)
+        sigma = sigma_new
+        if delta <= eps * min(sigma, 1.0):
+            break
+
+    # The location is the root of the mean of gud((x - m) / s), which decreases with
+    # m and lies in [x_min, x_max]. Newton steps leaving the bracket of the root are
+    # replaced by bisection steps.
+    s = sigma * sqrt(n_samples / log(1 / eps))
+    tol = eps * min(s, 1.0)
+    lower = x_min
+    upper = x_max
+    for _ in range(max_iter):
+        value = 0.0
+        slope = 0.0
+        for i in range(n_samples):
+            r = (x[i] - m) / s
+            if r < 12:
+                e = exp(r)
+                value += 2 * atan(e) - pi / 2
+                slope += 2 * e / (1 + e * e)
+            else:
+                value += pi / 2
+                if r < 30:
+                    slope += 2 * exp(-r)
+        if value > 0.0:
+            lower = m
+        else:
+            upper = m
+        if slope > 0.0:
+            m_new = m + s * value / slope
+        else:
+            m_new = lower - 1.0
+        if not lower < m_new < upper:
+            m_new = 0.5 * (lower + upper)
+        step = m_new - m
+        m = m_new
+        if fabs(step) <= tol:
+            break
+    return m, sigma
+
+
+@jit(**jit_kwargs)
+def warm_holland_catoni_update(x, eps, scales, locations, j, k):
+    """Holland-Catoni estimate of the mean of x for coordinate j and class k,
+    warm-started from and saved to scales and locations."""
+    estimate, scale = warm_holland_catoni(x, eps, scales[j, k], locations[j, k])
+    scales[j, k] = scale
+    locations[j, k] = estimate
+    return estimate
+
+
 from scipy.optimize import brentq
 
 
@@ -94,40 +235,81 @@ StateCH = namedtuple(
         "gradient",
         "loss_derivative",
         "partial_derivative",
+        "scales",
+        "locations",
     ],
 )
 
 
 class CH(Estimator):
-    def __init__(self, X, y, loss, n_classes, fit_intercept, eps=0.001):
-        Estimator.__init__(self, X, y, loss, n_classes, fit_intercept)
+    """Catoni-Holland estimator. When parallel is True, the estimates of the gradient
+    coordinates are computed in parallel."""
+
+    def __init__(
+        self, X, y, loss, n_classes, fit_intercept, eps=0.001, parallel=False
+    ):
+        Estimator.__init__(self, X, y, loss, n_classes, fit_intercept, parallel)
         self.eps = eps
 
     def get_state(self):
+        weights_shape = (self.n_features + int(self.fit_intercept), self.n_classes)
+        n_features_block = max(min(N_FEATURES_BLOCK, self.n_features), 1)
         return StateCH(
-            deriv_samples=np.empty((self.n_samples, self.n_classes), dtype=np_float),
-            deriv_samples_outer_prods=np.empty(self.n_samples, dtype=np_float),
-            gradient=np.empty(
-                (self.n_features + int(self.fit_intercept), self.n_classes),
-                dtype=np_float,
+            deriv_samples=np.empty((self.n_samples, self.n_classes), dtype=self.X.dtype),
+            deriv_samples_outer_prods=np.empty(
+                (self.n_samples, n_features_block * self.n_classes),
+                dtype=self.X.dtype,
+                order="F",
             ),
+            gradient=np.empty(weights_shape, dtype=np_float),
             loss_derivative=np.empty(self.n_classes, dtype=np_float),
             partial_derivative=np.empty(self.n_classes, dtype=np_float),
+            scales=np.zeros(weights_shape, dtype=np_float),
+            locations=np.zeros(weights_shape, dtype=np_float),
         )
 
     def partial_deriv_factory(self):
-        X = self.X
-        y = self.y
         loss = self.loss
         deriv_loss = loss.deriv_factory()
-        n_samples = self.n_samples
         n_classes = self.n_classes
         eps = self.eps
+        fit_intercept = self.fit_intercept
+
+        if matrix_type(self.X) == "csc":
+
+            @jit(**jit_kwargs)
+            def partial_deriv(X, y, j, inner_products, state):
+                n_samples = X.shape[0]
+                deriv_samples = state.deriv_samples
+                partial_derivative = state.partial_derivative
+                if fit_intercept and j == 0:
+                    for i in range(n_samples):
+                        deriv_loss(y[i], inner_products[i], deriv_samples[i])
+                else:
+                    # Loss derivatives are only computed for the non-zero entries of
+                    # the column, the other samples have zero partial derivatives
+                    deriv_samples.fill(0.0)
+                    deriv = state.loss_derivative
+                    col = j - int(fit_intercept)
+                    indices, data = X.indices, X.data
+                    for idx in range(X.indptr[col], X.indptr[col + 1]):
+                        i = indices[idx]
+                        deriv_loss(y[i], inner_products[i], deriv)
+                        for k in range(n_classes):
+                            deriv_samples[i, k] = deriv[k] * data[idx]
+
+                for k in range(n_classes):
+                    partial_derivative[k] = warm_holland_catoni_update(
+                        deriv_samples[:, k], eps, state.scales, state.locations, j, k
+                    )
+
+            return partial_deriv
 
-        if self.fit_intercept:
+        elif fit_intercept:
 
             @jit(**jit_kwargs)
-            def partial_deriv(j, inner_products, state):
+            def partial_deriv(X, y, j, inner_products, state):
+                n_samples = X.shape[0]
                 deriv_samples = state.deriv_samples
                 partial_derivative = state.partial_derivative
                 if j == 0:
@@ -139,15 +321,16 @@ class CH(Estimator):
                         for k in range(n_classes):
                             deriv_samples[i, k] *= X[i, j - 1]
                 for k in range(n_classes):
-                    partial_derivative[k] = holland_catoni_estimator(
-                        deriv_samples[:, k], eps
+                    partial_derivative[k] = warm_holland_catoni_update(
+                        deriv_samples[:, k], eps, state.scales, state.locations, j, k
                     )
 
             return partial_deriv
         else:
 
             @jit(**jit_kwargs)
-            def partial_deriv(j, inner_products, state):
+            def partial_deriv(X, y, j, inner_products, state):
+                n_samples = X.shape[0]
                 deriv_samples = state.deriv_samples
                 partial_derivative = state.partial_derivative
                 for i in range(n_samples):
@@ -156,70 +339,59 @@ class CH(Estimator):
                         deriv_samples[i, k] *= X[i, j]
 
                 for k in range(n_classes):
-                    partial_derivative[k] = holland_catoni_estimator(
-                        deriv_samples[:, k], eps
+                    partial_derivative[k] = warm_holland_catoni_update(
+                        deriv_samples[:, k], eps, state.scales, state.locations, j, k
                     )
 
             return partial_deriv
 
     def grad_factory(self):
-        X = self.X
-        y = self.y
         loss = self.loss
         deriv_loss = loss.deriv_factory()
-        n_samples = self.n_samples
-        n_features = self.n_features
         n_classes = self.n_classes
         eps = self.eps
+        fit_intercept = self.fit_intercept
+        int_fit_intercept = int(fit_intercept)
+        # The loops over the samples and over the columns of a block run in parallel
+        # in parallel mode
+        kernel_kwargs = jit_parallel_kwargs if self.parallel else jit_kwargs
+
+        @jit(**kernel_kwargs)
+        def grad(X, y, inner_products, state):
+            n_samples, n_features = X.shape
+            deriv_samples = state.deriv_samples
+            deriv_samples_outer_prods = state.deriv_samples_outer_prods
+            gradient = state.gradient
+            scales = state.scales
+            locations = state.locations
+            n_features_block = deriv_samples_outer_prods.shape[1] // n_classes
+
+            for i in prange(n_samples):
+                deriv_loss(y[i], inner_products[i], deriv_samples[i])
+
+            if fit_intercept:
+                for k in prange(n_classes):
+                    gradient[0, k] = warm_holland_catoni_update(
+                        deriv_samples[:, k], eps, scales, locations, 0, k
+                    )
 
-        if self.fit_intercept:
-
-            @jit(**jit_kwargs)
-            def grad(inner_products, state):
-                deriv_samples = state.deriv_samples
-                deriv_samples_outer_prods = state.deriv_samples_outer_prods
-                gradient = state.gradient
-
-                # gradient.fill(0.0)
-                for i in range(n_samples):
-                    deriv_loss(y[i], inner_products[i], deriv_samples[i])
-
-                # gradient[0] = holland_catoni_estimator(deriv_samples, eps)
-
-                for k in range(n_classes):
-                    gradient[0, k] = holland_catoni_estimator(deriv_samples[:, k], eps)
-
-                for j in range(n_features):
-                    for k in range(n_classes):
-                        for i in range(n_samples):
-                            deriv_samples_outer_prods[i] = X[i, j] * deriv_samples[i, k]
-
-                        gradient[j + 1, k] = holland_catoni_estimator(
-                            deriv_samples_outer_prods, eps
-                        )
-                return 0
-
-            return grad
-        else:
-
-            @jit(**jit_kwargs)
-            def grad(inner_products, state):
-                deriv_samples = state.deriv_samples
-                deriv_samples_outer_prods = state.deriv_samples_outer_prods
-                gradient = state.gradient
-
-                # gradient.fill(0.0)
-                for i in range(n_samples):
-                    deriv_loss(y[i], inner_products[i], deriv_samples[i])
-
-                for j in range(n_features):
-                    for k in range(n_classes):
-                        for i in range(n_samples):
-                            deriv_samples_outer_prods[i] = X[i, j] * deriv_samples[i, k]
-
-                        gradient[j, k] = holland_catoni_estimator(
-                            deriv_samples_outer_prods, eps
-                        )
-                return 0
+            for start in range(0, n_features, n_features_block):
+                end = min(start + n_features_block, n_features)
+                # The products for the block of features read X by rows
+                for i in prange(n_samples):
+                    for j in range(start, end):
+                        x_ij = X[i, j]
+                        col = (j - start) * n_classes
+                        for k in range(n_classes):
+                            deriv_samples_outer_prods[i, col + k] = (
+                                x_ij * deriv_samples[i, k]
+                            )
+                for col in prange((end - start) * n_classes):
+                    j = start + col // n_classes + int_fit_intercept
+                    k = col % n_classes
+                    gradient[j, k] = warm_holland_catoni_update(
+                        deriv_samples_outer_prods[:, col], eps, scales, locations, j, k
+                    )
+            return 0
 
-            return grad
+        return grad
@@ -5,13 +5,11 @@
 
 from collections import namedtuple
 import numpy as np
-from numba import jit, objmode
+from numba import jit
 from ._base import Estimator, jit_kwargs
 from .._utils import np_float
 from sklearn.utils import check_array
 
-from scipy.linalg import eigh
-
 
 @jit(**jit_kwargs)
 def find_t(g, w, eps):
@@ -146,96 +144,134 @@ def find_t3(g, w, eps):
 
     return vals[0]
 
+@jit(**jit_kwargs)
+def top_eigenvector(vecs, mu, w, sum_w, v, out, tol=1e-2, max_iter=100):
+    """Computes the top eigenvector of the weighted covariance matrix
+    sum_i w[i] (vecs[i] - mu) (vecs[i] - mu)^T / sum_w by power iterations. The
+    products of this matrix with a vector are computed matrix-free, using
+    O(n_samples * d) operations, and samples with a zero weight are skipped.
+
+    Parameters
+    ----------
+    vecs : numpy.ndarray
+        A numpy array of shape (n_samples, d) containing the samples.
+
+    mu : numpy.ndarray
+        A numpy array of shape (d,) containing the weighted mean of the samples.
+
+    w : numpy.ndarray
+        A numpy array of shape (n_samples,) containing the weights of the samples.
+
+    sum_w : float
+        The sum of the weights.
+
+    v : numpy.ndarray
+        A numpy array of shape (d,) containing the starting point of the iterations,
+        which is overwritten by the top eigenvector.
+
+    out : numpy.ndarray
+        A numpy array of shape (d,) used as a place-holder.
+
+    tol : float, default=1e-2
+        The iterations stop when the relative change of the top eigenvalue is
+        smaller than tol.
+
+    max_iter : int, default=100
+        Maximum number of power iterations.
+
+    Returns
+    -------
+    output : float
+        The top eigenvalue (zero if the starting point is in the kernel of the
+        covariance, in which case v is left unchanged).
+    """
+    n, d = vecs.shape
+    eigenvalue = 0.0
+    for _ in range(max_iter):
+        out.fill(0.0)
+        for i in range(n):
+            if w[i] == 0.0:
+                continue
+            proj = 0.0
+            for j in range(d):
+                proj += (vecs[i, j] - mu[j]) * v[j]
+            proj *= w[i] / sum_w
+            for j in range(d):
+                out[j] += proj * (vecs[i, j] - mu[j])
+        new_eigenvalue = 0.0
+        norm_out = 0.0
+        for j in range(d):
+            new_eigenvalue += v[j] * out[j]
+            norm_out += out[j] * out[j]
+        if norm_out == 0.0:
+            return 0.0
+        norm_out = np.sqrt(norm_out)
+        for j in range(d):
+            v[j] = out[j] / norm_out
+        if abs(new_eigenvalue - eigenvalue) <= tol * new_eigenvalue:
+            return new_eigenvalue
+        eigenvalue = new_eigenvalue
+    return eigenvalue
+
+
 @jit(**jit_kwargs)
 def dkk(vecs, eps):
     n, d = vecs.shape
     w = np.empty(len(vecs))
     w_copy = np.empty(len(vecs))
-    # ph1 = np.empty(vecs.shape)
-    Sigma = np.empty((d, d))
     w.fill(1.0 / len(vecs))
+    w_copy.fill(1.0 / len(vecs))
     sum_w = 1.0
     g = np.empty(n)
     g_copy = np.empty(n)
-    # print("called dkk")
+    eig = np.empty(d)
+    eig_out = np.empty(d)
+    mu = np.dot(w, vecs) / sum_w
+    # The first power iterations start from the sample farthest from the mean, and the
+    # next ones from the previous top eigenvector
+    i_max = 0
+    dist_max = -1.0
+    for i in range(n):
+        dist = 0.0
+        for j in range(d):
+            dist += (vecs[i, j] - mu[j]) ** 2
+        if dist > dist_max:
+            i_max = i
+            dist_max = dist
+    for j in range(d):
+        eig[j] = vecs[i_max, j] - mu[j]
+
     while sum_w > 1 - 2 * eps:
         mu = np.dot(w, vecs) / sum_w
-        # print(mu)
-        # print("sum_w = ", sum_w)
-
-        # for i in range(n):
-        #     for j in range(d):
-        #         ph1[i, j] = vecs[i, j] - mu[j]
-
-        # ph1 = vecs - mu[np.newaxis, :]
-
-        # Sigma.fill(0.0)
-        Sigma_norm = 0.0
-        for j1 in range(d):
-            for j2 in range(j1, d):
-                Sigma[j1, j2] = 0.0
-                for i in range(n):
-                    Sigma[j1, j2] += w[i] * (vecs[i, j1] - mu[j1]) * (vecs[i, j2] - mu[j2])#ph1[i, j1] * ph1[i, j2]
-                Sigma[j1, j2] /= sum_w
-                Sigma[j2, j1] = Sigma[j1, j2]
-                Sigma_norm += Sigma[j1, j2] * Sigma[j1, j2]
-        if Sigma_norm < 1e-4:
+        # The covariance is numerically zero when its top eigenvalue is
+        eigenvalue = top_eigenvector(vecs, mu, w, sum_w, eig, eig_out)
+        if eigenvalue * eigenvalue < 1e-4:
             return mu
 
-        #Sigma = ph1.T @ (w[:, np.newaxis] * ph1)
-        # TODO : Figure out how to compute only first eigenvector in Numba
-        with objmode(eig='float64[:]'):  # annotate return type
-            # this region is executed by object-mode.
-            _, eig = eigh(Sigma, subset_by_index=[d - 1, d - 1])
-            eig = eig.flatten()
-            #np.ascontiguousarray(eigvec)
-        # eigvals, eigvecs = np.linalg.eigh(Sigma)
-        # eigvec = eigvecs[:, np.argmax(eigvals)]
-
         for i in range(n):
             g[i] = 0.0
             for j in range(d):
                 g[i] += (vecs[i, j] - mu[j]) * eig[j]
             g[i] = g[i] * g[i]
             g_copy[i] = g[i]
-        # g = np.square(ph1 @ eig).reshape(n)
-
-        # f = g.copy()
-
-        # ________________________________
-        # asg = np.argsort(g)#[::-1]
-        # sm = 0.0
-        # ind = n-1
-        # while sm < eps:
-        #     sm += w[asg[ind]]
-        #     ind -= 1
-        # t = g[asg[ind + 1]]
-        # ________________________________
+
         t = find_t3(g_copy, w_copy, eps)
 
-        # f[f < t] = 0
         m = 0.0
-        #print("pass 2")
         for i in range(n):
             if g[i] < t:
                 g[i] = 0.0
             elif g[i] > m and w[i] > 0:
                 m = g[i]
-        # print("m = ", m)
-        #print("pass 3")
         for i in range(n):
             w[i] *= 1 - g[i] / m
             w_copy[i] = w[i]
-        # w = np.multiply(w, 1 - g / m)
         sum_w = np.sum(w)
     mu = np.dot(w, vecs) / sum_w
 
     return mu
 
 
-
-
-
 StateDKK = namedtuple(
     "StateDKK",
     [
@@ -255,10 +291,10 @@ class DKK(Estimator):
     def get_state(self):
         return StateDKK(
             deriv_samples=np.empty(
-                (self.n_samples, self.n_classes), dtype=np_float, order="F"
+                (self.n_samples, self.n_classes), dtype=self.X.dtype, order="F"
             ),
             deriv_samples_outer_prods=np.empty(
-                (self.n_samples, self.n_classes), dtype=np_float, order="F"
+                (self.n_samples, self.n_classes), dtype=self.X.dtype, order="F"
             ),
             gradient=np.empty(
                 (self.n_features + int(self.fit_intercept), self.n_classes),
@@ -273,19 +309,16 @@ class DKK(Estimator):
         )
 
     def grad_factory(self):
-        X = self.X
-        y = self.y
         loss = self.loss
         deriv_loss = loss.deriv_factory()
-        n_samples = self.n_samples
-        n_features = self.n_features
         n_classes = self.n_classes
         eps = self.eps
 
         if self.fit_intercept:
 
             @jit(**jit_kwargs)
-            def grad(inner_products, state):
+            def grad(X, y, inner_products, state):
+                n_samples, n_features = X.shape
                 deriv_samples = state.deriv_samples
                 deriv_samples_outer_prods = state.deriv_samples_outer_prods
                 gradient = state.gradient
@@ -313,7 +346,8 @@ class DKK(Estimator):
         else:
 
             @jit(**jit_kwargs)
-            def grad(inner_products, state):
+            def grad(X, y, inner_products, state):
+                n_samples, n_features = X.shape
                 deriv_samples = state.deriv_samples
                 deriv_samples_outer_prods = state.deriv_samples_outer_prods
                 gradient = state.gradient
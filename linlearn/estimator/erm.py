@@ -10,15 +10,53 @@ This module implement the ``ERM`` class the empirical risk minimizer estimator.
     gradient: numpy.ndarray
         A numpy array of shape (n_weights,) containing gradients computed by the
         `grad` function returned by the `grad_factory` factory function.
+
+    sample_inner_products: numpy.ndarray
+        A numpy array of shape (n_samples, n_classes) containing the inner products
+        at which the cached loss derivatives were computed (empty if the loss
+        derivatives are not cached).
+
+    sample_derivatives: numpy.ndarray
+        A numpy array of shape (n_samples, n_classes) containing the cached loss
+        derivatives of the samples (empty if the loss derivatives are not cached).
+
+    cache_filled: numpy.ndarray
+        A numpy array of shape (1,) telling if the cache has been filled.
+
+    sample_blocks: numpy.ndarray
+        A numpy array of shape (n_samples,) of zeros, all the samples being in the
+        same block for `xt_dot` (empty if `grad_factory` was not called before).
+
+    deriv_samples: numpy.ndarray
+        A numpy array of shape (n_samples, n_classes) containing the loss derivatives
+        of the samples computed by `grad` (empty if `grad_factory` was not called
+        before).
+
+    gradient_transposed: numpy.ndarray
+        A numpy array of shape (1, n_classes, n_features) containing the products of
+        the features with the loss derivatives computed by `grad`.
 """
 
 from collections import namedtuple
 import numpy as np
-from numba import jit
-from ._base import Estimator, jit_kwargs
-from .._utils import np_float
-
-StateERM = namedtuple("StateERM", ["gradient", "loss_derivative", "partial_derivative"])
+from numba import jit, prange
+from ._base import Estimator, jit_kwargs, jit_parallel_kwargs
+from .._utils import np_float, matrix_type, xt_dot_factory, PARALLEL_CHUNK_SIZE
+
+StateERM = namedtuple(
+    "StateERM",
+    [
+        "gradient",
+        "loss_derivative",
+        "partial_derivative",
+        "sample_inner_products",
+        "sample_derivatives",
+        "cache_filled",
+        "sample_blocks",
+        "deriv_samples",
+        "gradient_transposed",
+    ],
+)
 
 
 class ERM(Estimator):
@@ -43,6 +81,10 @@ class ERM(Estimator):
         Specifies if a constant (a.k.a. bias or intercept) should be added to the
         decision function.
 
+    parallel : bool, default=False
+        If True, the sums over the samples computed by the partial derivatives are
+        split across threads. The loss derivatives are then not cached.
+
     Attributes
     ----------
     n_samples : int
@@ -56,8 +98,11 @@ class ERM(Estimator):
 
     """
 
-    def __init__(self, X, y, loss, n_classes, fit_intercept):
-        Estimator.__init__(self, X, y, loss, n_classes, fit_intercept)
+    def __init__(self, X, y, loss, n_classes, fit_intercept, parallel=False):
+        Estimator.__init__(self, X, y, loss, n_classes, fit_intercept, parallel)
+        # The states only contain the place-holders of grad once grad_factory has
+        # been called, since the solvers using partial derivatives do not need them
+        self._grad_state = False
 
     def get_state(self):
         """Returns the state of the ERM estimator, which is a place-holder used for
@@ -68,6 +113,11 @@ class ERM(Estimator):
         output : StateERM
             State of the ERM estimator
         """
+        # The loss derivatives are cached by partial_deriv only if they are costly
+        n_cached = (
+            self.n_samples if self.loss.costly_deriv and not self.parallel else 0
+        )
+        n_grad = self.n_samples if self._grad_state else 0
         return StateERM(
             gradient=np.empty(
                 (self.n_features + int(self.fit_intercept), self.n_classes),
@@ -75,6 +125,16 @@ class ERM(Estimator):
             ),
             loss_derivative=np.empty(self.n_classes, dtype=np_float),
             partial_derivative=np.empty(self.n_classes, dtype=np_float),
+            sample_inner_products=np.empty(
+                (n_cached, self.n_classes), dtype=self.X.dtype
+            ),
+            sample_derivatives=np.empty((n_cached, self.n_classes), dtype=np_float),
+            cache_filled=np.zeros(1, dtype=np.bool_),
+            sample_blocks=np.zeros(n_grad, dtype=np.uintp),
+            deriv_samples=np.empty((n_grad, self.n_classes), dtype=self.X.dtype),
+            gradient_transposed=np.empty(
+                (1, self.n_classes, self.n_features), dtype=np_float
+            ),
         )
 
     def partial_deriv_factory(self):
@@ -86,23 +146,90 @@ class ERM(Estimator):
         output : function
             A jit-compiled function allowing to compute partial derivatives.
         """
-        X = self.X
-        y = self.y
         loss = self.loss
         deriv_loss = loss.deriv_factory()
-        n_samples = self.n_samples
         n_classes = self.n_classes
+        fit_intercept = self.fit_intercept
 
-        if self.fit_intercept:
+        if self.parallel:
+            return self._parallel_partial_deriv_factory()
+        elif loss.costly_deriv:
+            return self._cached_partial_deriv_factory()
+
+        if matrix_type(self.X) == "csc":
+
+            @jit(**jit_kwargs)
+            def partial_deriv(X, y, j, inner_products, state):
+                """Computes the partial derivative of the goodness-of-fit with
+                respect to coordinate `j`, given the value of the `inner_products` and
+                `state`, using only the non-zero entries of the column of `X`.
+
+                Parameters
+                ----------
+                X : CSCMatrix
+                    The sparse CSC matrix of shape (n_samples, n_features) containing
+                    the training samples.
+
+                y : numpy.ndarray
+                    A numpy array of shape (n_samples,) containing the targets.
+
+                j : int
+                    Partial derivative is with respect to this coordinate
+
+                inner_products : numpy.array
+                    A numpy array of shape (n_samples,), containing the inner
+                    products (decision function) X.dot(w) + b where w is the weights
+                    and b the (optional) intercept.
+
+                state : StateERM
+                    The state of the ERM estimator (not used here, but this allows
+                    all estimators to have the same prototypes for `partial_deriv`).
+
+                Returns
+                -------
+                output : float
+                    The value of the partial derivative
+                """
+                n_samples = X.shape[0]
+                deriv = state.loss_derivative
+                partial_derivative = state.partial_derivative
+                for k in range(n_classes):
+                    partial_derivative[k] = 0.0
+                if fit_intercept and j == 0:
+                    for i in range(n_samples):
+                        deriv_loss(y[i], inner_products[i], deriv)
+                        for k in range(n_classes):
+                            partial_derivative[k] += deriv[k]
+                else:
+                    col = j - int(fit_intercept)
+                    indices, data = X.indices, X.data
+                    for idx in range(X.indptr[col], X.indptr[col + 1]):
+                        i = indices[idx]
+                        deriv_loss(y[i], inner_products[i], deriv)
+                        for k in range(n_classes):
+                            partial_derivative[k] += deriv[k] * data[idx]
+                for k in range(n_classes):
+                    partial_derivative[k] /= n_samples
+
+            return partial_deriv
+
+        elif fit_intercept:
 
             @jit(**jit_kwargs)
-            def partial_deriv(j, inner_products, state):
+            def partial_deriv(X, y, j, inner_products, state):
                 """Computes the partial derivative of the goodness-of-fit with
                 respect to coordinate `j`, given the value of the `inner_products` and
                 `state`.
 
                 Parameters
                 ----------
+                X : numpy.ndarray
+                    A numpy array of shape (n_samples, n_features) containing the
+                    training samples.
+
+                y : numpy.ndarray
+                    A numpy array of shape (n_samples,) containing the targets.
+
                 j : int
                     Partial derivative is with respect to this coordinate
 
@@ -120,6 +247,7 @@ class ERM(Estimator):
                 output : float
                     The value of the partial derivative
                 """
+                n_samples = X.shape[0]
                 deriv = state.loss_derivative
                 partial_derivative = state.partial_derivative
                 for k in range(n_classes):
@@ -143,13 +271,20 @@ class ERM(Estimator):
         else:
 
             @jit(**jit_kwargs)
-            def partial_deriv(j, inner_products, state):
+            def partial_deriv(X, y, j, inner_products, state):
                 """Computes the partial derivative of the goodness-of-fit with
                 respect to coordinate `j`, given the value of the `inner_products` and
                 `state`.
 
                 Parameters
                 ----------
+                X : numpy.ndarray
+                    A numpy array of shape (n_samples, n_features) containing the
+                    training samples.
+
+                y : numpy.ndarray
+                    A numpy array of shape (n_samples,) containing the targets.
+
                 j : int
                     Partial derivative is with respect to this coordinate
 
@@ -167,6 +302,7 @@ class ERM(Estimator):
                 output : float
                     The value of the partial derivative
                 """
+                n_samples = X.shape[0]
                 deriv = state.loss_derivative
                 partial_derivative = state.partial_derivative
                 for k in range(n_classes):
@@ -180,6 +316,308 @@ class ERM(Estimator):
 
             return partial_deriv
 
+    def _parallel_partial_deriv_factory(self):
+        """Partial derivatives factory for the parallel mode. The returned function
+        splits the samples (the non-zero entries of the column for sparse features)
+        in chunks of PARALLEL_CHUNK_SIZE samples, computes the sums over the chunks
+        in parallel and adds them in a fixed order, so that the partial derivatives
+        do not depend on the number of threads.
+
+        Returns
+        -------
+        output : function
+            A jit-compiled function allowing to compute partial derivatives.
+        """
+        deriv_loss = self.loss.deriv_factory()
+        n_classes = self.n_classes
+        fit_intercept = self.fit_intercept
+
+        @jit(**jit_kwargs)
+        def add_chunk_sums(chunk_sums, n_samples, state):
+            # The sums over the chunks are added in a fixed order
+            partial_derivative = state.partial_derivative
+            for k in range(n_classes):
+                partial_derivative[k] = 0.0
+            for chunk in range(chunk_sums.shape[0]):
+                for k in range(n_classes):
+                    partial_derivative[k] += chunk_sums[chunk, k]
+            for k in range(n_classes):
+                partial_derivative[k] /= n_samples
+
+        if matrix_type(self.X) == "csc":
+
+            @jit(**jit_parallel_kwargs)
+            def partial_deriv(X, y, j, inner_products, state):
+                """Computes the partial derivative of the goodness-of-fit with
+                respect to coordinate `j`, given the value of the `inner_products` and
+                `state`, using only the non-zero entries of the column of `X` and
+                several threads.
+
+                Parameters
+                ----------
+                X : CSCMatrix
+                    The sparse CSC matrix of shape (n_samples, n_features) containing
+                    the training samples.
+
+                y : numpy.ndarray
+                    A numpy array of shape (n_samples,) containing the targets.
+
+                j : int
+                    Partial derivative is with respect to this coordinate
+
+                inner_products : numpy.array
+                    A numpy array of shape (n_samples,), containing the inner
+                    products (decision function) X.dot(w) + b where w is the weights
+                    and b the (optional) intercept.
+
+                state : StateERM
+                    The state of the ERM estimator.
+
+                Returns
+                -------
+                output : float
+                    The value of the partial derivative
+                """
+                n_samples = X.shape[0]
+                indices, data = X.indices, X.data
+                col = j - int(fit_intercept)
+                if col >= 0:
+                    start, end = X.indptr[col], X.indptr[col + 1]
+                else:
+                    start, end = 0, n_samples
+                n_chunks = (end - start + PARALLEL_CHUNK_SIZE - 1) // PARALLEL_CHUNK_SIZE
+                chunk_sums = np.zeros((n_chunks, n_classes))
+                for chunk in prange(n_chunks):
+                    deriv = np.empty(n_classes)
+                    chunk_start = start + chunk * PARALLEL_CHUNK_SIZE
+                    chunk_end = min(chunk_start + PARALLEL_CHUNK_SIZE, end)
+                    for idx in range(chunk_start, chunk_end):
+                        if col >= 0:
+                            i, x_ij = indices[idx], data[idx]
+                        else:
+                            i, x_ij = idx, 1.0
+                        deriv_loss(y[i], inner_products[i], deriv)
+                        for k in range(n_classes):
+                            chunk_sums[chunk, k] += deriv[k] * x_ij
+                add_chunk_sums(chunk_sums, n_samples, state)
+
+            return partial_deriv
+
+        else:
+
+            @jit(**jit_parallel_kwargs)
+            def partial_deriv(X, y, j, inner_products, state):
+                """Computes the partial derivative of the goodness-of-fit with
+                respect to coordinate `j`, given the value of the `inner_products` and
+                `state`, using several threads.
+
+                Parameters
+                ----------
+                X : numpy.ndarray
+                    A numpy array of shape (n_samples, n_features) containing the
+                    training samples.
+
+                y : numpy.ndarray
+                    A numpy array of shape (n_samples,) containing the targets.
+
+                j : int
+                    Partial derivative is with respect to this coordinate
+
+                inner_products : numpy.array
+                    A numpy array of shape (n_samples,), containing the inner
+                    products (decision function) X.dot(w) + b where w is the weights
+                    and b the (optional) intercept.
+
+                state : StateERM
+                    The state of the ERM estimator.
+
+                Returns
+                -------
+                output : float
+                    The value of the partial derivative
+                """
+                n_samples = X.shape[0]
+                col = j - int(fit_intercept)
+                n_chunks = (n_samples + PARALLEL_CHUNK_SIZE - 1) // PARALLEL_CHUNK_SIZE
+                chunk_sums = np.zeros((n_chunks, n_classes))
+                for chunk in prange(n_chunks):
+                    deriv = np.empty(n_classes)
+                    chunk_start = chunk * PARALLEL_CHUNK_SIZE
+                    chunk_end = min(chunk_start + PARALLEL_CHUNK_SIZE, n_samples)
+                    for i in range(chunk_start, chunk_end):
+                        deriv_loss(y[i], inner_products[i], deriv)
+                        x_ij = X[i, col] if col >= 0 else 1.0
+                        for k in range(n_classes):
+                            chunk_sums[chunk, k] += deriv[k] * x_ij
+                add_chunk_sums(chunk_sums, n_samples, state)
+
+            return partial_deriv
+
+    def _cached_partial_deriv_factory(self):
+        """Partial derivatives factory for losses with a costly derivative. The
+        returned function caches the loss derivative of each sample, and computes it
+        again only when the inner products of the sample changed since the last call.
+        Within a CGD cycle, this means that only the samples touched by the
+        coordinate updates (the whole dataset for non-zero updates of dense
+        features, the non-zero entries of the column for sparse ones) are computed
+        again.
+
+        Returns
+        -------
+        output : function
+            A jit-compiled function allowing to compute partial derivatives.
+        """
+        deriv_loss = self.loss.deriv_factory()
+        n_classes = self.n_classes
+        fit_intercept = self.fit_intercept
+
+        @jit(**jit_kwargs)
+        def fill_cache(y, inner_products, state):
+            sample_inner_products = state.sample_inner_products
+            sample_derivatives = state.sample_derivatives
+            for i in range(inner_products.shape[0]):
+                for k in range(n_classes):
+                    sample_inner_products[i, k] = inner_products[i, k]
+                deriv_loss(y[i], inner_products[i], sample_derivatives[i])
+            state.cache_filled[0] = True
+
+        if matrix_type(self.X) == "csc":
+
+            @jit(**jit_kwargs)
+            def partial_deriv(X, y, j, inner_products, state):
+                """Computes the partial derivative of the goodness-of-fit with
+                respect to coordinate `j`, given the value of the `inner_products` and
+                `state`, using only the non-zero entries of the column of `X` and the
+                cached loss derivatives.
+
+                Parameters
+                ----------
+                X : CSCMatrix
+                    The sparse CSC matrix of shape (n_samples, n_features) containing
+                    the training samples.
+
+                y : numpy.ndarray
+                    A numpy array of shape (n_samples,) containing the targets.
+
+                j : int
+                    Partial derivative is with respect to this coordinate
+
+                inner_products : numpy.array
+                    A numpy array of shape (n_samples,), containing the inner
+                    products (decision function) X.dot(w) + b where w is the weights
+                    and b the (optional) intercept.
+
+                state : StateERM
+                    The state of the ERM estimator, which contains the cache of loss
+                    derivatives.
+
+                Returns
+                -------
+                output : float
+                    The value of the partial derivative
+                """
+                n_samples = X.shape[0]
+                if not state.cache_filled[0]:
+                    fill_cache(y, inner_products, state)
+                sample_inner_products = state.sample_inner_products
+                sample_derivatives = state.sample_derivatives
+                deriv = state.loss_derivative
+                partial_derivative = state.partial_derivative
+                for k in range(n_classes):
+                    partial_derivative[k] = 0.0
+                if fit_intercept and j == 0:
+                    start, end = 0, n_samples
+                else:
+                    col = j - int(fit_intercept)
+                    start, end = X.indptr[col], X.indptr[col + 1]
+                indices, data = X.indices, X.data
+                for idx in range(start, end):
+                    if fit_intercept and j == 0:
+                        i, x_ij = idx, 1.0
+                    else:
+                        i, x_ij = indices[idx], data[idx]
+                    changed = False
+                    for k in range(n_classes):
+                        if sample_inner_products[i, k] != inner_products[i, k]:
+                            sample_inner_products[i, k] = inner_products[i, k]
+                            changed = True
+                    if changed:
+                        deriv_loss(y[i], inner_products[i], deriv)
+                        for k in range(n_classes):
+                            sample_derivatives[i, k] = deriv[k]
+                            partial_derivative[k] += deriv[k] * x_ij
+                    else:
+                        for k in range(n_classes):
+                            partial_derivative[k] += sample_derivatives[i, k] * x_ij
+                for k in range(n_classes):
+                    partial_derivative[k] /= n_samples
+
+            return partial_deriv
+
+        else:
+
+            @jit(**jit_kwargs)
+            def partial_deriv(X, y, j, inner_products, state):
+                """Computes the partial derivative of the goodness-of-fit with
+                respect to coordinate `j`, given the value of the `inner_products` and
+                `state`, using the cached loss derivatives.
+
+                Parameters
+                ----------
+                X : numpy.ndarray
+                    A numpy array of shape (n_samples, n_features) containing the
+                    training samples.
+
+                y : numpy.ndarray
+                    A numpy array of shape (n_samples,) containing the targets.
+
+                j : int
+                    Partial derivative is with respect to this coordinate
+
+                inner_products : numpy.array
+                    A numpy array of shape (n_samples,), containing the inner
+                    products (decision function) X.dot(w) + b where w is the weights
+                    and b the (optional) intercept.
+
+                state : StateERM
+                    The state of the ERM estimator, which contains the cache of loss
+                    derivatives.
+
+                Returns
+                -------
+                output : float
+                    The value of the partial derivative
+                """
+                n_samples = X.shape[0]
+                if not state.cache_filled[0]:
+                    fill_cache(y, inner_products, state)
+                sample_inner_products = state.sample_inner_products
+                sample_derivatives = state.sample_derivatives
+                deriv = state.loss_derivative
+                partial_derivative = state.partial_derivative
+                for k in range(n_classes):
+                    partial_derivative[k] = 0.0
+                col = j - int(fit_intercept)
+                for i in range(n_samples):
+                    changed = False
+                    for k in range(n_classes):
+                        if sample_inner_products[i, k] != inner_products[i, k]:
+                            sample_inner_products[i, k] = inner_products[i, k]
+                            changed = True
+                    x_ij = X[i, col] if col >= 0 else 1.0
+                    if changed:
+                        deriv_loss(y[i], inner_products[i], deriv)
+                        for k in range(n_classes):
+                            sample_derivatives[i, k] = deriv[k]
+                            partial_derivative[k] += deriv[k] * x_ij
+                    else:
+                        for k in range(n_classes):
+                            partial_derivative[k] += sample_derivatives[i, k] * x_ij
+                for k in range(n_classes):
+                    partial_derivative[k] /= n_samples
+
+            return partial_deriv
+
     def grad_factory(self):
         """Gradient factory. This returns a jit-compiled function allowing to
         compute the gradient of the considered goodness-of-fit.
@@ -189,23 +627,30 @@ class ERM(Estimator):
         output : function
             A jit-compiled function allowing to compute gradients.
         """
-        X = self.X
-        y = self.y
         loss = self.loss
         deriv_loss = loss.deriv_factory()
-        n_samples = self.n_samples
-        n_features = self.n_features
         n_classes = self.n_classes
+        # The gradient is X.T @ D / n_samples with D the loss derivatives of the
+        # samples, which are computed first
+        xt_dot = xt_dot_factory(self.X)
+        self._grad_state = True
 
         if self.fit_intercept:
 
             @jit(**jit_kwargs)
-            def grad(inner_products, state):
+            def grad(X, y, inner_products, state):
                 """Computes the gradient of the goodness-of-fit, given the value of the
                  `inner_products` and `state`.
 
                 Parameters
                 ----------
+                X : numpy.ndarray
+                    A numpy array of shape (n_samples, n_features) containing the
+                    training samples.
+
+                y : numpy.ndarray
+                    A numpy array of shape (n_samples,) containing the targets.
+
                 inner_products : numpy.array
                     A numpy array of shape (n_samples,), containing the inner
                     products (decision function) X.dot(w) + b where w is the weights
@@ -220,33 +665,45 @@ class ERM(Estimator):
                 output : numpy.array
                     A numpy array of shape (n_weights,) containing the gradient.
                 """
+                n_samples, n_features = X.shape
                 gradient = state.gradient
-                deriv = state.loss_derivative
-                for j in range(n_features + 1):
-                    for k in range(n_classes):
-                        gradient[j, k] = 0.0
+                deriv_samples = state.deriv_samples
+                gradient_transposed = state.gradient_transposed
+                if deriv_samples.shape[0] != n_samples:
+                    raise ValueError(
+                        "The state of ERM must be obtained after calling grad_factory"
+                    )
+                for k in range(n_classes):
+                    gradient[0, k] = 0.0
                 for i in range(n_samples):
-                    deriv_loss(y[i], inner_products[i], deriv)
+                    deriv_loss(y[i], inner_products[i], deriv_samples[i])
                     for k in range(n_classes):
-                        gradient[0, k] += deriv[k]
-                    for j in range(n_features):
-                        for k in range(n_classes):
-                            gradient[j + 1, k] += X[i, j] * deriv[k]
-                for j in range(n_features + 1):
+                        gradient[0, k] += deriv_samples[i, k]
+                xt_dot(X, deriv_samples, state.sample_blocks, gradient_transposed)
+                for k in range(n_classes):
+                    gradient[0, k] /= n_samples
+                for j in range(n_features):
                     for k in range(n_classes):
-                        gradient[j, k] /= n_samples
+                        gradient[j + 1, k] = gradient_transposed[0, k, j] / n_samples
                 return 0
 
             return grad
         else:
 
             @jit(**jit_kwargs)
-            def grad(inner_products, state):
+            def grad(X, y, inner_products, state):
                 """Computes the gradient of the goodness-of-fit, given the value of the
                  `inner_products` and `state`.
 
                 Parameters
                 ----------
+                X : numpy.ndarray
+                    A numpy array of shape (n_samples, n_features) containing the
+                    training samples.
+
+                y : numpy.ndarray
+                    A numpy array of shape (n_samples,) containing the targets.
+
                 inner_products : numpy.array
                     A numpy array of shape (n_samples,), containing the inner
                     products (decision function) X.dot(w) + b where w is the weights
@@ -261,20 +718,20 @@ class ERM(Estimator):
                 output : numpy.array
                     A numpy array of shape (n_weights,) containing the gradient.
                 """
+                n_samples, n_features = X.shape
                 gradient = state.gradient
-                deriv = state.loss_derivative
-                for j in range(n_features):
-                    for k in range(n_classes):
-                        gradient[j, k] = 0.0
-
+                deriv_samples = state.deriv_samples
+                gradient_transposed = state.gradient_transposed
+                if deriv_samples.shape[0] != n_samples:
+                    raise ValueError(
+                        "The state of ERM must be obtained after calling grad_factory"
+                    )
                 for i in range(n_samples):
-                    deriv_loss(y[i], inner_products[i], deriv)
-                    for j in range(n_features):
-                        for k in range(n_classes):
-                            gradient[j, k] += X[i, j] * deriv[k]
+                    deriv_loss(y[i], inner_products[i], deriv_samples[i])
+                xt_dot(X, deriv_samples, state.sample_blocks, gradient_transposed)
                 for j in range(n_features):
                     for k in range(n_classes):
-                        gradient[j, k] /= n_samples
+                        gradient[j, k] = gradient_transposed[0, k, j] / n_samples
                 return 0
 
             return grad
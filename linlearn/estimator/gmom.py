@@ -6,74 +6,212 @@
 This module implement the ``GMOM`` class for the geometric median-of-means robust
 estimator.
 
+The geometric median of the block means is computed by Weiszfeld iterations in
+preallocated arrays, starting from the median of the previous call (see
+``warm_geometric_median``), which barely moves in the late iterations of the solvers.
+
 ``StateGMOM`` is a place-holder for the GMOM estimator containing:
 
+    block_means : numpy.ndarray
+        A numpy array of shape (n_blocks, n_weights, n_classes) containing the means of
+        the sample gradients in the blocks.
+
+    sample_indices : numpy.ndarray
+        A numpy array of shape (n_samples,) containing the shuffled sample indices
+        defining the blocks.
+
+    sample_blocks : numpy.ndarray
+        A numpy array of shape (n_samples,) containing the blocks of the samples.
+
+    grads_sum_block : numpy.ndarray
+        A numpy array of shape (n_blocks, n_classes, n_features) containing the sums
+        of the products of the features with the loss derivatives in the blocks.
+
+    gradient : numpy.ndarray
+        A numpy array of shape (n_weights, n_classes) containing gradients computed by
+        the `grad` function returned by the `grad_factory` factory function.
+
+    loss_derivative : numpy.ndarray
+        A numpy array of shape (n_classes,) containing a loss derivative.
+
+    partial_derivative : numpy.ndarray
+        A numpy array of shape (n_classes,) containing a partial derivative.
+
+    deriv_samples : numpy.ndarray
+        A numpy array of shape (n_samples, n_classes) containing the loss derivatives
+        of the samples.
+
+    median : numpy.ndarray
+        A numpy array of shape (n_weights * n_classes,) containing the geometric median
+        of the block means at the last call.
+
+    median_previous : numpy.ndarray
+        A numpy array of shape (n_weights * n_classes,) containing the geometric median
+        of the block means at the call before the last one.
 
-    gradient: numpy.ndarray
-        A numpy array of shape (n_weights,) containing gradients computed by the
-        `grad` function returned by the `grad_factory` factory function.
+    median_new : numpy.ndarray
+        A numpy array of shape (n_weights * n_classes,) used by the Weiszfeld
+        iterations.
 
-    TODO: fill the missing things in StateCH
+    inv_dists : numpy.ndarray
+        A numpy array of shape (n_blocks,) containing the inverse distances of the
+        block means to the iterate of the Weiszfeld iterations.
+
+    median_shift : numpy.ndarray
+        A numpy array of shape (1,) containing the move of the geometric median at the
+        last call, which is negative before the first call.
 """
 
 from collections import namedtuple
 import numpy as np
+from math import sqrt
 from numba import jit
 from ._base import Estimator, jit_kwargs
-from .._utils import np_float
+from .._utils import np_float, xt_dot_factory
+
+# Tolerance of the Weiszfeld iterations, which is loosened to a fraction of the move of
+# the geometric median at the previous call, maximum number of iterations, and
+# distance below which a point is considered equal to the iterate
+WEISZFELD_TOL = 1e-4
+WEISZFELD_SHIFT_RATIO = 0.1
+MAX_WEISZFELD_ITER = 1000
+WEISZFELD_EPS = 1e-10
 
 
 @jit(**jit_kwargs)
-def gmom_njit(xs, tol=1e-4):
-    # from Vardi and Zhang 2000
+def weiszfeld(
+    xs, median, inv_dists, median_new, warm, tol, max_iter=MAX_WEISZFELD_ITER
+):
+    """Geometric median of the rows of xs, computed in place in median by the modified
+    Weiszfeld iterations of Vardi and Zhang (2000), which handle iterates equal to a
+    row. The iterations start from median if warm is True and from the mean of the
+    rows otherwise, and stop when the iterate moves by less than tol.
+
+    Parameters
+    ----------
+    xs : numpy.ndarray
+        A numpy array of shape (n_elem, n_dim) containing the points.
+
+    median : numpy.ndarray
+        A numpy array of shape (n_dim,) containing the starting point if warm is True,
+        and the geometric median in output.
+
+    inv_dists : numpy.ndarray
+        A numpy array of shape (n_elem,) used as scratch space.
+
+    median_new : numpy.ndarray
+        A numpy array of shape (n_dim,) used as scratch space.
+
+    warm : bool
+        If True, the iterations start from median.
+
+    tol : float
+        Tolerance on the moves of the iterates.
+
+    max_iter : int
+        Maximum number of iterations.
+
+    Returns
+    -------
+    output : int
+        The number of iterations
+    """
     n_elem, n_dim = xs.shape
-    # TODO : avoid the memory allocations in this function
-    y = np.zeros(n_dim)
-    dists = np.zeros(n_elem)
-    inv_dists = np.zeros(n_elem)
+    if not warm:
+        for j in range(n_dim):
+            median[j] = 0.0
+        for i in range(n_elem):
+            for j in range(n_dim):
+                median[j] += xs[i, j]
+        for j in range(n_dim):
+            median[j] /= n_elem
 
-    xsy = np.zeros_like(xs)
-    for i in range(n_elem):
-        y += xs[i]
-    y /= n_elem
-    eps = 1e-10
-    delta = 1
-    niter = 0
-    while delta > tol:
-        xsy[:] = xs - y
-        dists.fill(0.0)
+    n_iter = 0
+    while n_iter < max_iter:
+        n_iter += 1
+        n_too_close = 0
+        sum_inv_dists = 0.0
+        for i in range(n_elem):
+            dist = 0.0
+            for j in range(n_dim):
+                diff = xs[i, j] - median[j]
+                dist += diff * diff
+            dist = sqrt(dist)
+            if dist < WEISZFELD_EPS:
+                inv_dists[i] = 0.0
+                n_too_close += 1
+            else:
+                inv_dists[i] = 1.0 / dist
+                sum_inv_dists += inv_dists[i]
+        if sum_inv_dists == 0.0:
+            # All the rows are at the iterate
+            break
+
+        # The Weiszfeld step, and the norm of the sum of the unit vectors from the
+        # iterate to the rows
         for j in range(n_dim):
-            dists[:] += xsy[:, j] * xsy[:, j]  # np.linalg.norm(xsy, axis=1)
+            median_new[j] = 0.0
         for i in range(n_elem):
-            dists[i] = np.sqrt(dists[i])
-
-        # dists[:] = euclidean_numba1(xs, [y]).flatten()
-        mask = dists < eps
-        nmask = np.logical_not(mask)
-        inv_dists[nmask] = 1 / dists[nmask]
-        # print("pass2")
-        inv_dists[mask] = 0
-        nb_too_close = mask.sum()
-        ry = np.sqrt(
-            np.sum(np.dot(inv_dists, xsy) ** 2)
-        )  # np.linalg.norm(np.dot(inv_dists, xsy))
-        if ry == 0:
+            inv_dist = inv_dists[i]
+            if inv_dist > 0.0:
+                for j in range(n_dim):
+                    median_new[j] += inv_dist * xs[i, j]
+        norm_r = 0.0
+        for j in range(n_dim):
+            median_new[j] /= sum_inv_dists
+            r_j = (median_new[j] - median[j]) * sum_inv_dists
+            norm_r += r_j * r_j
+        norm_r = sqrt(norm_r)
+        if norm_r == 0.0:
             break
 
-        cst = nb_too_close / ry
-        sum_inv_dists = np.sum(inv_dists)
-        if sum_inv_dists == 0:
-            raise ValueError
-        y_new = (
-            max(0, 1 - cst) * np.dot(inv_dists, xs) / sum_inv_dists
-            + min(1, cst) * y
-        )
+        cst = n_too_close / norm_r
+        delta = 0.0
+        for j in range(n_dim):
+            m_j = max(0.0, 1.0 - cst) * median_new[j] + min(1.0, cst) * median[j]
+            diff = m_j - median[j]
+            delta += diff * diff
+            median[j] = m_j
+        if sqrt(delta) <= tol:
+            break
+
+    return n_iter
+
 
-        delta = np.sqrt(np.sum((y - y_new) ** 2))  # np.linalg.norm(y - y_new)
-        y = y_new
-        niter += 1
+@jit(**jit_kwargs)
+def warm_geometric_median(block_means, state):
+    """Computes the geometric median of the block means in state.gradient, starting
+    from the median of the previous call. The tolerance of the Weiszfeld iterations is
+    loosened to a fraction of the move of the median at the previous call, so that the
+    median is computed more precisely as the solver converges.
+
+    Returns
+    -------
+    output : int
+        The number of inner products computed
+    """
+    n_blocks = block_means.shape[0]
+    xs = block_means.reshape((n_blocks, -1))
+    median = state.median
+    median_previous = state.median_previous
+    shift = state.median_shift[0]
+    warm = shift >= 0.0
+    tol = WEISZFELD_TOL
+    if warm:
+        tol = max(tol, WEISZFELD_SHIFT_RATIO * shift)
+        median_previous[:] = median
+    n_iter = weiszfeld(xs, median, state.inv_dists, state.median_new, warm, tol)
+    if warm:
+        shift = 0.0
+        for j in range(median.shape[0]):
+            diff = median[j] - median_previous[j]
+            shift += diff * diff
+        state.median_shift[0] = sqrt(shift)
+    else:
+        state.median_shift[0] = 0.0
+    state.gradient[:] = median.reshape(state.gradient.shape)
+    return n_iter * (n_blocks + 1)
 
-    return y, niter * (n_elem + 1)
 
 @jit(**jit_kwargs)
 def gmom_njit2(X, tol=1e-5):
@@ -119,10 +257,17 @@ StateGMOM = namedtuple(
     [
         "block_means",
         "sample_indices",
+        "sample_blocks",
         "grads_sum_block",
         "gradient",
         "loss_derivative",
         "partial_derivative",
+        "deriv_samples",
+        "median",
+        "median_previous",
+        "median_new",
+        "inv_dists",
+        "median_shift",
     ],
 )
 
@@ -139,6 +284,7 @@ class GMOM(Estimator):
             self.n_blocks += 1
 
     def get_state(self):
+        n_dim = (self.n_features + int(self.fit_intercept)) * self.n_classes
         return StateGMOM(
             block_means=np.empty(
                 (
@@ -146,12 +292,15 @@ class GMOM(Estimator):
                     self.n_features + int(self.fit_intercept),
                     self.n_classes,
                 ),
-                dtype=np_float,
+                dtype=self.X.dtype,
             ),
             sample_indices=np.arange(self.n_samples, dtype=np.uintp),
+            sample_blocks=np.empty(self.n_samples, dtype=np.uintp),
             grads_sum_block=np.empty(
-                (self.n_features + int(self.fit_intercept), self.n_classes),
-                dtype=np_float,
+                (self.n_blocks, self.n_classes, self.n_features), dtype=np_float
+            ),
+            deriv_samples=np.empty(
+                (self.n_samples, self.n_classes), dtype=self.X.dtype
             ),
             gradient=np.empty(
                 (self.n_features + int(self.fit_intercept), self.n_classes),
@@ -159,6 +308,12 @@ class GMOM(Estimator):
             ),
             loss_derivative=np.empty(self.n_classes, dtype=np_float),
             partial_derivative=np.empty(self.n_classes, dtype=np_float),
+            median=np.empty(n_dim, dtype=np_float),
+            median_previous=np.empty(n_dim, dtype=np_float),
+            median_new=np.empty(n_dim, dtype=np_float),
+            inv_dists=np.empty(self.n_blocks, dtype=np_float),
+            # A negative shift means that there is no previous median
+            median_shift=-np.ones(1, dtype=np_float),
         )
 
     def partial_deriv_factory(self):
@@ -167,121 +322,83 @@ class GMOM(Estimator):
         )
 
     def grad_factory(self):
-        X = self.X
-        y = self.y
         loss = self.loss
         deriv_loss = loss.deriv_factory()
         n_samples_in_block = self.n_samples_in_block
         n_classes = self.n_classes
-        n_features = self.n_features
-        n_blocks = self.n_blocks
         last_block_size = self.last_block_size
+        # The sums of the sample gradients in the blocks are the blocks of X.T @ D,
+        # with D the loss derivatives of the samples
+        xt_dot = xt_dot_factory(self.X)
 
         if self.fit_intercept:
 
             @jit(**jit_kwargs)
-            def grad(inner_products, state):
+            def grad(X, y, inner_products, state):
+                n_samples, n_features = X.shape
                 sample_indices = state.sample_indices
+                sample_blocks = state.sample_blocks
                 block_means = state.block_means
-                gradient = state.gradient
-                # Cumulative sum in the block
+                deriv_samples = state.deriv_samples
                 grads_sum_block = state.grads_sum_block
-                # for i in range(n_samples):
-                #     sample_indices[i] = i
+                n_blocks = block_means.shape[0]
 
                 np.random.shuffle(sample_indices)
-                for j in range(n_features + 1):
+                for i in range(n_samples):
+                    sample_blocks[sample_indices[i]] = i // n_samples_in_block
+                for b in range(n_blocks):
                     for k in range(n_classes):
-                        grads_sum_block[j, k] = 0.0
-                # Block counter
-                counter = 0
-                deriv = state.loss_derivative
-                for i, idx in enumerate(sample_indices):
-                    deriv_loss(y[idx], inner_products[idx], deriv)
-
+                        block_means[b, 0, k] = 0.0
+                for i in range(n_samples):
+                    deriv_loss(y[i], inner_products[i], deriv_samples[i])
+                    b = sample_blocks[i]
+                    for k in range(n_classes):
+                        block_means[b, 0, k] += deriv_samples[i, k]
+                xt_dot(X, deriv_samples, sample_blocks, grads_sum_block)
+
+                for b in range(n_blocks):
+                    if b == n_blocks - 1 and last_block_size != 0:
+                        block_size = last_block_size
+                    else:
+                        block_size = n_samples_in_block
                     for k in range(n_classes):
-                        grads_sum_block[0, k] += deriv[k]
+                        block_means[b, 0, k] /= block_size
                         for j in range(n_features):
-                            grads_sum_block[j + 1, k] += (
-                                X[idx, j] * deriv[k]
-                            )  # np.outer(X[idx], deriv)
-
-                    if ((i != 0) and ((i + 1) % n_samples_in_block == 0)) or n_samples_in_block == 1:
-
-                        for j in range(n_features + 1):
-                            for k in range(n_classes):
-                                block_means[counter, j, k] = (
-                                    grads_sum_block[j, k] / n_samples_in_block
-                                )
-                                grads_sum_block[j, k] = 0.0
-                        counter += 1
-
-                if last_block_size != 0:
-                    for j in range(n_features + 1):
-                        for k in range(n_classes):
-                            block_means[counter, j, k] = (
-                                grads_sum_block[j, k] / last_block_size
+                            block_means[b, j + 1, k] = (
+                                grads_sum_block[b, k, j] / block_size
                             )
 
-                # TODO : possible optimizations in the next line by rewriting gmom_njit with out parameter
-                #  and preallocated place holders ...
-                gmom_grad, sc_prods = gmom_njit(block_means.reshape((n_blocks, -1)))
-                gradient[:] = gmom_grad.reshape(
-                    block_means.shape[1:]
-                )
-
-                return sc_prods
+                return warm_geometric_median(block_means, state)
 
             return grad
         else:
 
             @jit(**jit_kwargs)
-            def grad(inner_products, state):
+            def grad(X, y, inner_products, state):
+                n_samples, n_features = X.shape
                 sample_indices = state.sample_indices
+                sample_blocks = state.sample_blocks
                 block_means = state.block_means
-                gradient = state.gradient
-                # Cumulative sum in the block
+                deriv_samples = state.deriv_samples
                 grads_sum_block = state.grads_sum_block
-                # for i in range(n_samples):
-                #     sample_indices[i] = i
+                n_blocks = block_means.shape[0]
 
                 np.random.shuffle(sample_indices)
-                # Cumulative sum in the block
-                for j in range(n_features):
+                for i in range(n_samples):
+                    sample_blocks[sample_indices[i]] = i // n_samples_in_block
+                for i in range(n_samples):
+                    deriv_loss(y[i], inner_products[i], deriv_samples[i])
+                xt_dot(X, deriv_samples, sample_blocks, grads_sum_block)
+
+                for b in range(n_blocks):
+                    if b == n_blocks - 1 and last_block_size != 0:
+                        block_size = last_block_size
+                    else:
+                        block_size = n_samples_in_block
                     for k in range(n_classes):
-                        grads_sum_block[j, k] = 0.0
-                # Block counter
-                counter = 0
-                deriv = state.loss_derivative
-                for i, idx in enumerate(sample_indices):
-                    deriv_loss(y[idx], inner_products[idx], deriv)
-                    for j in range(n_features):
-                        for k in range(n_classes):
-                            grads_sum_block[j, k] += X[idx, j] * deriv[k]
-
-                    if (i != 0) and ((i + 1) % n_samples_in_block == 0):
                         for j in range(n_features):
-                            for k in range(n_classes):
-                                block_means[counter, j, k] = (
-                                    grads_sum_block[j, k] / n_samples_in_block
-                                )
-                                grads_sum_block[j, k] = 0.0
-                        counter += 1
-
-                if last_block_size != 0:
-                    for j in range(n_features):
-                        for k in range(n_classes):
-                            block_means[counter, j, k] = (
-                                grads_sum_block[j, k] / last_block_size
-                            )
-
-                # TODO : possible optimizations in the next line by rewriting gmom_njit with out parameter
-                #  and preallocated place holders ...
-                gmom_grad, sc_prods = gmom_njit(block_means.reshape((n_blocks, -1)))
+                            block_means[b, j, k] = grads_sum_block[b, k, j] / block_size
 
-                gradient[:] = gmom_grad.reshape(
-                    block_means.shape[1:]
-                )
-                return sc_prods
+                return warm_geometric_median(block_means, state)
 
             return grad
@@ -5,7 +5,7 @@
 
 from collections import namedtuple
 import numpy as np
-from numba import jit, prange
+from numba import jit
 from ._base import Estimator, jit_kwargs
 from .._utils import np_float
 from math import ceil
@@ -14,7 +14,7 @@ from math import ceil
 StateHG = namedtuple(
     "StateHG",
     [
-        "sample_gradients",
+        "deriv_samples",
         "gradient",
         "loss_derivative",
         "partial_derivative",
@@ -97,6 +97,189 @@ def alg2(X, eps, delta=0.01):
     return est
 
 
+@jit(**jit_kwargs)
+def ssi_mean(samples, eps, delta):
+    """Mean of the smallest interval containing a (1 - eps) fraction of the samples,
+    namely the one-dimensional case of alg2. The samples are sorted in place."""
+    n = samples.shape[0]
+    samples_tilde = SSI(
+        samples,
+        max(2, ceil(n * (1 - eps - C5 * np.sqrt(np.log(n / delta) / n)) * (1 - eps))),
+    )
+    return np.mean(samples_tilde)
+
+
+# Number of sample gradients formed at once, and number of directions on which they are
+# projected at once, when computing the statistics needed by alg2_rank_one
+CHUNK_SIZE = 256
+N_DIRECTIONS = 8
+
+
+@jit(**jit_kwargs)
+def sample_gradients_chunk(X, deriv_samples, fit_intercept, indices, out):
+    """Forms the sample gradients x_i deriv_samples[i]^T (x_i being preceded by 1 when
+    fit_intercept is True) of the samples in indices, flattened in the rows of out."""
+    n_features = X.shape[1]
+    n_classes = deriv_samples.shape[1]
+    for r in range(indices.shape[0]):
+        i = indices[r]
+        for j in range(n_features + int(fit_intercept)):
+            x_ij = X[i, j - int(fit_intercept)] if j >= int(fit_intercept) else 1.0
+            for k in range(n_classes):
+                out[r, j * n_classes + k] = x_ij * deriv_samples[i, k]
+
+
+@jit(**jit_kwargs)
+def project_sample_gradients(X, deriv_samples, fit_intercept, indices, directions, out):
+    """Computes the inner products between the sample gradients of the samples in
+    indices and the columns of directions, by chunks of CHUNK_SIZE samples."""
+    n = indices.shape[0]
+    chunk = np.empty((min(n, CHUNK_SIZE), directions.shape[0]))
+    for start in range(0, n, CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, n)
+        sample_gradients_chunk(
+            X, deriv_samples, fit_intercept, indices[start:end], chunk
+        )
+        out[start:end] = chunk[: end - start] @ directions
+
+
+@jit(**jit_kwargs)
+def sample_gradients_moments(X, deriv_samples, fit_intercept, indices, mean, gram):
+    """Computes the mean and, if gram is not empty, the uncentered second moment
+    matrix of the sample gradients of the samples in indices, by chunks of CHUNK_SIZE
+    samples."""
+    n = indices.shape[0]
+    with_gram = gram.shape[0] > 0
+    chunk = np.empty((min(n, CHUNK_SIZE), mean.shape[0]))
+    mean.fill(0.0)
+    if with_gram:
+        gram.fill(0.0)
+    for start in range(0, n, CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, n)
+        sample_gradients_chunk(
+            X, deriv_samples, fit_intercept, indices[start:end], chunk
+        )
+        mean += chunk[: end - start].sum(axis=0)
+        if with_gram:
+            gram += chunk[: end - start].T @ chunk[: end - start]
+    mean /= n
+
+
+@jit(**jit_kwargs)
+def alg2_rank_one(X, deriv_samples, fit_intercept, eps, delta=0.01):
+    """Computes alg2 on the sample gradients x_i deriv_samples[i]^T (x_i being
+    preceded by 1 when fit_intercept is True) without storing them. The recursion of
+    alg2 is unrolled and its successive projections are kept as an orthonormal basis
+    of the remaining directions, so that the coordinates, covariances and means it
+    needs are computed from X and deriv_samples directly. Peak memory is
+    O(n_samples * (n_classes + N_DIRECTIONS) + (n_weights * n_classes)^2).
+
+    Parameters
+    ----------
+    X : numpy.ndarray
+        Features matrix of shape (n_samples, n_features).
+
+    deriv_samples : numpy.ndarray
+        Loss derivatives of shape (n_samples, n_classes).
+
+    fit_intercept : bool
+        Whether the sample gradients contain the derivatives w.r.t. the intercept.
+
+    eps : float
+        Fraction of corrupted samples.
+
+    delta : float, default=0.01
+        Confidence level.
+
+    Returns
+    -------
+    output : numpy.ndarray
+        The estimated gradient of shape (n_weights * n_classes,), with the same
+        layout as alg2 applied to the flattened sample gradients.
+    """
+    n_samples, n_features = X.shape
+    n_classes = deriv_samples.shape[1]
+    n_weights = n_features + int(fit_intercept)
+    p = n_weights * n_classes
+    indices = np.arange(n_samples)
+    basis = np.eye(p)
+    estimate = np.zeros(p)
+    mean = np.empty(p)
+    gram = np.empty((p, p))
+    no_gram = np.empty((0, 0))
+    coordinates = np.empty((n_samples, N_DIRECTIONS))
+    sorted_coordinates = np.empty(n_samples)
+    dists = np.empty(n_samples)
+    level = 0
+
+    while True:
+        n = indices.shape[0]
+        q = basis.shape[1]
+        if q == 1:
+            project_sample_gradients(
+                X, deriv_samples, fit_intercept, indices, basis, coordinates[:, :1]
+            )
+            location = ssi_mean(coordinates[:n, 0], eps, delta)
+            for j in range(p):
+                estimate[j] += location * basis[j, 0]
+            return estimate
+
+        # Keep the samples closest to the coordinatewise robust means
+        dists[:n] = 0.0
+        for c_start in range(0, q, N_DIRECTIONS):
+            c_end = min(c_start + N_DIRECTIONS, q)
+            if level == 0:
+                # The basis is the canonical one, coordinates are the sample gradients
+                for r in range(n):
+                    i = indices[r]
+                    for c in range(c_start, c_end):
+                        j = c // n_classes
+                        x_ij = (
+                            X[i, j - int(fit_intercept)]
+                            if j >= int(fit_intercept)
+                            else 1.0
+                        )
+                        coordinates[r, c - c_start] = (
+                            x_ij * deriv_samples[i, c % n_classes]
+                        )
+            else:
+                project_sample_gradients(
+                    X,
+                    deriv_samples,
+                    fit_intercept,
+                    indices,
+                    np.ascontiguousarray(basis[:, c_start:c_end]),
+                    coordinates[:, : c_end - c_start],
+                )
+            for c in range(c_end - c_start):
+                sorted_coordinates[:n] = coordinates[:n, c]
+                a_c = ssi_mean(sorted_coordinates[:n], eps, delta / q)
+                for r in range(n):
+                    dists[r] += (coordinates[r, c] - a_c) ** 2
+        n_tilde = ceil(
+            n * (1 - eps - C(q) * np.sqrt(np.log(n / (q * delta)) * q / n)) * (1 - eps)
+        )
+        indices_tilde = indices[np.argsort(dists[:n])[:n_tilde]]
+
+        # Covariance of the current samples in the current basis
+        sample_gradients_moments(X, deriv_samples, fit_intercept, indices, mean, gram)
+        centered = (gram - n * np.outer(mean, mean)) / (n - 1)
+        S = basis.T @ centered @ basis
+        _, V = np.linalg.eigh(S)
+
+        # Plain mean of the kept samples along the directions of smallest variance
+        sample_gradients_moments(
+            X, deriv_samples, fit_intercept, indices_tilde, mean, no_gram
+        )
+        PV = basis @ np.ascontiguousarray(V[:, : q // 2])
+        estimate += PV @ (PV.T @ mean)
+
+        # Recursion on the kept samples along the directions of largest variance
+        basis = basis @ np.ascontiguousarray(V[:, q // 2 :])
+        indices = indices_tilde
+        level += 1
+
+
 class HG(Estimator):
     def __init__(self, X, y, loss, n_classes, fit_intercept, delta=0.01, eps=0.01):
         super().__init__(X, y, loss, n_classes, fit_intercept)
@@ -106,9 +289,8 @@ class HG(Estimator):
 
     def get_state(self):
         return StateHG(
-            sample_gradients=np.empty(
-                (self.n_samples, self.n_features + int(self.fit_intercept), self.n_classes),
-                dtype=np_float,
+            deriv_samples=np.empty(
+                (self.n_samples, self.n_classes), dtype=self.X.dtype
             ),
             gradient=np.empty(
                 (self.n_features + int(self.fit_intercept), self.n_classes),
@@ -124,50 +306,23 @@ class HG(Estimator):
         )
 
     def grad_factory(self):
-        X = self.X
-        y = self.y
         loss = self.loss
         deriv_loss = loss.deriv_factory()
-        n_samples = self.n_samples
-        n_classes = self.n_classes
-        n_features = self.n_features
+        fit_intercept = self.fit_intercept
         eps = self.eps
         delta = self.delta
 
-        if self.fit_intercept:
-
-            @jit(**jit_kwargs)
-            def grad(inner_products, state):
-                gradient = state.gradient
-                sample_gradients = state.sample_gradients
-                deriv = state.loss_derivative
-                for i in prange(n_samples):
-                    deriv_loss(y[i], inner_products[i], deriv)
-                    for k in range(n_classes):
-                        sample_gradients[i, 0, k] = deriv[k]
-                    for j in range(n_features):
-                        for k in range(n_classes):
-                            sample_gradients[i, j + 1, k] = X[i, j] * deriv[k]
-
-                gradient[:] = alg2(sample_gradients.reshape((n_samples, -1)), 2*eps, delta).reshape((gradient.shape))
-                return 0
-
-            return grad
-        else:
-
-            @jit(**jit_kwargs)
-            def grad(inner_products, state):
-
-                gradient = state.gradient
-                sample_gradients = state.sample_gradients
-                deriv = state.loss_derivative
-                for i in prange(n_samples):
-                    deriv_loss(y[i], inner_products[i], deriv)
-                    for j in range(n_features):
-                        for k in range(n_classes):
-                            sample_gradients[i, j, k] = X[i, j] * deriv[k]
-
-                gradient[:] = alg2(sample_gradients.reshape((n_samples, -1)), 2*eps, delta).reshape((gradient.shape))
-                return 0
-
-            return grad
+        @jit(**jit_kwargs)
+        def grad(X, y, inner_products, state):
+            n_samples = X.shape[0]
+            gradient = state.gradient
+            deriv_samples = state.deriv_samples
+            for i in range(n_samples):
+                deriv_loss(y[i], inner_products[i], deriv_samples[i])
+
+            gradient[:] = alg2_rank_one(
+                X, deriv_samples, fit_intercept, 2 * eps, delta
+            ).reshape(gradient.shape)
+            return 0
+
+        return grad
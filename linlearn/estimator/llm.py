@@ -6,40 +6,51 @@
 This module implement the ``LLM`` class for the Lecué - Lerasle - Mathieu robust
 estimator.
 
+The block with the median objective is selected by ``argmedian``, a quickselect
+which does not allocate memory.
+
 ``StateLLM`` is a place-holder for the LLM estimator containing:
 
-    gradient: numpy.ndarray
-        A numpy array of shape (n_weights,) containing gradients computed by the
-        `grad` function returned by the `grad_factory` factory function.
+    block_means : numpy.ndarray
+        A numpy array of shape (n_blocks,) containing the means of the objectives in
+        the blocks.
+
+    block_indices : numpy.ndarray
+        A numpy array of shape (n_blocks,) used by ``argmedian``.
+
+    sample_indices : numpy.ndarray
+        A numpy array of shape (n_samples,) containing the shuffled sample indices
+        defining the blocks.
+
+    gradient : numpy.ndarray
+        A numpy array of shape (n_weights, n_classes) containing gradients computed by
+        the `grad` function returned by the `grad_factory` factory function.
+
+    loss_derivative : numpy.ndarray
+        A numpy array of shape (n_classes,) containing a loss derivative.
 
-    TODO: fill the missing things
+    partial_derivative : numpy.ndarray
+        A numpy array of shape (n_classes,) containing a partial derivative.
+
+    n_grad_calls : int
+        Unused counter of the calls to `grad`.
+
+    n_pderiv_calls : int
+        Unused counter of the calls to `partial_deriv`.
 """
 
 from collections import namedtuple
 import numpy as np
 from numba import jit
 from ._base import Estimator, jit_kwargs
-from .._utils import np_float
-
-
-# Better implementation of argmedian ??
-@jit(**jit_kwargs)
-def argmedian(x):
-    med = np.median(x)
-    id = 0
-    for a in x:
-        if a == med:
-            return id
-        id += 1
-    raise ValueError("Failed argmedian")
-
-    # return np.argpartition(x, len(x) // 2)[len(x) // 2]
+from .._utils import np_float, argmedian
 
 
 StateLLM = namedtuple(
     "StateLLM",
     [
         "block_means",
+        "block_indices",
         "sample_indices",
         "gradient",
         "loss_derivative",
@@ -58,7 +69,7 @@ class LLM(Estimator):
         self.n_blocks = n_blocks + ((n_blocks + 1) % 2)
         if self.n_blocks >= self.n_samples:
             self.n_blocks = self.n_samples - (self.n_samples % 2 + 1)
-        self.n_samples_in_block = max(1, self.n_samples // n_blocks)
+        self.n_samples_in_block = max(1, self.n_samples // self.n_blocks)
         # no last block size, the remaining samples are just ignored
         # self.last_block_size = self.n_samples % self.n_samples_in_block
         # if self.last_block_size > 0:
@@ -67,6 +78,7 @@ class LLM(Estimator):
     def get_state(self):
         return StateLLM(
             block_means=np.empty(self.n_blocks, dtype=np_float),
+            block_indices=np.empty(self.n_blocks, dtype=np.uintp),
             sample_indices=np.arange(self.n_samples, dtype=np.uintp),
             gradient=np.empty(
                 (self.n_features + int(self.fit_intercept), self.n_classes),
@@ -79,8 +91,6 @@ class LLM(Estimator):
         )
 
     def partial_deriv_factory(self):
-        X = self.X
-        y = self.y
         n_samples_in_block = self.n_samples_in_block
         n_blocks = self.n_blocks
         loss = self.loss
@@ -91,7 +101,7 @@ class LLM(Estimator):
         if self.fit_intercept:
 
             @jit(**jit_kwargs)
-            def partial_deriv(j, inner_products, state):
+            def partial_deriv(X, y, j, inner_products, state):
                 sample_indices = state.sample_indices
                 n_calls = state.n_pderiv_calls
                 n_calls += 1
@@ -109,7 +119,7 @@ class LLM(Estimator):
                         counter += 1
                         objectives_sum_block = 0.0
 
-                argmed = argmedian(block_means)
+                argmed = argmedian(block_means, state.block_indices)
 
                 deriv = state.loss_derivative
                 partial_derivative = state.partial_derivative
@@ -139,7 +149,7 @@ class LLM(Estimator):
         else:
             # Same function without an intercept
             @jit(**jit_kwargs)
-            def partial_deriv(j, inner_products, state):
+            def partial_deriv(X, y, j, inner_products, state):
                 sample_indices = state.sample_indices
                 n_calls = state.n_pderiv_calls
                 n_calls += 1
@@ -157,7 +167,7 @@ class LLM(Estimator):
                         counter += 1
                         objectives_sum_block = 0.0
 
-                argmed = argmedian(block_means)
+                argmed = argmedian(block_means, state.block_indices)
 
                 deriv = state.loss_derivative
                 partial_derivative = state.partial_derivative
@@ -176,20 +186,18 @@ class LLM(Estimator):
             return partial_deriv
 
     def grad_factory(self):
-        X = self.X
-        y = self.y
         loss = self.loss
         value_loss = loss.value_factory()
         deriv_loss = loss.deriv_factory()
         n_samples_in_block = self.n_samples_in_block
         n_blocks = self.n_blocks
         n_classes = self.n_classes
-        n_features = self.n_features
 
         if self.fit_intercept:
 
             @jit(**jit_kwargs)
-            def grad(inner_products, state):
+            def grad(X, y, inner_products, state):
+                n_features = X.shape[1]
                 sample_indices = state.sample_indices
                 n_calls = state.n_grad_calls
                 n_calls += 1
@@ -210,7 +218,7 @@ class LLM(Estimator):
                         counter += 1
                         objectives_sum_block = 0.0
 
-                argmed = argmedian(block_means)
+                argmed = argmedian(block_means, state.block_indices)
 
                 for j in range(n_features + 1):
                     for k in range(n_classes):
@@ -237,7 +245,8 @@ class LLM(Estimator):
         else:
 
             @jit(**jit_kwargs)
-            def grad(inner_products, state):
+            def grad(X, y, inner_products, state):
+                n_features = X.shape[1]
                 sample_indices = state.sample_indices
                 n_calls = state.n_grad_calls
                 n_calls += 1
@@ -258,7 +267,7 @@ class LLM(Estimator):
                         counter += 1
                         objectives_sum_block = 0.0
 
-                argmed = argmedian(block_means)
+                argmed = argmedian(block_means, state.block_indices)
 
                 for j in range(n_features):
                     for k in range(n_classes):
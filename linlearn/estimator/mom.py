@@ -15,6 +15,19 @@ This module implement the ``MOM`` class for the median-of-means robust estimator
         A numpy array of shape (n_samples,) containing the shuffled indices
         corresponding to the block samples.
 
+    sample_blocks : numpy.ndarray
+        A numpy array of shape (n_samples,) containing the block of each sample, when
+        blocks are kept for several partial derivatives or when the block sums are
+        computed in parallel (empty otherwise).
+
+    block_samples : numpy.ndarray
+        A numpy array of shape (n_samples,) containing the samples grouped by block,
+        when the block sums are computed in parallel (empty otherwise).
+
+    n_calls : numpy.ndarray
+        A numpy array of shape (1,) counting the calls to `partial_deriv`, which
+        tells when the blocks must be drawn again.
+
     gradient : numpy.ndarray
         A numpy array of shape (n_weights,) containing gradients computed by the
         `grad` function returned by the `grad_factory` factory function.
@@ -22,9 +35,9 @@ This module implement the ``MOM`` class for the median-of-means robust estimator
 
 from collections import namedtuple
 import numpy as np
-from numba import jit
-from ._base import Estimator, jit_kwargs
-from .._utils import np_float, fast_median
+from numba import jit, prange
+from ._base import Estimator, jit_kwargs, jit_parallel_kwargs
+from .._utils import np_float, fast_median, matrix_type
 
 
 StateMOM = namedtuple(
@@ -32,6 +45,9 @@ StateMOM = namedtuple(
     [
         "block_means",
         "sample_indices",
+        "sample_blocks",
+        "block_samples",
+        "n_calls",
         "gradient",
         "loss_derivative",
         "partial_derivative",
@@ -66,6 +82,17 @@ class MOM(Estimator):
         Number of samples used in the blocks. Note that the last block can be smaller
         than that.
 
+    block_resampling : {'coordinate', 'epoch'} or int, default='coordinate'
+        When the blocks are drawn again. If 'coordinate', new blocks are used for
+        each partial derivative. If 'epoch', the blocks are kept during an epoch
+        (``n_weights`` partial derivatives, namely a CGD cycle or a full gradient),
+        and an integer k keeps them during k epochs. Keeping the blocks allows the
+        partial derivatives to stream the samples in their original order.
+
+    parallel : bool, default=False
+        If True, the block sums of dense features are computed in parallel, one
+        block per thread at a time.
+
     Attributes
     ----------
     n_samples : int
@@ -82,15 +109,35 @@ class MOM(Estimator):
 
     last_block_size : int
         Size of the last block
+
+    resampling_period : int
+        Number of calls to `partial_deriv` between two draws of the blocks.
     """
 
-    def __init__(self, X, y, loss, n_classes, fit_intercept, n_samples_in_block):
-        super().__init__(X, y, loss, n_classes, fit_intercept)
+    def __init__(
+        self,
+        X,
+        y,
+        loss,
+        n_classes,
+        fit_intercept,
+        n_samples_in_block,
+        block_resampling="coordinate",
+        parallel=False,
+    ):
+        super().__init__(X, y, loss, n_classes, fit_intercept, parallel)
         self.n_samples_in_block = n_samples_in_block
         self.n_blocks = self.n_samples // n_samples_in_block
         self.last_block_size = self.n_samples % n_samples_in_block
         if self.last_block_size > 0:
             self.n_blocks += 1
+        self.block_resampling = block_resampling
+        if block_resampling == "coordinate":
+            self.resampling_period = 1
+        elif block_resampling == "epoch":
+            self.resampling_period = self.n_weights
+        else:
+            self.resampling_period = block_resampling * self.n_weights
 
     def get_state(self):
         """Returns the state of the MOM estimator, which is a place-holder used for
@@ -102,11 +149,18 @@ class MOM(Estimator):
             State of the MOM estimator
         """
 
+        grouped = self.parallel and matrix_type(self.X) != "csc"
         return StateMOM(
             block_means=np.empty(
                 (self.n_blocks, self.n_classes), dtype=np_float, order="F"
             ),
             sample_indices=np.arange(self.n_samples, dtype=np.intp),
+            sample_blocks=np.empty(
+                self.n_samples if self.resampling_period > 1 or grouped else 0,
+                dtype=np.intp,
+            ),
+            block_samples=np.empty(self.n_samples if grouped else 0, dtype=np.intp),
+            n_calls=np.zeros(1, dtype=np.intp),
             gradient=np.empty(
                 (self.n_features + int(self.fit_intercept), self.n_classes),
                 dtype=np_float,
@@ -124,24 +178,92 @@ class MOM(Estimator):
         output : function
             A jit-compiled function allowing to compute partial derivatives.
         """
-        X = self.X
-        y = self.y
         deriv_loss = self.loss.deriv_factory()
         n_classes = self.n_classes
         n_samples_in_block = self.n_samples_in_block
         last_block_size = self.last_block_size
         n_blocks = self.n_blocks
+        fit_intercept = self.fit_intercept
+        resampling_period = self.resampling_period
+
+        @jit(**jit_kwargs)
+        def next_blocks(state):
+            # Draws new blocks if needed, and stores the block of each sample when
+            # they are kept for several calls. With resampling_period == 1 the blocks
+            # are drawn on the fly by partial_deriv instead.
+            n_calls = state.n_calls
+            if resampling_period > 1 and n_calls[0] % resampling_period == 0:
+                sample_indices = state.sample_indices
+                sample_blocks = state.sample_blocks
+                np.random.shuffle(sample_indices)
+                for t in range(sample_indices.shape[0]):
+                    sample_blocks[sample_indices[t]] = t // n_samples_in_block
+            n_calls[0] += 1
+
+        @jit(**jit_kwargs)
+        def median_block_means(state):
+            block_means = state.block_means
+            for n_block in range(n_blocks):
+                if last_block_size != 0 and n_block == n_blocks - 1:
+                    block_size = last_block_size
+                else:
+                    block_size = n_samples_in_block
+                for k in range(n_classes):
+                    block_means[n_block, k] /= block_size
 
-        if self.fit_intercept:
+            partial_derivative = state.partial_derivative
+            for k in range(n_classes):
+                partial_derivative[k] = fast_median(block_means[:, k], n_blocks)
+
+        if self.parallel and matrix_type(self.X) != "csc":
 
             @jit(**jit_kwargs)
-            def partial_deriv(j, inner_products, state):
+            def group_blocks(state):
+                # Draws the blocks with the same random numbers as the serial
+                # partial_deriv, and groups the samples by block in block_samples
+                # (block n_block at positions n_block * n_samples_in_block onwards),
+                # keeping their original order within each block, so that the block
+                # sums are the same as the serial ones
+                sample_indices = state.sample_indices
+                sample_blocks = state.sample_blocks
+                block_samples = state.block_samples
+                n_samples = sample_indices.shape[0]
+                if state.n_calls[0] % resampling_period != 0:
+                    state.n_calls[0] += 1
+                    return
+                next_blocks(state)
+                if resampling_period == 1:
+                    # Fisher-Yates shuffle of sample_indices, as in the serial
+                    # partial_deriv
+                    for i in range(n_samples):
+                        pos = np.random.randint(i, n_samples)
+                        sample_indices[i], sample_indices[pos] = (
+                            sample_indices[pos],
+                            sample_indices[i],
+                        )
+                        sample_blocks[i] = sample_indices[i] // n_samples_in_block
+                block_sizes = np.zeros(n_blocks, dtype=np.intp)
+                for i in range(n_samples):
+                    n_block = sample_blocks[i]
+                    t = n_block * n_samples_in_block + block_sizes[n_block]
+                    block_samples[t] = i
+                    block_sizes[n_block] += 1
+
+            @jit(**jit_parallel_kwargs)
+            def partial_deriv(X, y, j, inner_products, state):
                 """Computes the partial derivative of the goodness-of-fit with
                 respect to coordinate `j`, given the value of the `inner_products` and
-                `state`.
+                `state`, computing the block sums in parallel.
 
                 Parameters
                 ----------
+                X : numpy.ndarray
+                    A numpy array of shape (n_samples, n_features) containing the
+                    training samples.
+
+                y : numpy.ndarray
+                    A numpy array of shape (n_samples,) containing the targets.
+
                 j : int
                     Partial derivative is with respect to this coordinate
 
@@ -158,71 +280,120 @@ class MOM(Estimator):
                 output : float
                     The value of the partial derivative
                 """
-                # print("call to mom partial deriv")
-                sample_indices = state.sample_indices
+                n_samples = X.shape[0]
+                block_samples = state.block_samples
                 block_means = state.block_means
+                group_blocks(state)
+                col = j - int(fit_intercept)
+                for n_block in prange(n_blocks):
+                    deriv = np.empty(n_classes)
+                    for k in range(n_classes):
+                        block_means[n_block, k] = 0.0
+                    block_start = n_block * n_samples_in_block
+                    block_end = min(block_start + n_samples_in_block, n_samples)
+                    for t in range(block_start, block_end):
+                        i = block_samples[t]
+                        deriv_loss(y[i], inner_products[i], deriv)
+                        x_ij = X[i, col] if col >= 0 else 1.0
+                        for k in range(n_classes):
+                            block_means[n_block, k] += deriv[k] * x_ij
 
-                # for i in range(n_samples):
-                #     sample_indices[i] = i
+                median_block_means(state)
 
-                np.random.shuffle(sample_indices)
-                deriv = state.loss_derivative
-                # Cumulative sum in the block
-                derivatives_sum_block = state.partial_derivative
-                for k in range(n_classes):
-                    derivatives_sum_block[k] = 0.0
-                # Block counter
-                n_block = 0
-                if j == 0:
-                    for i, idx in enumerate(sample_indices):
-                        deriv_loss(y[idx], inner_products[idx], deriv)
-                        for k in range(n_classes):
-                            derivatives_sum_block[k] += deriv[k]
-                        if ((i != 0) and ((i + 1) % n_samples_in_block == 0)) or n_samples_in_block == 1:
-                            for k in range(n_classes):
-                                block_means[n_block, k] = (
-                                    derivatives_sum_block[k] / n_samples_in_block
-                                )
-                                derivatives_sum_block[k] = 0.0
-                            n_block += 1
-                else:
-                    for i, idx in enumerate(sample_indices):
-                        deriv_loss(y[idx], inner_products[idx], deriv)
-                        Xij = X[idx, j - 1]
-                        for k in range(n_classes):
-                            derivatives_sum_block[k] += deriv[k] * Xij
+            return partial_deriv
 
-                        if ((i != 0) and ((i + 1) % n_samples_in_block == 0)) or n_samples_in_block == 1:
-                            for k in range(n_classes):
-                                block_means[n_block, k] = (
-                                    derivatives_sum_block[k] / n_samples_in_block
-                                )
-                                derivatives_sum_block[k] = 0.0
-                            n_block += 1
+        elif matrix_type(self.X) == "csc":
 
-                if last_block_size != 0:
-                    for k in range(n_classes):
-                        block_means[n_block, k] = (
-                            derivatives_sum_block[k] / last_block_size
+            @jit(**jit_kwargs)
+            def partial_deriv(X, y, j, inner_products, state):
+                """Computes the partial derivative of the goodness-of-fit with
+                respect to coordinate `j`, given the value of the `inner_products` and
+                `state`, using only the non-zero entries of the column of `X`.
+
+                Parameters
+                ----------
+                X : CSCMatrix
+                    The sparse CSC matrix of shape (n_samples, n_features) containing
+                    the training samples.
+
+                y : numpy.ndarray
+                    A numpy array of shape (n_samples,) containing the targets.
+
+                j : int
+                    Partial derivative is with respect to this coordinate
+
+                inner_products : numpy.array
+                    A numpy array of shape (n_samples,), containing the inner
+                    products (decision function) X.dot(w) + b where w is the weights
+                    and b the (optional) intercept.
+
+                state : StateMOM
+                    The state of the MOM estimator.
+
+                Returns
+                -------
+                output : float
+                    The value of the partial derivative
+                """
+                n_samples = X.shape[0]
+                sample_indices = state.sample_indices
+                sample_blocks = state.sample_blocks
+                block_means = state.block_means
+                deriv = state.loss_derivative
+                next_blocks(state)
+                block_means.fill(0.0)
+                if fit_intercept and j == 0:
+                    start, end = 0, n_samples
+                else:
+                    col = j - int(fit_intercept)
+                    start, end = X.indptr[col], X.indptr[col + 1]
+                indices, data = X.indices, X.data
+                for idx in range(start, end):
+                    if fit_intercept and j == 0:
+                        i, x_ij = idx, 1.0
+                    else:
+                        i, x_ij = indices[idx], data[idx]
+                    if resampling_period == 1:
+                        # The zero entries of the column do not contribute to the
+                        # block sums, so we only draw the positions of the samples
+                        # with a non-zero entry in the shuffle (a partial Fisher-Yates
+                        # shuffle of sample_indices), which gives their blocks with
+                        # the same distribution as a full shuffle
+                        t = idx - start
+                        pos = np.random.randint(t, n_samples)
+                        sample_indices[t], sample_indices[pos] = (
+                            sample_indices[pos],
+                            sample_indices[t],
                         )
+                        n_block = sample_indices[t] // n_samples_in_block
+                    else:
+                        n_block = sample_blocks[i]
+                    deriv_loss(y[i], inner_products[i], deriv)
+                    for k in range(n_classes):
+                        block_means[n_block, k] += deriv[k] * x_ij
+
+                median_block_means(state)
 
-                for k in range(n_classes):
-                    derivatives_sum_block[k] = fast_median(block_means[:, k], n_blocks)
-                    # derivatives_sum_block[k] = np.median(block_means[:, k])
-                # return np.median(block_means)
-                # print("over")
             return partial_deriv
 
         else:
-            # Same function without an intercept
+
             @jit(**jit_kwargs)
-            def partial_deriv(j, inner_products, state):
+            def partial_deriv(X, y, j, inner_products, state):
                 """Computes the partial derivative of the goodness-of-fit with
                 respect to coordinate `j`, given the value of the `inner_products` and
-                `state`.
+                `state`. The samples are visited in their original order, so that
+                the data is streamed sequentially, and each one is sent to its block.
 
                 Parameters
                 ----------
+                X : numpy.ndarray
+                    A numpy array of shape (n_samples, n_features) containing the
+                    training samples.
+
+                y : numpy.ndarray
+                    A numpy array of shape (n_samples,) containing the targets.
+
                 j : int
                     Partial derivative is with respect to this coordinate
 
@@ -239,45 +410,32 @@ class MOM(Estimator):
                 output : float
                     The value of the partial derivative
                 """
-                # print("call to mom partial deriv")
+                n_samples = X.shape[0]
                 sample_indices = state.sample_indices
+                sample_blocks = state.sample_blocks
                 block_means = state.block_means
-                # for i in range(n_samples):
-                #     sample_indices[i] = i
-
-                np.random.shuffle(sample_indices)
                 deriv = state.loss_derivative
-                # Cumulative sum in the block
-                derivatives_sum_block = state.partial_derivative
-                for k in range(n_classes):
-                    derivatives_sum_block[k] = 0.0
-                # Block counter
-                n_block = 0
-                for i, idx in enumerate(sample_indices):
-                    deriv_loss(y[idx], inner_products[idx], deriv)
-                    Xij = X[idx, j]
-                    for k in range(n_classes):
-                        derivatives_sum_block[k] += deriv[k] * Xij
-
-                    if ((i != 0) and ((i + 1) % n_samples_in_block == 0)) or n_samples_in_block == 1:
-                        for k in range(n_classes):
-                            block_means[n_block, k] = (
-                                derivatives_sum_block[k] / n_samples_in_block
-                            )
-                            derivatives_sum_block[k] = 0.0
-                        n_block += 1
-
-                if last_block_size != 0:
-                    for k in range(n_classes):
-                        block_means[n_block, k] = (
-                            derivatives_sum_block[k] / last_block_size
+                next_blocks(state)
+                block_means.fill(0.0)
+                col = j - int(fit_intercept)
+                for i in range(n_samples):
+                    if resampling_period == 1:
+                        # Draws the position of sample i in the shuffle on the fly (a
+                        # Fisher-Yates shuffle of sample_indices)
+                        pos = np.random.randint(i, n_samples)
+                        sample_indices[i], sample_indices[pos] = (
+                            sample_indices[pos],
+                            sample_indices[i],
                         )
+                        n_block = sample_indices[i] // n_samples_in_block
+                    else:
+                        n_block = sample_blocks[i]
+                    deriv_loss(y[i], inner_products[i], deriv)
+                    x_ij = X[i, col] if col >= 0 else 1.0
+                    for k in range(n_classes):
+                        block_means[n_block, k] += deriv[k] * x_ij
 
-                for k in range(n_classes):
-                    derivatives_sum_block[k] = fast_median(block_means[:, k], n_blocks)
-                    # derivatives_sum_block[k] = np.median(block_means[:, k])
-                # return np.median(block_means)
-                # print("over")
+                median_block_means(state)
 
             return partial_deriv
 
@@ -290,18 +448,24 @@ class MOM(Estimator):
         output : function
             A jit-compiled function allowing to compute gradients.
         """
-        n_features = self.n_features
         n_classes = self.n_classes
         fit_intercept = self.fit_intercept
         partial_deriv = self.partial_deriv_factory()
 
         @jit(**jit_kwargs)
-        def grad(inner_products, state):
+        def grad(X, y, inner_products, state):
             """Computes the gradient of the goodness-of-fit, given the value of the
              `inner_products` and `state`.
 
             Parameters
             ----------
+            X : numpy.ndarray
+                A numpy array of shape (n_samples, n_features) containing the
+                training samples.
+
+            y : numpy.ndarray
+                A numpy array of shape (n_samples,) containing the targets.
+
             inner_products : numpy.array
                 A numpy array of shape (n_samples,), containing the inner
                 products (decision function) X.dot(w) + b where w is the weights
@@ -315,11 +479,12 @@ class MOM(Estimator):
             output : numpy.array
                 A numpy array of shape (n_weights,) containing the gradient.
             """
+            n_features = X.shape[1]
             gradient = state.gradient
             partial_derivative = state.partial_derivative
 
             for j in range(n_features + int(fit_intercept)):
-                partial_deriv(j, inner_products, state)
+                partial_deriv(X, y, j, inner_products, state)
                 for k in range(n_classes):
                     gradient[j, k] = partial_derivative[k]
             return 0
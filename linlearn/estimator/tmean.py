@@ -5,15 +5,56 @@
 """
 This module implement the ``TMean`` class for the trimmed-means robust estimator.
 
+The trimmed means of the partial derivatives are warm-started from the trimming
+bounds of the previous call for the same coordinate (see ``warm_trimmed_mean``), which
+barely move in the late iterations of the solvers, so that a full selection over the
+samples is only needed when they move too much.
+
 `StateTMean` is a place-holder for the TMean estimator containing:
 
+    deriv_samples : numpy.ndarray
+        A numpy array of shape (n_samples, n_classes) containing the loss derivatives
+        of the samples.
+
+    deriv_samples_outer_prods : numpy.ndarray
+        A numpy array of shape (n_samples, n_classes) containing the products of the
+        loss derivatives with a feature.
+
+    gradient : numpy.ndarray
+        A numpy array of shape (n_weights, n_classes) containing the gradient.
+
+    loss_derivative : numpy.ndarray
+        A numpy array of shape (n_classes,) containing a loss derivative.
+
+    partial_derivative : numpy.ndarray
+        A numpy array of shape (n_classes,) containing a partial derivative.
+
+    one_hot_cols : numpy.ndarray
+        A numpy array of shape (n_weights,) indicating the columns with many zeros.
+
+    trim_bounds : numpy.ndarray
+        A numpy array of shape (n_weights, n_classes, 2) containing the last trimming
+        bounds of each coordinate.
+
+    trim_widths : numpy.ndarray
+        A numpy array of shape (n_weights, n_classes, 2) containing the half-widths of
+        the intervals in which the trimming bounds are searched (negative before the
+        first call).
+
+    selection_buffer : numpy.ndarray
+        A numpy array of shape (n_samples,) used by the warm-started selection.
 """
 
 from collections import namedtuple
 import numpy as np
-from numba import jit
-from ._base import Estimator, jit_kwargs
-from .._utils import np_float, trimmed_mean, fast_trimmed_mean, trimmed_mean_variant
+from numba import jit, prange
+from ._base import Estimator, jit_kwargs, jit_parallel_kwargs
+from .._utils import (
+    np_float,
+    warm_trimmed_mean,
+    trimmed_mean_variant,
+    matrix_type,
+)
 
 StateTMean = namedtuple(
     "StateTMean",
@@ -23,114 +64,168 @@ StateTMean = namedtuple(
         "gradient",
         "loss_derivative",
         "partial_derivative",
+        "one_hot_cols",
+        "trim_bounds",
+        "trim_widths",
+        "selection_buffer",
     ],
 )
 
 
 class TMean(Estimator):
-    """Trimmed-mean estimator"""
+    """Trimmed-mean estimator. When parallel is True, the loss derivatives of the
+    samples used by the partial derivatives are computed in parallel."""
 
-    def __init__(self, X, y, loss, n_classes, fit_intercept, percentage):
-        Estimator.__init__(self, X, y, loss, n_classes, fit_intercept)
+    def __init__(
+        self, X, y, loss, n_classes, fit_intercept, percentage, parallel=False
+    ):
+        Estimator.__init__(self, X, y, loss, n_classes, fit_intercept, parallel)
         self.percentage = percentage
         # Number of samples excluded from both tails (left and right)
-        self.n_excluded_tails = max(1, int(len(X) * percentage))
-        self.one_hot_cols = np.sum(X == 0.0, axis=0) > X.shape[0]/20
+        self.n_excluded_tails = max(1, int(self.n_samples * percentage))
+        if matrix_type(X) == "csc":
+            n_zeros = self.n_samples - np.diff(X.indptr)
+        else:
+            n_zeros = np.sum(X == 0.0, axis=0)
+        self.one_hot_cols = n_zeros > X.shape[0]/20
         if fit_intercept:
             self.one_hot_cols = np.insert(self.one_hot_cols, 0, False)
 
 
     def get_state(self):
+        weights_shape = (self.n_features + int(self.fit_intercept), self.n_classes)
         return StateTMean(
             deriv_samples=np.empty(
-                (self.n_samples, self.n_classes), dtype=np_float, order="F"
+                (self.n_samples, self.n_classes), dtype=self.X.dtype, order="F"
             ),
             deriv_samples_outer_prods=np.empty(
-                (self.n_samples, self.n_classes), dtype=np_float, order="F"
-            ),
-            gradient=np.empty(
-                (self.n_features + int(self.fit_intercept), self.n_classes),
-                dtype=np_float,
-                order="F",
+                (self.n_samples, self.n_classes), dtype=self.X.dtype, order="F"
             ),
+            gradient=np.empty(weights_shape, dtype=np_float, order="F"),
             loss_derivative=np.empty(self.n_classes, dtype=np_float),
             partial_derivative=np.empty(self.n_classes, dtype=np_float),
+            one_hot_cols=self.one_hot_cols,
+            trim_bounds=np.zeros(weights_shape + (2,), dtype=np_float),
+            trim_widths=np.full(weights_shape + (2,), -1.0, dtype=np_float),
+            selection_buffer=np.empty(self.n_samples, dtype=self.X.dtype),
         )
 
     def partial_deriv_factory(self):
-        X = self.X
-        y = self.y
         loss = self.loss
         deriv_loss = loss.deriv_factory()
-        n_samples = self.n_samples
         n_classes = self.n_classes
-        one_hot_cols = self.one_hot_cols
         n_excluded_tails = self.n_excluded_tails
+        fit_intercept = self.fit_intercept
+        # The loops over the samples filling deriv_samples run in parallel in
+        # parallel mode
+        kernel_kwargs = jit_parallel_kwargs if self.parallel else jit_kwargs
 
-        if self.fit_intercept:
+        if matrix_type(self.X) == "csc":
 
-            @jit(**jit_kwargs)
-            def partial_deriv(j, inner_products, state):
+            @jit(**kernel_kwargs)
+            def partial_deriv(X, y, j, inner_products, state):
+                n_samples = X.shape[0]
                 deriv_samples = state.deriv_samples
+                one_hot_cols = state.one_hot_cols
                 partial_derivative = state.partial_derivative
-                if j == 0:
-                    for i in range(n_samples):
+                if fit_intercept and j == 0:
+                    for i in prange(n_samples):
                         deriv_loss(y[i], inner_products[i], deriv_samples[i])
                 else:
-                    for i in range(n_samples):
+                    # Loss derivatives are only computed for the non-zero entries of
+                    # the column, the other samples have zero partial derivatives
+                    deriv_samples.fill(0.0)
+                    col = j - int(fit_intercept)
+                    indices, data = X.indices, X.data
+                    start, end = X.indptr[col], X.indptr[col + 1]
+                    for idx in prange(start, end):
+                        i = indices[idx]
                         deriv_loss(y[i], inner_products[i], deriv_samples[i])
                         for k in range(n_classes):
-                            deriv_samples[i, k] *= X[i, j - 1]
+                            deriv_samples[i, k] *= data[idx]
 
-                # TODO: Hand-made mean ?
-                # TODO: Try out different sorting mechanisms, since at some point the
-                #  sorting order won't change much...
+                for k in range(n_classes):
+                    partial_derivative[k] = warm_trimmed_mean(
+                        deriv_samples[:, k],
+                        n_samples,
+                        n_excluded_tails,
+                        state.trim_bounds[j, k],
+                        state.trim_widths[j, k],
+                        state.selection_buffer,
+                        one_hot_cols[j],
+                    )
 
-                if one_hot_cols[j]:
-                    for k in range(n_classes):
-                        partial_derivative[k] = trimmed_mean(deriv_samples[:, k], n_samples, n_excluded_tails)
+            return partial_deriv
+
+        elif fit_intercept:
+
+            @jit(**kernel_kwargs)
+            def partial_deriv(X, y, j, inner_products, state):
+                n_samples = X.shape[0]
+                deriv_samples = state.deriv_samples
+                one_hot_cols = state.one_hot_cols
+                partial_derivative = state.partial_derivative
+                if j == 0:
+                    for i in prange(n_samples):
+                        deriv_loss(y[i], inner_products[i], deriv_samples[i])
                 else:
-                    for k in range(n_classes):
-                        partial_derivative[k] = fast_trimmed_mean(deriv_samples[:, k], n_samples, n_excluded_tails)
+                    for i in prange(n_samples):
+                        deriv_loss(y[i], inner_products[i], deriv_samples[i])
+                        for k in range(n_classes):
+                            deriv_samples[i, k] *= X[i, j - 1]
+
+                for k in range(n_classes):
+                    partial_derivative[k] = warm_trimmed_mean(
+                        deriv_samples[:, k],
+                        n_samples,
+                        n_excluded_tails,
+                        state.trim_bounds[j, k],
+                        state.trim_widths[j, k],
+                        state.selection_buffer,
+                        one_hot_cols[j],
+                    )
 
             return partial_deriv
 
         else:
 
-            @jit(**jit_kwargs)
-            def partial_deriv(j, inner_products, state):
+            @jit(**kernel_kwargs)
+            def partial_deriv(X, y, j, inner_products, state):
+                n_samples = X.shape[0]
                 deriv_samples = state.deriv_samples
+                one_hot_cols = state.one_hot_cols
                 partial_derivative = state.partial_derivative
-                for i in range(n_samples):
+                for i in prange(n_samples):
                     deriv_loss(y[i], inner_products[i], deriv_samples[i])
                     for k in range(n_classes):
                         deriv_samples[i, k] *= X[i, j]
 
-                if one_hot_cols[j]:
-                    for k in range(n_classes):
-                        partial_derivative[k] = trimmed_mean(deriv_samples[:, k], n_samples, n_excluded_tails)
-                else:
-                    for k in range(n_classes):
-                        partial_derivative[k] = fast_trimmed_mean(deriv_samples[:, k], n_samples, n_excluded_tails)
+                for k in range(n_classes):
+                    partial_derivative[k] = warm_trimmed_mean(
+                        deriv_samples[:, k],
+                        n_samples,
+                        n_excluded_tails,
+                        state.trim_bounds[j, k],
+                        state.trim_widths[j, k],
+                        state.selection_buffer,
+                        one_hot_cols[j],
+                    )
 
             return partial_deriv
 
     def grad_factory(self):
-        X = self.X
-        y = self.y
         loss = self.loss
         deriv_loss = loss.deriv_factory()
-        n_samples = self.n_samples
-        n_features = self.n_features
         n_classes = self.n_classes
-        one_hot_cols = self.one_hot_cols
         n_excluded_tails = self.n_excluded_tails
 
         if self.fit_intercept:
 
             @jit(**jit_kwargs)
-            def grad(inner_products, state):
+            def grad(X, y, inner_products, state):
+                n_samples, n_features = X.shape
                 deriv_samples = state.deriv_samples
+                one_hot_cols = state.one_hot_cols
                 deriv_samples_outer_prods = state.deriv_samples_outer_prods
                 gradient = state.gradient
 
@@ -142,8 +237,15 @@ class TMean(Estimator):
                         deriv_samples_outer_prods[i, k] = deriv_samples[i, k]
 
                 for k in range(n_classes):
-                    gradient[0, k] = fast_trimmed_mean(deriv_samples_outer_prods[:, k], n_samples, n_excluded_tails)
-                    # gradient[0, k] = trimmed_mean(deriv_samples_outer_prods[:, k], n_samples, n_excluded_tails)
+                    gradient[0, k] = warm_trimmed_mean(
+                        deriv_samples_outer_prods[:, k],
+                        n_samples,
+                        n_excluded_tails,
+                        state.trim_bounds[0, k],
+                        state.trim_widths[0, k],
+                        state.selection_buffer,
+                        one_hot_cols[0],
+                    )
 
                 for k in range(n_classes):
                     for j in range(n_features):
@@ -151,17 +253,26 @@ class TMean(Estimator):
                             deriv_samples_outer_prods[i, k] = (
                                 deriv_samples[i, k] * X[i, j]
                             )
-                        if one_hot_cols[j]:
-                            gradient[j + 1, k] = trimmed_mean(deriv_samples_outer_prods[:, k], n_samples, n_excluded_tails)
-                        else:
-                            gradient[j + 1, k] = fast_trimmed_mean(deriv_samples_outer_prods[:, k], n_samples, n_excluded_tails)
+                        gradient[j + 1, k] = warm_trimmed_mean(
+                            deriv_samples_outer_prods[:, k],
+                            n_samples,
+                            n_excluded_tails,
+                            state.trim_bounds[j + 1, k],
+                            state.trim_widths[j + 1, k],
+                            state.selection_buffer,
+                            one_hot_cols[j + 1],
+                        )
+
+                return 0
 
             return grad
         else:
 
             @jit(**jit_kwargs)
-            def grad(inner_products, state):
+            def grad(X, y, inner_products, state):
+                n_samples, n_features = X.shape
                 deriv_samples = state.deriv_samples
+                one_hot_cols = state.one_hot_cols
                 deriv_samples_outer_prods = state.deriv_samples_outer_prods
                 gradient = state.gradient
 
@@ -179,10 +290,15 @@ class TMean(Estimator):
                                     deriv_samples[i, k] * X[i, j]
                             )
 
-                        if one_hot_cols[j]:
-                            gradient[j, k] = trimmed_mean(deriv_samples_outer_prods[:, k], n_samples, n_excluded_tails)
-                        else:
-                            gradient[j, k] = fast_trimmed_mean(deriv_samples_outer_prods[:, k], n_samples, n_excluded_tails)
+                        gradient[j, k] = warm_trimmed_mean(
+                            deriv_samples_outer_prods[:, k],
+                            n_samples,
+                            n_excluded_tails,
+                            state.trim_bounds[j, k],
+                            state.trim_widths[j, k],
+                            state.selection_buffer,
+                            one_hot_cols[j],
+                        )
 
                 return 0
             return grad
@@ -201,18 +317,16 @@ class TMean_variant(TMean):
             )
 
     def partial_deriv_factory(self):
-        X = self.X
-        y = self.y
         loss = self.loss
         deriv_loss = loss.deriv_factory()
-        n_samples = self.n_samples
         n_classes = self.n_classes
         n_excluded_tails = self.n_excluded_tails
 
         if self.fit_intercept:
 
             @jit(**jit_kwargs)
-            def partial_deriv(j, inner_products, state):
+            def partial_deriv(X, y, j, inner_products, state):
+                n_samples = X.shape[0]
                 deriv_samples = state.deriv_samples
                 partial_derivative = state.partial_derivative
                 if j == 0:
@@ -236,7 +350,8 @@ class TMean_variant(TMean):
         else:
 
             @jit(**jit_kwargs)
-            def partial_deriv(j, inner_products, state):
+            def partial_deriv(X, y, j, inner_products, state):
+                n_samples = X.shape[0]
                 deriv_samples = state.deriv_samples
                 partial_derivative = state.partial_derivative
                 for i in range(n_samples):
@@ -250,19 +365,16 @@ class TMean_variant(TMean):
             return partial_deriv
 
     def grad_factory(self):
-        X = self.X
-        y = self.y
         loss = self.loss
         deriv_loss = loss.deriv_factory()
-        n_samples = self.n_samples
-        n_features = self.n_features
         n_classes = self.n_classes
         n_excluded_tails = self.n_excluded_tails
 
         if self.fit_intercept:
 
             @jit(**jit_kwargs)
-            def grad(inner_products, state):
+            def grad(X, y, inner_products, state):
+                n_samples, n_features = X.shape
                 deriv_samples = state.deriv_samples
                 deriv_samples_outer_prods = state.deriv_samples_outer_prods
                 gradient = state.gradient
@@ -289,7 +401,8 @@ class TMean_variant(TMean):
         else:
 
             @jit(**jit_kwargs)
-            def grad(inner_products, state):
+            def grad(X, y, inner_products, state):
+                n_samples, n_features = X.shape
                 deriv_samples = state.deriv_samples
                 deriv_samples_outer_prods = state.deriv_samples_outer_prods
                 gradient = state.gradient
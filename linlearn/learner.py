@@ -8,9 +8,11 @@
 from warnings import warn
 
 import numbers
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from scipy.special import expit, softmax
-from numba import jit
+import numba
+from numba import jit, prange
 
 from sklearn.base import ClassifierMixin, RegressorMixin, BaseEstimator
 from sklearn.preprocessing import LabelEncoder
@@ -33,12 +35,32 @@ from ._loss import (
     MultiHinge,
     compute_steps,
     compute_steps_cgd,
-    decision_function_factory,
 )
 from ._penalty import NoPen, L2Sq, L1, ElasticNet
-from .solver import CGD, GD, MD, DA, SGD, SVRG, SAGA, LLC19, batch_GD, History
+from .solver import (
+    CGD,
+    ParallelCGD,
+    GD,
+    AGD,
+    LBFGS,
+    MD,
+    DA,
+    SGD,
+    SVRG,
+    SAGA,
+    LLC19,
+    batch_GD,
+    History,
+)
 from .estimator import ERM, MOM, TMean, TMean_variant, LLM, GMOM, CH, HG, DKK
-from ._utils import NOPYTHON, NOGIL, BOUNDSCHECK, FASTMATH, np_float, numba_seed_numpy
+from ._utils import (
+    NOPYTHON,
+    NOGIL,
+    BOUNDSCHECK,
+    FASTMATH,
+    numba_seed_numpy,
+    get_kernel,
+)
 
 jit_kwargs = {
     "nopython": NOPYTHON,
@@ -48,6 +70,44 @@ jit_kwargs = {
 }
 
 
+@jit(**jit_kwargs, parallel=True)
+def misclassification_rates(y, weights, inner_products, out):
+    """Computes the misclassification rates of several iterates at once.
+
+    Parameters
+    ----------
+    y : numpy.ndarray of shape (n_samples,)
+        Indices of the labels of the samples in ``classes_``, -1 for labels unseen
+        during fit
+
+    weights : numpy.ndarray of shape (n_iterates, n_weights, n_classes)
+        The iterates
+
+    inner_products : numpy.ndarray of shape (n_samples, n_iterates * n_classes)
+        The decision functions of the iterates
+
+    out : numpy.ndarray of shape (n_iterates,)
+        Array containing the misclassification rates of the iterates
+    """
+    n_iterates, _, n_classes = weights.shape
+    n_samples = y.shape[0]
+    for t in prange(n_iterates):
+        n_errors = 0
+        for i in range(n_samples):
+            if n_classes == 1:
+                prediction = 1 if inner_products[i, t] > 0 else 0
+            else:
+                prediction = 0
+                best = inner_products[i, t * n_classes]
+                for k in range(1, n_classes):
+                    if inner_products[i, t * n_classes + k] > best:
+                        prediction = k
+                        best = inner_products[i, t * n_classes + k]
+            if prediction != y[i]:
+                n_errors += 1
+        out[t] = n_errors / n_samples
+
+
 # TODO: serialization
 
 
@@ -67,7 +127,21 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
     ]
     _penalties = ["none", "l2", "l1", "elasticnet"]
     _estimators = ["erm", "mom", "tmean", "tmean_variant", "llm", "gmom", "ch", "hg", "dkk"]
-    _solvers = ["cgd", "gd", "md", "da", "sgd", "svrg", "saga", "batch_gd", "llc"]
+    _solvers = [
+        "cgd",
+        "parallel_cgd",
+        "gd",
+        "agd",
+        "lbfgs",
+        "md",
+        "da",
+        "sgd",
+        "svrg",
+        "saga",
+        "batch_gd",
+        "llc",
+    ]
+    _stopping_rules = ["weights", "objective", "gap", "gradient"]
 
     def __init__(
         self,
@@ -94,6 +168,14 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
         stage_length=10,
         Radius=1000,
         sparsity_ub=0.01,
+        dtype="float64",
+        block_resampling="coordinate",
+        history_record="all",
+        history_size=None,
+        screening=False,
+        working_set=False,
+        stopping_rule="weights",
+        stopping_period=1,
     ):
         self.penalty = penalty
         self.C = C
@@ -117,7 +199,14 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
         self.stage_length = stage_length
         self.Radius = Radius
         self.sparsity_ub = sparsity_ub
-
+        self.dtype = dtype
+        self.block_resampling = block_resampling
+        self.history_record = history_record
+        self.history_size = history_size
+        self.screening = screening
+        self.working_set = working_set
+        self.stopping_rule = stopping_rule
+        self.stopping_period = stopping_period
 
         self.history_ = None
         self.intercept_ = None
@@ -220,6 +309,60 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
         else:
             self._block_size = val
 
+    @property
+    def block_resampling(self):
+        return self._block_resampling
+
+    @block_resampling.setter
+    def block_resampling(self, val):
+        if val in ["coordinate", "epoch"] or (
+            isinstance(val, numbers.Integral)
+            and not isinstance(val, bool)
+            and val > 0
+        ):
+            self._block_resampling = val
+        else:
+            raise ValueError(
+                "block_resampling must be 'coordinate', 'epoch' or a positive integer; "
+                "got (block_resampling=%r)" % val
+            )
+
+    @property
+    def history_record(self):
+        return self._history_record
+
+    @history_record.setter
+    def history_record(self, val):
+        if val in ["all", "off", "delta"] or (
+            isinstance(val, numbers.Integral)
+            and not isinstance(val, bool)
+            and val > 0
+        ):
+            self._history_record = val
+        else:
+            raise ValueError(
+                "history_record must be 'all', 'off', 'delta' or a positive integer; "
+                "got (history_record=%r)" % val
+            )
+
+    @property
+    def history_size(self):
+        return self._history_size
+
+    @history_size.setter
+    def history_size(self, val):
+        if val is None or (
+            isinstance(val, numbers.Integral)
+            and not isinstance(val, bool)
+            and val > 0
+        ):
+            self._history_size = val
+        else:
+            raise ValueError(
+                "history_size must be None or a positive integer; "
+                "got (history_size=%r)" % val
+            )
+
     @property
     def percentage(self):
         return self._percentage
@@ -322,6 +465,23 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
                 "sparsity_ub (sparsity upperbound) must be a postive integer or a ratio between 0 and 1; got (sparsity_ub=%r)" % val
             )
 
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @dtype.setter
+    def dtype(self, val):
+        try:
+            dtype = np.dtype(val)
+        except TypeError:
+            dtype = None
+        if val is None or dtype not in (np.float32, np.float64):
+            raise ValueError(
+                "dtype must be either 'float32' or 'float64'; got (dtype=%r)" % val
+            )
+        else:
+            self._dtype = val
+
     @property
     def Radius(self):
         return self._Radius
@@ -346,14 +506,92 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
         else:
             self._cgd_IS = val
 
-    # TODO: properties for class_weight=None, random_state=None, verbose=0, warm_start=False, n_jobs=None
+    @property
+    def screening(self):
+        return self._screening
+
+    @screening.setter
+    def screening(self, val):
+        if not isinstance(val, bool):
+            raise ValueError("screening must be a boolean; got (screening=%r)" % val)
+        else:
+            self._screening = val
+
+    @property
+    def working_set(self):
+        return self._working_set
+
+    @working_set.setter
+    def working_set(self, val):
+        if not isinstance(val, bool):
+            raise ValueError(
+                "working_set must be a boolean; got (working_set=%r)" % val
+            )
+        else:
+            self._working_set = val
+
+    @property
+    def stopping_rule(self):
+        return self._stopping_rule
+
+    @stopping_rule.setter
+    def stopping_rule(self, val):
+        if val not in BaseLearner._stopping_rules:
+            raise ValueError(
+                "stopping_rule must be one of %r; got (stopping_rule=%r)"
+                % (self._stopping_rules, val)
+            )
+        else:
+            self._stopping_rule = val
+
+    @property
+    def stopping_period(self):
+        return self._stopping_period
+
+    @stopping_period.setter
+    def stopping_period(self, val):
+        if not isinstance(val, int) or isinstance(val, bool) or val < 1:
+            raise ValueError(
+                "stopping_period must be a positive integer; got (stopping_period=%r)"
+                % val
+            )
+        else:
+            self._stopping_period = val
+
+    @property
+    def n_jobs(self):
+        return self._n_jobs
+
+    @n_jobs.setter
+    def n_jobs(self, val):
+        if val is None or (
+            isinstance(val, numbers.Integral) and not isinstance(val, bool) and val != 0
+        ):
+            self._n_jobs = val
+        else:
+            raise ValueError(
+                "n_jobs must be None or a non-zero integer; got (n_jobs=%r)" % val
+            )
+
+    def _get_n_threads(self):
+        """Number of threads used for training, following the n_jobs conventions of
+        scikit-learn (None means 1, -1 means all the threads available to numba)"""
+        max_threads = numba.config.NUMBA_NUM_THREADS
+        if self.n_jobs is None:
+            return 1
+        elif self.n_jobs < 0:
+            return max(max_threads + 1 + self.n_jobs, 1)
+        else:
+            return min(self.n_jobs, max_threads)
+
+    # TODO: properties for class_weight=None, random_state=None, verbose=0, warm_start=False
 
     def check_estimator_solver_combination(self, estimator, solver):
         if solver in ["sgd", "svrg", "saga", "batch_gd"] and estimator != "erm":
             warn(
                 "Your choice of robust estimator will be ignored because it is not supported by SGD type solvers (SGD, SVRG and SAGA)"
             )
-        elif solver == "gd" and estimator == "mom":
+        elif solver in ["gd", "agd"] and estimator == "mom":
             warn(
                 "The Median-of-Means estimator computes only single gradient coordinates, a full gradient can be constituted for Gradient Descent but we recommend to either use mom estimator with cgd solver or gmom estimator with gd solver instead"
             )
@@ -367,11 +605,11 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
         #         "The Holland estimator computes full gradients, doing CGD with this estimator is equivalent to using catoni estimator with CGD. Switching estimator to 'catoni'"
         #     )
         #     self.estimator = "catoni"
-        elif solver == "gd" and estimator == "tmean":
+        elif solver in ["gd", "agd"] and estimator == "tmean":
             warn(
                 "The Trimmed Mean estimator computes only single gradient coordinates, full gradients for GD will be constituted from coordinates."
             )
-        elif solver == "cgd" and estimator in ["gmom", "hg"]:
+        elif solver in ["cgd", "parallel_cgd"] and estimator in ["gmom", "hg"]:
             raise ValueError(
                 "The GMOM and HG estimators compute whole gradients and cannot be used with CGD."
             )
@@ -403,14 +641,26 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
         else:
             raise ValueError("Loss unknown")
 
-    def _get_estimator(self, X, y, loss):
+    def _get_estimator(self, X, y, loss, n_threads=None):
+        if n_threads is None:
+            n_threads = self._get_n_threads()
+        # Estimators supporting it split their loops over samples across threads,
+        # unless the threads already update distinct coordinates (parallel_cgd)
+        parallel = n_threads > 1 and self.solver != "parallel_cgd"
         if self.estimator == "erm":
-            return ERM(X, y, loss, self.n_classes, self.fit_intercept)
+            return ERM(X, y, loss, self.n_classes, self.fit_intercept, parallel)
         elif self.estimator == "mom":
             n_samples = y.shape[0]
             n_samples_in_block = max(int(self.block_size * n_samples), 1)
             return MOM(
-                X, y, loss, self.n_classes, self.fit_intercept, n_samples_in_block
+                X,
+                y,
+                loss,
+                self.n_classes,
+                self.fit_intercept,
+                n_samples_in_block,
+                self.block_resampling,
+                parallel,
             )
         elif self.estimator == "tmean":
             if self.solver == "llc":
@@ -419,10 +669,18 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
                 )
             else:
                 return TMean(
-                    X, y, loss, self.n_classes, self.fit_intercept, self.percentage
+                    X,
+                    y,
+                    loss,
+                    self.n_classes,
+                    self.fit_intercept,
+                    self.percentage,
+                    parallel,
                 )
         elif self.estimator == "ch":
-            return CH(X, y, loss, self.n_classes, self.fit_intercept, self.eps)
+            return CH(
+                X, y, loss, self.n_classes, self.fit_intercept, self.eps, parallel
+            )
         elif self.estimator == "llm":
             return LLM(
                 X, y, loss, self.n_classes, self.fit_intercept, max(int(1 / self.block_size), 1)
@@ -459,8 +717,31 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
         else:
             raise ValueError("Unknown penalty")
 
-    def _get_solver(self, X, y):
+    def _get_step(self, X, loss):
+        n_samples, n_features = X.shape
+        n_samples_in_block = max(int(n_samples * self.block_size), 1)
+
+        if self.solver in ["cgd", "parallel_cgd"]:
+            step = compute_steps_cgd(X, self.estimator, self.fit_intercept, loss.lip, self.percentage,
+                                     n_samples_in_block, self.eps)
+        # elif self.solver == "llc":
+        #     step = np.min(compute_steps_cgd(X, self.estimator, self.fit_intercept, loss.lip, self.percentage,
+        #                              n_samples_in_block, self.eps))
+        #     print("llc19 step size is : %f" % step)
+        # elif self.solver in ["md", "da"]:
+        #     step = 1.0
+        else:
+            step = compute_steps(X, self.solver, self.estimator, self.fit_intercept, loss.lip, self.percentage,
+                                 max(1, int(1 / self.block_size)), self.eps)
+
+        return step * self.step_size
+
+    def _get_solver(self, X, y, n_threads=None, step=None):
+        # n_threads is the number of threads available to the solver and step the
+        # precomputed step sizes (both are computed if not given)
         n_samples, n_features = X.shape
+        if n_threads is None:
+            n_threads = self._get_n_threads()
 
         # # Get the loss object
         # loss_factory = losses_factory[self.loss]
@@ -469,34 +750,32 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
         # Get the loss object
         loss = self._get_loss()
         # Get the estimator object
-        estimator = self._get_estimator(X, y, loss)
+        estimator = self._get_estimator(X, y, loss, n_threads)
         # Get the penalty object
         penalty = self._get_penalty(n_samples)
         # penalty_factory = penalties_factory[self.penalty]
         # The strength is scaled using following scikit-learn's scaling
         # strength = 1 / (self.C * n_samples)
         # penalty = penalty_factory(strength=strength, l1_ratio=self.l1_ratio)
-        n_samples_in_block = max(int(n_samples * self.block_size), 1)
 
-        if self.solver == "cgd":
-            step = compute_steps_cgd(X, self.estimator, self.fit_intercept, loss.lip, self.percentage,
-                                     n_samples_in_block, self.eps)
-        # elif self.solver == "llc":
-        #     step = np.min(compute_steps_cgd(X, self.estimator, self.fit_intercept, loss.lip, self.percentage,
-        #                              n_samples_in_block, self.eps))
-        #     print("llc19 step size is : %f" % step)
-        # elif self.solver in ["md", "da"]:
-        #     step = 1.0
-        else:
-            step = compute_steps(X, self.solver, self.estimator, self.fit_intercept, loss.lip, self.percentage,
-                                 max(1, int(1 / self.block_size)), self.eps)
-            print("step size is : %f" % step)
+        if self.stopping_rule != "weights" and self.solver in ("md", "da", "llc"):
+            raise ValueError(
+                "stopping_rule=%r cannot be used with solver=%r"
+                % (self.stopping_rule, self.solver)
+            )
 
-        step *= self.step_size
+        if step is None:
+            step = self._get_step(X, loss)
 
         if self.solver == "cgd":
             # Create an history object for the solver
-            history = History("CGD", self.max_iter, self.verbose)
+            history = History(
+                "CGD",
+                self.max_iter,
+                self.verbose,
+                record=self.history_record,
+                record_size=self.history_size,
+            )
             self.history_ = history
 
             return CGD(
@@ -512,11 +791,53 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
                 step,
                 history,
                 importance_sampling=self.cgd_IS,
+                parallel=n_threads > 1,
+                screening=self.screening,
+                working_set=self.working_set,
+                stopping_rule=self.stopping_rule,
+                stopping_period=self.stopping_period,
+            )
+
+        elif self.solver == "parallel_cgd":
+            # Create an history object for the solver
+            history = History(
+                "ParallelCGD",
+                self.max_iter,
+                self.verbose,
+                record=self.history_record,
+                record_size=self.history_size,
+            )
+            self.history_ = history
+
+            return ParallelCGD(
+                X,
+                y,
+                loss,
+                self.n_classes,
+                self.fit_intercept,
+                estimator,
+                penalty,
+                self.max_iter,
+                self.tol,
+                step,
+                history,
+                n_workers=n_threads,
+                importance_sampling=self.cgd_IS,
+                screening=self.screening,
+                working_set=self.working_set,
+                stopping_rule=self.stopping_rule,
+                stopping_period=self.stopping_period,
             )
 
         elif self.solver == "gd":
             # Create an history object for the solver
-            history = History("GD", self.max_iter, self.verbose)
+            history = History(
+                "GD",
+                self.max_iter,
+                self.verbose,
+                record=self.history_record,
+                record_size=self.history_size,
+            )
             self.history_ = history
 
             return GD(
@@ -531,10 +852,70 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
                 self.tol,
                 step,
                 history,
+                stopping_rule=self.stopping_rule,
+                stopping_period=self.stopping_period,
+            )
+        elif self.solver == "agd":
+            # Create an history object for the solver
+            history = History(
+                "AGD",
+                self.max_iter,
+                self.verbose,
+                record=self.history_record,
+                record_size=self.history_size,
+            )
+            self.history_ = history
+
+            return AGD(
+                X,
+                y,
+                loss,
+                self.n_classes,
+                self.fit_intercept,
+                estimator,
+                penalty,
+                self.max_iter,
+                self.tol,
+                step,
+                history,
+                stopping_rule=self.stopping_rule,
+                stopping_period=self.stopping_period,
+            )
+        elif self.solver == "lbfgs":
+            # Create an history object for the solver
+            history = History(
+                "LBFGS",
+                self.max_iter,
+                self.verbose,
+                record=self.history_record,
+                record_size=self.history_size,
+            )
+            self.history_ = history
+
+            return LBFGS(
+                X,
+                y,
+                loss,
+                self.n_classes,
+                self.fit_intercept,
+                estimator,
+                penalty,
+                self.max_iter,
+                self.tol,
+                step,
+                history,
+                stopping_rule=self.stopping_rule,
+                stopping_period=self.stopping_period,
             )
         elif self.solver == "md":
             # Create an history object for the solver
-            history = History("MD", self.max_iter, self.verbose)
+            history = History(
+                "MD",
+                self.max_iter,
+                self.verbose,
+                record=self.history_record,
+                record_size=self.history_size,
+            )
             self.history_ = history
             return MD(
                 X,
@@ -553,7 +934,13 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
             )
         elif self.solver == "da":
             # Create an history object for the solver
-            history = History("DA", self.max_iter, self.verbose)
+            history = History(
+                "DA",
+                self.max_iter,
+                self.verbose,
+                record=self.history_record,
+                record_size=self.history_size,
+            )
             self.history_ = history
             return DA(
                 X,
@@ -572,7 +959,13 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
             )
         elif self.solver == "llc":
             # Create an history object for the solver
-            history = History("LLC", self.max_iter, self.verbose)
+            history = History(
+                "LLC",
+                self.max_iter,
+                self.verbose,
+                record=self.history_record,
+                record_size=self.history_size,
+            )
             self.history_ = history
             return LLC19(
                 X,
@@ -590,7 +983,13 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
 
         elif self.solver == "sgd":
             # Create an history object for the solver
-            history = History("SGD", self.max_iter, self.verbose)
+            history = History(
+                "SGD",
+                self.max_iter,
+                self.verbose,
+                record=self.history_record,
+                record_size=self.history_size,
+            )
             self.history_ = history
 
             return SGD(
@@ -606,11 +1005,19 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
                 step,
                 history,
                 exponent=self.sgd_exponent,
+                stopping_rule=self.stopping_rule,
+                stopping_period=self.stopping_period,
             )
 
         elif self.solver == "svrg":
             # Create an history object for the solver
-            history = History("SVRG", self.max_iter, self.verbose)
+            history = History(
+                "SVRG",
+                self.max_iter,
+                self.verbose,
+                record=self.history_record,
+                record_size=self.history_size,
+            )
             self.history_ = history
 
             return SVRG(
@@ -625,10 +1032,18 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
                 self.tol,
                 step,
                 history,
+                stopping_rule=self.stopping_rule,
+                stopping_period=self.stopping_period,
             )
         elif self.solver == "saga":
             # Create an history object for the solver
-            history = History("SAGA", self.max_iter, self.verbose)
+            history = History(
+                "SAGA",
+                self.max_iter,
+                self.verbose,
+                record=self.history_record,
+                record_size=self.history_size,
+            )
             self.history_ = history
 
             return SAGA(
@@ -643,10 +1058,18 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
                 self.tol,
                 step,
                 history,
+                stopping_rule=self.stopping_rule,
+                stopping_period=self.stopping_period,
             )
         elif self.solver == "batch_gd":
             # Create an history object for the solver
-            history = History("batch_GD", self.max_iter, self.verbose)
+            history = History(
+                "batch_GD",
+                self.max_iter,
+                self.verbose,
+                record=self.history_record,
+                record_size=self.history_size,
+            )
             self.history_ = history
 
             return batch_GD(
@@ -662,6 +1085,8 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
                 step,
                 history,
                 batch_size=self.block_size,
+                stopping_rule=self.stopping_rule,
+                stopping_period=self.stopping_period,
             )
 
         else:
@@ -678,8 +1103,23 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
             )
         else:
             w = np.zeros((n_features, self.n_classes), dtype=X.dtype, order="F")
+        # Start from the previous solution if it has the right shape
+        if (
+            self.warm_start
+            and self.coef_ is not None
+            and self.coef_.shape == (self.n_classes, n_features)
+        ):
+            self._get_fitted_weights(w)
         return w
 
+    def _get_fitted_weights(self, w):
+        # Fills w with the fitted intercept and coefficients
+        if self.fit_intercept:
+            w[0] = self.intercept_
+            w[1:] = self.coef_.T
+        else:
+            w[:] = self.coef_.T
+
     def _check_multiclass_loss(self):
         if self.loss == "logistic":
             # if we are in the multiclass case switch to multiclass loss
@@ -741,65 +1181,151 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
         if self.fit_intercept:
 
             @jit(**jit_kwargs)
-            def objective(weights, inner_products):
+            def objective(y, weights, inner_products):
                 obj = value_loss(y, inner_products)
                 obj += value_penalty(weights[1:])
                 return obj
 
-            return objective
+            return get_kernel(objective)
         else:
 
             @jit(**jit_kwargs)
-            def objective(weights, inner_products):
+            def objective(y, weights, inner_products):
                 obj = value_loss(y, inner_products)
                 obj += value_penalty(weights)
                 return obj
 
-            return objective
+            return get_kernel(objective)
 
     def fit_time(self):
         # TODO : check_is_fitted is not throwing an error when it should
         check_is_fitted(self)
-        time_record = self.history_.records[1]
-        return time_record.record[time_record.cursor-1] - time_record.record[0]
+        if isinstance(self.history_, list):
+            # The binary problems of a one-vs-rest fit can be solved concurrently, so
+            # that the fit time is the wall time over all of them
+            return max(history.end_time for history in self.history_) - min(
+                history.start_time for history in self.history_
+            )
+        return self.history_.end_time - self.history_.start_time
 
 
-    def compute_objective_history(self, X, y, metric="objective"):
-        self.history_.allocate_record(1, metric)
-        new_record = self.history_.records[-1]
-        fit_intercept = self.fit_intercept
-        inner_products = np.empty((X.shape[0], self.n_classes), dtype=np_float)
+    def objective_batch_factory(self, y):
+        """Returns a kernel computing the objective at several iterates at once: its
+        arguments are the targets, the iterates of shape (n_iterates, n_weights,
+        n_classes), the inner products of shape (n_samples, n_iterates * n_classes)
+        and the output array of shape (n_iterates,). Iterates are processed in
+        parallel."""
+        value_loss = self._get_loss().value_batch_factory()
+        value_penalty = (self._get_penalty(len(y))).value_factory()
+        int_fit_intercept = int(self.fit_intercept)
+
+        @jit(**jit_kwargs, parallel=True)
+        def objectives(y, weights, inner_products, out):
+            n_iterates, _, n_classes = weights.shape
+            for t in prange(n_iterates):
+                obj = value_loss(
+                    y, inner_products[:, t * n_classes : (t + 1) * n_classes]
+                )
+                obj += value_penalty(weights[t, int_fit_intercept:])
+                out[t] = obj
 
-        # decision function
-        decision_function = decision_function_factory(X, fit_intercept)
+        return get_kernel(objectives)
+
+    def compute_objective_history(
+        self, X, y, metric="objective", X_test=None, y_test=None, chunk_size=None
+    ):
+        """Computes a metric at each iterate recorded in ``history_`` during fit, and
+        stores it in a new record of ``history_`` named after the metric. The
+        decision functions of several iterates are computed by a single matrix
+        product, and the metric is evaluated for these iterates in parallel.
+
+        Parameters
+        ----------
+        X : {array-like, sparse matrix} of shape (n_samples, n_features)
+            Samples on which the metric is computed.
+
+        y : array-like of shape (n_samples,)
+            Targets of the samples.
 
-        if metric == "objective":
-            # Get the objective function
-            obj = self.objective_factory(y)
-            metric_fct = lambda w, i_p, y: obj(w, i_p)
-        elif metric == "misclassif_rate":
+        metric : {'objective', 'misclassif_rate'}, default='objective'
+            The metric to compute, 'misclassif_rate' is only available for
+            classifiers.
+
+        X_test : {array-like, sparse matrix} of shape (n_test_samples, n_features), default=None
+            If not None, the metric is also computed on these samples and stored in a
+            record named after the metric with a '_test' suffix.
+
+        y_test : array-like of shape (n_test_samples,), default=None
+            Targets of the samples in X_test.
+
+        chunk_size : int or None, default=None
+            Number of iterates processed at once. By default, chunks are chosen so
+            that the decision functions of a chunk take about 64MB.
+        """
+        if isinstance(self.history_, list):
+            raise ValueError(
+                "Cannot compute the history of a one-vs-rest fit, compute it on each "
+                "binary problem instead"
+            )
+        if metric == "misclassif_rate":
             if self.__class__.__name__ != "Classifier":
                 raise ValueError("Cannot compute misclassification rates for Regressor")
+        elif metric != "objective":
+            raise ValueError("Unknown metric %r" % metric)
 
-            from sklearn.metrics import accuracy_score
-            classes = self.classes_
-            def metric_fct(w, i_p, y):
-                if i_p.ndim == 1:
-                    indices = (i_p > 0).astype(int)
-                else:
-                    indices = i_p.argmax(axis=1)
-                predictions = classes[indices]
-                return 1 - accuracy_score(y, predictions)
-        else:
-            raise ValueError("Unknown metric %r"%metric)
+        parameter_record = self.history_.record_nm("weights")
+        iterations = parameter_record.stored_iterations()
+        n_iterates = iterations.shape[0]
+        fit_intercept = self.fit_intercept
 
-        parameter_record = self.history_.records[0]
-        total_iter = parameter_record.cursor
+        datasets = [(X, y, metric)]
+        if X_test is not None:
+            datasets.append((X_test, y_test, metric + "_test"))
+        samples, targets, kernels, values = [], [], [], []
+        for X_, y_, _ in datasets:
+            X_ = check_array(
+                X_,
+                accept_sparse="csc",
+                dtype=np.dtype(self.dtype),
+                estimator=self.__class__.__name__,
+            )
+            y_ = np.asarray(y_)
+            if metric == "objective":
+                kernels.append(self.objective_batch_factory(y_))
+            else:
+                # Labels unseen during fit are encoded by -1, and never predicted
+                unseen = np.isin(y_, self.classes_, invert=True)
+                y_ = np.searchsorted(self.classes_, y_)
+                y_[unseen] = -1
+                kernels.append(misclassification_rates)
+            samples.append(X_)
+            targets.append(y_)
+            values.append(np.empty(n_iterates))
+
+        if chunk_size is None:
+            n_samples = max(X_.shape[0] for X_ in samples)
+            itemsize = np.dtype(self.dtype).itemsize
+            chunk_size = max(1, 2 ** 26 // (n_samples * self.n_classes * itemsize))
+
+        iterates = iter(parameter_record)
+        for start in range(0, n_iterates, chunk_size):
+            end = min(start + chunk_size, n_iterates)
+            weights = np.array([next(iterates) for _ in range(end - start)])
+            # Iterates are stacked in the columns of a single matrix
+            stacked = weights.transpose((1, 0, 2)).reshape((weights.shape[1], -1))
+            for X_, y_, kernel, out in zip(samples, targets, kernels, values):
+                inner_products = safe_sparse_dot(
+                    X_, stacked[int(fit_intercept) :], dense_output=True
+                )
+                if fit_intercept:
+                    inner_products += stacked[0]
+                kernel(y_, weights, inner_products, out[start:end])
 
-        for i in range(total_iter):  # totalitaire
-            weights = parameter_record.record[i]
-            decision_function(weights, inner_products)
-            new_record.update(metric_fct(weights, inner_products, y))
+        for (_, _, name), out in zip(datasets, values):
+            self.history_.allocate_record(1, name, capacity=n_iterates)
+            new_record = self.history_.record_nm(name)
+            for iteration, value in zip(iterations, out):
+                new_record.update(value, iteration)
 
     def fit(self, X, y, sample_weight=None, dummy_first_step=False):
         """
@@ -827,26 +1353,44 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
         -----
         sample_weight is not supported yet
         """
+        X, y_encoded = self._check_fit_data(X, y)
+        w = self._get_initial_iterate(X, y_encoded)
+        self._fit_weights(X, y_encoded, w, dummy_first_step=dummy_first_step)
+        return self
+
+    def _check_fit_data(self, X, y):
+        """Checks the training data and returns it in the layout and dtype used by
+        the solver, together with the encoded targets. For classifiers, this also sets
+        classes_ and n_classes and checks the loss."""
         # TODO: sample_weight support
 
         # Ideal data ordering depends on the solver
         # TODO: raise a warning if a copy is made ?
-        if self.solver == "cgd":
-            accept_sparse = "csc"
+        if self.solver in ["cgd", "parallel_cgd"]:
+            # Sparse features are only supported by the estimators below
+            if self.estimator in ["erm", "mom", "tmean", "ch"]:
+                accept_sparse = "csc"
+            else:
+                accept_sparse = False
             order = "F"
             accept_large_sparse = False
         else:
-            accept_sparse = "csr"
+            # Sparse features are only supported by the stochastic solvers below
+            if self.solver in ["sgd", "saga", "svrg"]:
+                accept_sparse = "csr"
+            else:
+                accept_sparse = False
             order = "C"
             accept_large_sparse = False
 
         estimator_name = self.__class__.__name__
         is_classifier = estimator_name == "Classifier"
+        dtype = np.dtype(self.dtype)
         X = check_array(
             X,
             order=order,
             accept_sparse=accept_sparse,
-            dtype="numeric",
+            dtype=dtype,
             accept_large_sparse=accept_large_sparse,
             estimator=estimator_name,
         )
@@ -872,9 +1416,12 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
             self.n_classes = len(self.classes_)
             if y_type == "binary":
                 # We need to put the targets in {-1, 1}
-                y_encoded = 2 * y_encoded - 1.0
+                y_encoded = (2 * y_encoded - 1.0).astype(dtype)
                 self.n_classes = 1
                 self._check_binary_loss()
+            elif self.multi_class == "ovr":
+                # One binary problem is fitted for each class
+                self._check_binary_loss()
             else:
                 self._check_multiclass_loss()
 
@@ -882,7 +1429,7 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
             y = check_array(
                 y, ensure_2d=False, dtype="numeric", estimator=estimator_name
             )
-            y_encoded = y
+            y_encoded = y.astype(dtype, copy=False)
             self.n_classes = 1
             self._check_regression_loss()
 
@@ -933,25 +1480,102 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
         if self.sparsity_ub <= 1:
             self.sparsity_ub = max(1, min(int(self.sparsity_ub * X.shape[1]), X.shape[0]))
 
-        #######
-        solver = self._get_solver(X, y_encoded)
-        w = self._get_initial_iterate(X, y_encoded)
-        optimization_result = solver.solve(w, dummy_first_step=dummy_first_step)
-        self.history_.record_nm("sc_prods").record = np.cumsum(self.history_.record_nm("sc_prods").record)
+        return X, y_encoded
+
+    def _fit_weights(self, X, y, w, step=None, dummy_first_step=False):
+        """Solves the training problem starting from the weights w, using the
+        precomputed step sizes step if given, and sets the fitted attributes."""
+        is_classifier = self.__class__.__name__ == "Classifier"
+        if is_classifier and self.n_classes > 1 and self.multi_class == "ovr":
+            w = self._fit_ovr(X, y, w, step, dummy_first_step)
+        else:
+            solver = self._get_solver(X, y, step=step)
+            n_threads = self._get_n_threads()
+            if n_threads > 1:
+                # The parallel kernels use n_threads threads
+                previous_n_threads = numba.get_num_threads()
+                numba.set_num_threads(n_threads)
+                try:
+                    optimization_result = solver.solve(
+                        w, dummy_first_step=dummy_first_step
+                    )
+                finally:
+                    numba.set_num_threads(previous_n_threads)
+            else:
+                optimization_result = solver.solve(
+                    w, dummy_first_step=dummy_first_step
+                )
 
-        self.optimization_result_ = optimization_result
-        self.n_iter_ = np.asarray([optimization_result.n_iter], dtype=np.int32)
+            self.optimization_result_ = optimization_result
+            self.n_iter_ = np.asarray([optimization_result.n_iter], dtype=np.int32)
 
-        w = optimization_result.w
+            w = optimization_result.w
 
         if self.fit_intercept:
             self.intercept_ = np.array([w[0]]).reshape(self.n_classes)
             self.coef_ = w[1:].T.copy()
         else:
-            self.intercept_ = np.zeros(self.n_classes)
+            self.intercept_ = np.zeros(self.n_classes, dtype=w.dtype)
             self.coef_ = w[:].T.copy()
 
-        return self
+    def path(self, X, y, Cs):
+        """
+        Fit the model along a regularization path. The problems are solved for the
+        values of C in increasing order (decreasing penalization strength), each one
+        starting from the solution of the previous one. The data checks, the step
+        sizes and the compiled kernels are shared by all the fits.
+
+        Parameters
+        ----------
+        X : {array-like, sparse matrix} of shape (n_samples, n_features)
+            Training vector, where n_samples is the number of samples and
+            n_features is the number of features.
+
+        y : array-like of shape (n_samples,)
+            Target vector relative to X.
+
+        Cs : array-like of shape (n_Cs,)
+            The values of the inverse of the penalization strength C.
+
+        Returns
+        -------
+        coefs : numpy.ndarray
+            A numpy array of shape (n_Cs, n_classes, n_features) containing the
+            coefficients obtained for each value of C, in the order of Cs.
+
+        intercepts : numpy.ndarray
+            A numpy array of shape (n_Cs, n_classes) containing the intercepts
+            obtained for each value of C, in the order of Cs.
+
+        Notes
+        -----
+        C is left unchanged, and the fitted attributes (coef_, intercept_, n_iter_,
+        history_, etc.) are the ones obtained for the largest value of C.
+        """
+        Cs = np.asarray(Cs, dtype=np.float64)
+        if Cs.ndim != 1 or Cs.size == 0 or np.any(Cs <= 0):
+            raise ValueError(
+                "Cs must be a non-empty sequence of positive numbers; got (Cs=%r)" % Cs
+            )
+        X, y_encoded = self._check_fit_data(X, y)
+        n_features = X.shape[1]
+        # The step sizes do not depend on C
+        step = self._get_step(X, self._get_loss())
+        w = self._get_initial_iterate(X, y_encoded)
+        coefs = np.empty((Cs.size, self.n_classes, n_features), dtype=X.dtype)
+        intercepts = np.empty((Cs.size, self.n_classes), dtype=X.dtype)
+        C = self.C
+        try:
+            for idx in np.argsort(Cs, kind="stable"):
+                self.C = float(Cs[idx])
+                self._fit_weights(X, y_encoded, w, step)
+                coefs[idx] = self.coef_
+                intercepts[idx] = self.intercept_
+                # The next problem starts from this solution
+                self._get_fitted_weights(w)
+        finally:
+            self.C = C
+        return coefs, intercepts
 
     def decision_function(self, X):
         """
@@ -975,9 +1599,9 @@ class BaseLearner(ClassifierMixin, BaseEstimator):
         # TODO: this is from scikit-learn, cite and put authors
         check_is_fitted(self)
 
-        # For now, no sparse arrays
-        # X = check_array(X, accept_sparse="csr")
-        X = check_array(X, accept_sparse=False, estimator=self.__class__.__name__)
+        X = check_array(
+            X, accept_sparse=["csr", "csc"], estimator=self.__class__.__name__
+        )
 
         n_features = self.coef_.shape[1]
         if X.shape[1] != n_features:
@@ -1060,8 +1684,17 @@ class Classifier(BaseLearner):
     random_state : int, default=None
         Used when the solver or the estimator involves random shuffling.
 
-    solver : {'cgd', 'gd', 'sgd', 'svrg', 'saga'}, default='cgd'
-        Algorithm to use in the optimization problem.
+    solver : {'cgd', 'parallel_cgd', 'gd', 'agd', 'lbfgs', 'sgd', 'svrg', 'saga'}, default='cgd'
+        Algorithm to use in the optimization problem. 'parallel_cgd' is an
+        asynchronous coordinate gradient descent, in which n_jobs threads update
+        distinct coordinates concurrently, well suited to wide sparse problems.
+        'agd' is an accelerated proximal gradient descent (FISTA) with adaptive
+        restart of the momentum and, with the 'erm' estimator, a backtracking line
+        search, which needs far fewer iterations than 'gd' on ill-conditioned
+        problems.
+        'lbfgs' is the limited-memory quasi-Newton solver L-BFGS (OWL-QN for the
+        'l1' and 'elasticnet' penalties), which only supports the 'erm' estimator
+        with a smooth loss and usually converges in a few tens of iterations.
 
         TODO: more blabla here
 
@@ -1074,11 +1707,19 @@ class Classifier(BaseLearner):
 
     warm_start : bool, default=False
         When set to True, reuse the solution of the previous call to fit as
-        initialization, otherwise, just erase the previous solution.
-        Useless for liblinear solver. See :term:`the Glossary <warm_start>`.
-
-        .. versionadded:: 0.17
-           *warm_start* to support *lbfgs*, *newton-cg*, *sag*, *saga* solvers.
+        initialization (when it has the right shape), otherwise, just erase the
+        previous solution. See :term:`the Glossary <warm_start>`.
+
+    n_jobs : int, default=None
+        Number of threads used by the 'cgd' solver with the 'erm', 'mom' (dense
+        features only) and 'tmean' estimators, which then split their loops over the
+        samples across threads, by the 'ch' estimator, which then computes the
+        gradient coordinates in parallel, and number of workers of the
+        'parallel_cgd' solver.
+        ``None`` means 1 (no parallelism) and ``-1`` means all the threads available
+        to numba. With 'cgd', the sums over samples are computed by chunks added in
+        a fixed order, so that results do not depend on the number of threads, while
+        the asynchronous updates of 'parallel_cgd' are not reproducible.
 
     l1_ratio : float, default=None
         The Elastic-Net mixing parameter, with ``0 <= l1_ratio <= 1``. Only
@@ -1087,6 +1728,70 @@ class Classifier(BaseLearner):
         to using ``penalty='l1'``. For ``0 < l1_ratio <1``, the penalty is a
         combination of L1 and L2.
 
+    dtype : {'float64', 'float32'}, default='float64'
+        Floating point type used for the features, the weights and the solver and
+        estimator buffers during training. Using 'float32' halves the memory
+        footprint and traffic of the training loops, while reductions are still
+        accumulated in float64.
+
+    block_resampling : {'coordinate', 'epoch'} or int, default='coordinate'
+        When the blocks of the 'mom' estimator are drawn again: for each partial
+        derivative ('coordinate'), once per epoch ('epoch') or every k epochs (an
+        integer k). Keeping the same blocks for an epoch or more removes a shuffle of
+        the samples from each partial derivative.
+
+    history_record : {'all', 'off', 'delta'} or int, default='all'
+        Which iterations are recorded in ``history_`` during training: all of them
+        ('all'), none of them ('off'), every k iterations (an integer k), or all of
+        them storing only the weights that changed since the previous iteration
+        ('delta').
+
+    history_size : int or None, default=None
+        If not None, only the last ``history_size`` recorded iterations are kept in
+        ``history_``. Cannot be used with ``history_record='delta'``.
+
+    screening : bool, default=False
+        With an 'l1' or 'elasticnet' penalty and the 'cgd' or 'parallel_cgd'
+        solvers, the features that are zero at the optimum are discarded from the
+        cycles during training. With the 'erm' estimator, a smooth loss and a single
+        output (regression or binary classification), the Gap Safe rule is used and
+        only features that are provably zero are discarded. Otherwise, the features
+        whose weights remained zero for some iterations are discarded, and all of
+        them are visited again before the solver stops.
+
+    working_set : bool, default=False
+        With an 'l1' or 'elasticnet' penalty and the 'cgd' or 'parallel_cgd'
+        solvers, the cycles only visit a working set of features, made of the
+        non-zero features and of the features violating the most the optimality
+        conditions. When the solver converges on the working set, the optimality
+        conditions are checked on all the features, and the size of the working set
+        is doubled if some of them are violated. This is much faster than visiting
+        all the features when most of them are zero at the optimum. Cannot be used
+        with ``screening=True``.
+
+    stopping_rule : {'weights', 'objective', 'gap', 'gradient'}, default='weights'
+        The quantity compared with ``tol`` to stop the solver: the maximum absolute
+        change of the weights during an iteration divided by the maximum absolute
+        weight ('weights'), the decrease of the objective divided by the objective
+        ('objective'), the duality gap divided by the objective ('gap') or the
+        infinity norm of the gradient mapping ('gradient'). 'objective' and 'gap'
+        can only be used with the 'erm' estimator, and 'gap' with a single output
+        (regression or binary classification) and a penalization. Only 'weights'
+        can be used with the 'md', 'da' and 'llc' solvers.
+
+    stopping_period : int, default=1
+        The stopping rule is evaluated every ``stopping_period`` iterations, which
+        amortizes the cost of the rules other than 'weights' (each evaluation costs
+        about one iteration of the solver).
+
+    multi_class : {'multinomial', 'ovr'}, default='multinomial'
+        How multiclass problems are fitted: a single problem with a multiclass loss
+        ('multinomial'), or one binary problem for each class against all the
+        others ('ovr'), fitted concurrently using ``n_jobs`` threads. With 'ovr',
+        ``history_`` and ``optimization_result_`` are lists with an element for
+        each class, and ``n_iter_`` contains the number of iterations of each
+        class.
+
     """
 
     def __init__(
@@ -1114,7 +1819,15 @@ class Classifier(BaseLearner):
         stage_length=10,
         Radius=1000,
         sparsity_ub=0.01,
-
+        dtype="float64",
+        block_resampling="coordinate",
+        history_record="all",
+        history_size=None,
+        screening=False,
+        working_set=False,
+        stopping_rule="weights",
+        stopping_period=1,
+        multi_class="multinomial",
     ):
         super(Classifier, self).__init__(
             penalty=penalty,
@@ -1138,12 +1851,73 @@ class Classifier(BaseLearner):
             stage_length=stage_length,
             Radius=Radius,
             sparsity_ub=sparsity_ub,
-
+            dtype=dtype,
+            block_resampling=block_resampling,
+            history_record=history_record,
+            history_size=history_size,
+            screening=screening,
+            working_set=working_set,
+            stopping_rule=stopping_rule,
+            stopping_period=stopping_period,
         )
 
         self.class_weight = class_weight
+        self.multi_class = multi_class
         self.classes_ = None
 
+    @property
+    def multi_class(self):
+        return self._multi_class
+
+    @multi_class.setter
+    def multi_class(self, val):
+        if val not in ["multinomial", "ovr"]:
+            raise ValueError(
+                "multi_class must be either 'multinomial' or 'ovr'; got (multi_class=%r)"
+                % val
+            )
+        else:
+            self._multi_class = val
+
+    def _fit_ovr(self, X, y, w, step=None, dummy_first_step=False):
+        """Fits a binary problem for each class (the class against all the others),
+        starting from the columns of w and using n_jobs threads, and returns the
+        weights of all the classes. The problems share X and the step sizes, which
+        do not depend on the labels."""
+        n_classes = self.n_classes
+        n_threads = self._get_n_threads()
+        # The solvers of the binary problems are single-threaded, the threads are
+        # used for the classes
+        self.n_classes = 1
+        try:
+            if step is None:
+                step = self._get_step(X, self._get_loss())
+            solvers = []
+            for k in range(n_classes):
+                y_k = np.where(y == k, 1.0, -1.0).astype(X.dtype)
+                solvers.append(self._get_solver(X, y_k, n_threads=1, step=step))
+        finally:
+            self.n_classes = n_classes
+
+        random_state = self.random_state
+
+        def solve(k):
+            if random_state is not None:
+                # The random generator of numba is local to each thread, it is seeded
+                # as for the fit of a binary classifier
+                numba_seed_numpy(random_state)
+            return solvers[k].solve(w[:, k : k + 1], dummy_first_step=dummy_first_step)
+
+        with ThreadPoolExecutor(max_workers=min(n_threads, n_classes)) as executor:
+            optimization_results = list(executor.map(solve, range(n_classes)))
+
+        self.optimization_result_ = optimization_results
+        self.n_iter_ = np.asarray(
+            [result.n_iter for result in optimization_results], dtype=np.int32
+        )
+        self.history_ = [solver.history for solver in solvers]
+        return np.hstack([result.w for result in optimization_results])
+
     def predict_proba(self, X):
         """
         Probability estimates.
@@ -1178,6 +1952,10 @@ class Classifier(BaseLearner):
         if self.n_classes == 1:
             expit(prob, out=prob)
             return np.vstack([1 - prob, prob]).T
+        elif self.multi_class == "ovr":
+            expit(prob, out=prob)
+            prob /= prob.sum(axis=1)[:, np.newaxis]
+            return prob
         else:
             return softmax(prob, axis=1)
 
@@ -1280,7 +2058,14 @@ class Regressor(BaseLearner, RegressorMixin):
         stage_length=10,
         Radius=1000,
         sparsity_ub=0.01,
-
+        dtype="float64",
+        block_resampling="coordinate",
+        history_record="all",
+        history_size=None,
+        screening=False,
+        working_set=False,
+        stopping_rule="weights",
+        stopping_period=1,
     ):
         super(Regressor, self).__init__(
             penalty=penalty,
@@ -1304,7 +2089,14 @@ class Regressor(BaseLearner, RegressorMixin):
             stage_length=stage_length,
             Radius=Radius,
             sparsity_ub=sparsity_ub,
-
+            dtype=dtype,
+            block_resampling=block_resampling,
+            history_record=history_record,
+            history_size=history_size,
+            screening=screening,
+            working_set=working_set,
+            stopping_rule=stopping_rule,
+            stopping_period=stopping_period,
         )
 
     def predict(self, X):
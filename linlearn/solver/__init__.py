@@ -6,12 +6,15 @@
 This module contains all the solvers available in ``linlearn``
 """
 
-from .cgd import CGD
-from .gd import GD, batch_GD
-from .md import MD
-from .da import DA
-from .sgd import SGD
-from .saga import SAGA
-from .svrg import SVRG
-from .llc19 import LLC19
+from .cgd import CGD, StateCGD
+from .parallel_cgd import ParallelCGD, StateParallelCGD
+from .gd import GD, batch_GD, StateGD
+from .agd import AGD, StateAGD
+from .lbfgs import LBFGS, StateLBFGS
+from .md import MD, StateMD
+from .da import DA, StateDA
+from .sgd import SGD, StateSGD
+from .saga import SAGA, StateSAGA
+from .svrg import SVRG, StateSVRG
+from .llc19 import LLC19, StateLLC19
 from .history import History, plot_history
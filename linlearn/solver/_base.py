@@ -3,7 +3,28 @@
 # License: BSD 3 clause
 
 """
-This module contains the base Solver class
+This module contains the base Solver class.
+
+The solvers stop when the quantity given by ``stopping_rule`` is below ``tol``, which
+is evaluated every ``stopping_period`` iterations:
+
+    'weights'
+        The maximum absolute change of the weights during the iteration divided by
+        the maximum absolute weight (this is free, so it is evaluated at each
+        iteration).
+
+    'objective'
+        The absolute decrease of the objective since its previous evaluation divided
+        by its absolute value (ERM estimator only).
+
+    'gap'
+        The duality gap divided by the objective (ERM estimator with a single output
+        and an l2 or l1 or elasticnet penalization only).
+
+    'gradient'
+        The infinity norm of the gradient mapping, namely the proximal gradient steps
+        of the coordinates divided by their learning rates, where the gradient is the
+        one of the estimator (smooth losses only).
 """
 
 from abc import ABC, abstractmethod
@@ -21,6 +42,8 @@ from collections import namedtuple
 
 # from .strategy import grad_coordinate_erm, decision_function, strategy_classes
 # from ._estimator import decision_function_
+from ._duality import duality_gap_factory
+from ..estimator import ERM
 from .._loss import decision_function_factory
 from .._utils import (
     NOPYTHON,
@@ -30,13 +53,18 @@ from .._utils import (
     nb_float,
     np_float,
     rand_choice_nb,
+    get_kernel,
+    matrix_type,
+    kernel_matrix,
+    sum_sq,
 )
 
 
-# TODO: good default for tol when using duality gap
 # TODO: step=float or {'best', 'auto'}
 # TODO: random_state same thing as in scikit
 
+stopping_rules = ("weights", "objective", "gap", "gradient")
+
 OptimizationResult = namedtuple(
     "OptimizationResult", ["n_iter", "tol", "success", "w", "message"]
 )
@@ -49,6 +77,10 @@ jit_kwargs = {
     "fastmath": FASTMATH,
 }
 
+# Options passed to the @jit decorator of the kernels splitting their loops over the
+# samples across threads
+jit_parallel_kwargs = {**jit_kwargs, "parallel": True}
+
 
 class Solver(ABC):
     def __init__(
@@ -63,6 +95,8 @@ class Solver(ABC):
         max_iter,
         tol,
         history,
+        stopping_rule="weights",
+        stopping_period=1,
     ):
         self.X = X
         self.y = y
@@ -73,6 +107,8 @@ class Solver(ABC):
         self.penalty = penalty
         self.max_iter = max_iter
         self.tol = tol
+        self.stopping_rule = stopping_rule
+        self.stopping_period = stopping_period
         self.n_samples, self.n_features = self.X.shape
         if self.fit_intercept:
             self.n_weights = (self.n_features + 1) * self.n_classes
@@ -81,21 +117,186 @@ class Solver(ABC):
             self.n_weights = self.n_features * self.n_classes
             self.weights_shape = (self.n_features, self.n_classes)
 
+        self._check_stopping_rule()
         self.history = history
-        self.history.allocate_record(self.weights_shape, "weights")
+        self.history.allocate_record(self.weights_shape, "weights", dtype=self.X.dtype)
         self.history.allocate_record(1, "time")
         self.history.allocate_record(1, "sc_prods")
 
+    def _check_stopping_rule(self):
+        stopping_rule = self.stopping_rule
+        if stopping_rule not in stopping_rules:
+            raise ValueError(
+                "stopping_rule must be one of %r; got (stopping_rule=%r)"
+                % (stopping_rules, stopping_rule)
+            )
+        if stopping_rule in ("objective", "gap") and not isinstance(
+            self.estimator, ERM
+        ):
+            raise ValueError(
+                "stopping_rule=%r can only be used with the 'erm' estimator"
+                % stopping_rule
+            )
+        if stopping_rule == "gap":
+            penalty = self.penalty
+            if self.n_classes != 1:
+                raise ValueError(
+                    "stopping_rule='gap' can only be used with a single output"
+                )
+            if penalty.strength * (penalty.scale_l1 + penalty.scale_l2sq) <= 0.0:
+                raise ValueError(
+                    "stopping_rule='gap' cannot be used without penalization"
+                )
+        if stopping_rule == "gradient" and not np.isfinite(self.loss.lip):
+            raise ValueError("stopping_rule='gradient' needs a smooth loss")
+
+    @abstractmethod
+    def get_state(self):
+        pass
+
     @abstractmethod
     def cycle_factory(self):
         pass
 
+    def screening_factory(self):
+        """Returns a function screening the coordinates visited by the cycles, or None
+        if the solver does not screen coordinates. The function is called before the
+        first iteration (with n_iter=0) and after each iteration as screen(n_iter, X,
+        y, coordinates, weights, inner_products, converged) and returns the
+        coordinates used by the next cycles together with the convergence status of
+        the solver.
+        """
+        return None
+
+    def stopping_factory(self):
+        """Returns the function deciding if the solver stops, which is called after
+        each iteration as stop(n_iter, weights, max_abs_delta, max_abs_weight), where
+        max_abs_delta and max_abs_weight are the maximum absolute change of the
+        weights during the iteration and the maximum absolute weight. The rules other
+        than 'weights' compute the inner products again, since the solvers do not
+        keep them up to date with the weights.
+        """
+        stopping_rule = self.stopping_rule
+        stopping_period = self.stopping_period
+        tol = self.tol
+
+        if stopping_rule == "weights":
+
+            def stop(n_iter, weights, max_abs_delta, max_abs_weight):
+                if max_abs_weight == 0.0:
+                    current_tol = 0.0
+                else:
+                    current_tol = max_abs_delta / max_abs_weight
+                return current_tol < tol
+
+            return stop
+
+        X = kernel_matrix(self.X)
+        y = self.y
+        fit_intercept = self.fit_intercept
+        penalty = self.penalty
+        inner_products = np.empty(
+            (self.n_samples, self.n_classes), dtype=self.X.dtype, order="F"
+        )
+        decision_function = decision_function_factory(
+            fit_intercept, matrix_type(self.X)
+        )
+
+        if stopping_rule == "objective":
+            value_loss = self.loss.value_batch_factory()
+            value_penalty = penalty.value_factory()
+            int_fit_intercept = int(fit_intercept)
+
+            @jit(**jit_kwargs)
+            def objective(y, weights, inner_products):
+                return value_loss(y, inner_products) + value_penalty(
+                    weights[int_fit_intercept:]
+                )
+
+            objective = get_kernel(objective)
+            previous = [np.inf]
+
+            def stop(n_iter, weights, max_abs_delta, max_abs_weight):
+                if n_iter % stopping_period != 0:
+                    return False
+                decision_function(X, weights, inner_products)
+                obj = objective(y, weights, inner_products)
+                decrease = fabs(previous[0] - obj)
+                previous[0] = obj
+                return decrease <= tol * fabs(obj)
+
+            return stop
+
+        elif stopping_rule == "gap":
+            duality_gap = get_kernel(
+                duality_gap_factory(self.loss, fit_intercept, matrix_type(self.X))
+            )
+            l1_strength = penalty.strength * penalty.scale_l1
+            l2_strength = penalty.strength * penalty.scale_l2sq
+            u = np.empty(self.n_samples, dtype=np_float)
+            u_in = np.empty(self.n_samples, dtype=np_float)
+
+            def stop(n_iter, weights, max_abs_delta, max_abs_weight):
+                if n_iter % stopping_period != 0:
+                    return False
+                decision_function(X, weights, inner_products)
+                primal, gap = duality_gap(
+                    X, y, weights, inner_products, u, u_in, l1_strength, l2_strength
+                )
+                return gap <= tol * primal
+
+            return stop
+
+        else:
+            n_classes = self.n_classes
+            partial_deriv_estimator = self.estimator.partial_deriv_factory()
+            penalize = penalty.apply_one_unscaled_factory()
+            # Learning rates given by the Lipschitz constants of the partial
+            # derivatives of the goodness-of-fit
+            lips = self.loss.lip * sum_sq(self.X, 0) / self.n_samples
+            if fit_intercept:
+                lips = np.concatenate(([self.loss.lip], lips))
+            steps = np.ones(self.weights_shape[0], dtype=np_float)
+            steps[lips > 0.0] = 1 / lips[lips > 0.0]
+            scaled_steps = penalty.strength * steps
+
+            @jit(**jit_kwargs)
+            def gradient_mapping(
+                X, y, weights, inner_products, state_estimator, steps, scaled_steps
+            ):
+                delta_j = state_estimator.partial_derivative
+                norm = 0.0
+                for j in range(weights.shape[0]):
+                    partial_deriv_estimator(X, y, j, inner_products, state_estimator)
+                    for k in range(n_classes):
+                        w_j_new = weights[j, k] - steps[j] * delta_j[k]
+                        if not (fit_intercept and j == 0):
+                            w_j_new = penalize(w_j_new, scaled_steps[j])
+                        norm = max(norm, fabs(w_j_new - weights[j, k]) / steps[j])
+                return norm
+
+            gradient_mapping = get_kernel(gradient_mapping)
+            # The solver uses its own estimator state
+            state_estimator = self.estimator.get_state()
+
+            def stop(n_iter, weights, max_abs_delta, max_abs_weight):
+                if n_iter % stopping_period != 0:
+                    return False
+                decision_function(X, weights, inner_products)
+                norm = gradient_mapping(
+                    X, y, weights, inner_products, state_estimator, steps, scaled_steps
+                )
+                return norm < tol
+
+            return stop
+
     def solve(self, w0=None, dummy_first_step=False):
-        X = self.X
+        X = kernel_matrix(self.X)
+        y = self.y
         fit_intercept = self.fit_intercept
-        inner_products = np.empty((self.n_samples, self.n_classes), dtype=np_float, order="F")
+        inner_products = np.empty((self.n_samples, self.n_classes), dtype=self.X.dtype, order="F")
         coordinates = np.arange(self.weights_shape[0], dtype=np.intp)
-        weights = np.empty(self.weights_shape, dtype=np_float)
+        weights = np.empty(self.weights_shape, dtype=self.X.dtype)
         tol = self.tol
         max_iter = self.max_iter
         history = self.history
@@ -105,8 +306,10 @@ class Solver(ABC):
             weights.fill(0.0)
 
         # Computation of the initial inner products
-        decision_function = decision_function_factory(X, fit_intercept)
-        decision_function(weights, inner_products)
+        decision_function = decision_function_factory(
+            fit_intercept, matrix_type(self.X)
+        )
+        decision_function(X, weights, inner_products)
 
         # random_state = self.random_state
         # if random_state is not None:
@@ -118,7 +321,11 @@ class Solver(ABC):
         #     numba_seed_numpy(random_state)
 
         # Get the cycle function
-        cycle = self.cycle_factory()
+        cycle = get_kernel(self.cycle_factory())
+        # Get the screening function (None if the solver does not screen coordinates)
+        screen = self.screening_factory()
+        # Get the function deciding if the solver stops
+        stop = self.stopping_factory()
         # Get the objective function
         # objective = self.objective_factory()
         # # Compute the first value of the objective
@@ -126,35 +333,53 @@ class Solver(ABC):
         # Get the estimator state (a place-holder for the estimator's internal
         # computations)
         state_estimator = self.estimator.get_state()
+        # Get the solver state (containing the learning rates)
+        state_solver = self.get_state()
 
         # TODO: First value for tolerance is 1.0 or NaN
         # history.update(epoch=0, obj=obj, tol=1.0, update_bar=True)
         if dummy_first_step:
-            cycle(coordinates, weights, inner_products, state_estimator)
+            cycle(
+                X,
+                y,
+                coordinates,
+                weights,
+                inner_products,
+                state_estimator,
+                state_solver,
+            )
             if w0 is not None:
                 weights[:] = w0
             else:
                 weights.fill(0.0)
-            decision_function(weights, inner_products)
+            decision_function(X, weights, inner_products)
+            # The dummy step must not change the states of the estimator and of the
+            # solver (such as warm starts or learning rates)
+            state_estimator = self.estimator.get_state()
+            state_solver = self.get_state()
+
+        if screen is not None:
+            coordinates, _ = screen(
+                0, X, y, coordinates, weights, inner_products, False
+            )
 
         history.update(weights, 0)
 
         for n_iter in range(1, max_iter + 1):
             max_abs_delta, max_abs_weight, sc_prods = cycle(
-                coordinates, weights, inner_products, state_estimator
+                X, y, coordinates, weights, inner_products, state_estimator, state_solver
             )
-            # Compute the new value of objective
-            # obj = objective(weights, inner_products)
-            if max_abs_weight == 0.0:
-                current_tol = 0.0
-            else:
-                current_tol = max_abs_delta / max_abs_weight
-
             # TODO: tester tous les cas "max_abs_weight == 0.0" etc..
             # history.update(epoch=n_iter, obj=obj, tol=current_tol, update_bar=True)
             history.update(weights, sc_prods)
 
-            if current_tol < tol:
+            converged = stop(n_iter, weights, max_abs_delta, max_abs_weight)
+            if screen is not None:
+                coordinates, converged = screen(
+                    n_iter, X, y, coordinates, weights, inner_products, converged
+                )
+
+            if converged:
                 history.close_bar()
                 return OptimizationResult(
                     w=weights, n_iter=n_iter, success=True, tol=tol, message=None
@@ -0,0 +1,225 @@
+# Authors: Stephane Gaiffas <stephane.gaiffas@gmail.com>
+#          Ibrahim Merad <imerad7@gmail.com>
+# License: BSD 3 clause
+
+"""
+This module contains the kernels building dual points of the ERM problem with a single
+output, which are used by the Gap Safe screening of ``CGD`` and by the 'gap' stopping
+rule of the solvers.
+
+The goodness-of-fit is F(z) = sum_i f(y_i, z_i) / n_samples at the inner products z,
+and the dual point u is given by the loss derivatives at z divided by n_samples, so
+that the conjugate of F at u follows from the Fenchel-Young equality. The losses have
+zero infimum, so that the conjugate is zero at zero and scaling u down bounds the
+conjugate by convexity.
+"""
+
+import numpy as np
+from math import fabs
+from numba import jit
+
+from .._utils import NOPYTHON, NOGIL, BOUNDSCHECK, FASTMATH
+
+
+jit_kwargs = {
+    "nopython": NOPYTHON,
+    "nogil": NOGIL,
+    "boundscheck": BOUNDSCHECK,
+    "fastmath": FASTMATH,
+}
+
+# Maximum number of doublings used to bracket the intercept shift giving a dual point,
+# and number of bisections refining the bracket
+N_BRACKET = 64
+N_BISECT = 20
+
+
+def column_kernels_factory(X_type):
+    """Returns the jit-compiled functions col_dot(X, j, u) computing the inner product
+    of column j of X with u, and col_axpy(X, j, a, inner_products) adding a times
+    column j of X to the inner products.
+
+    Parameters
+    ----------
+    X_type : {'csc', 'dense'}
+        The type of the features matrix.
+
+    Returns
+    -------
+    output : tuple
+        The functions col_dot and col_axpy
+    """
+    if X_type == "csc":
+
+        @jit(**jit_kwargs)
+        def col_dot(X, j, u):
+            indices, data = X.indices, X.data
+            out = 0.0
+            for idx in range(X.indptr[j], X.indptr[j + 1]):
+                out += data[idx] * u[indices[idx]]
+            return out
+
+        @jit(**jit_kwargs)
+        def col_axpy(X, j, a, inner_products):
+            indices, data = X.indices, X.data
+            for idx in range(X.indptr[j], X.indptr[j + 1]):
+                inner_products[indices[idx], 0] += a * data[idx]
+
+    else:
+
+        @jit(**jit_kwargs)
+        def col_dot(X, j, u):
+            out = 0.0
+            for i in range(X.shape[0]):
+                out += X[i, j] * u[i]
+            return out
+
+        @jit(**jit_kwargs)
+        def col_axpy(X, j, a, inner_products):
+            for i in range(X.shape[0]):
+                inner_products[i, 0] += a * X[i, j]
+
+    return col_dot, col_axpy
+
+
+def dual_point_factory(loss, fit_intercept):
+    """Returns the jit-compiled function dual_point(y, inner_products, u, u_in)
+    filling u with a dual point (up to scaling) and returning the conjugate of the
+    goodness-of-fit at u, together with False if no dual point was found.
+
+    Parameters
+    ----------
+    loss : Loss
+        The loss of the goodness-of-fit.
+
+    fit_intercept : bool
+        If True, the dual point must sum to zero.
+
+    Returns
+    -------
+    output : function
+        The function dual_point, where u_in is an array of shape (n_samples,) used as
+        scratch space.
+    """
+    value_loss = loss.value_factory()
+    deriv_loss = loss.deriv_factory()
+
+    @jit(**jit_kwargs)
+    def fenchel_young(y, inner_products, shift, u):
+        """Fills u with the loss derivatives at the inner products plus shift
+        (divided by n_samples), and returns the sum of the conjugates of the losses
+        at these derivatives (given by the Fenchel-Young equality) and the sum of
+        u."""
+        n_samples = y.shape[0]
+        z = np.empty(1)
+        deriv = np.empty(1)
+        sum_conjugates = 0.0
+        sum_u = 0.0
+        for i in range(n_samples):
+            z[0] = inner_products[i, 0] + shift
+            deriv_loss(y[i], z, deriv)
+            u[i] = deriv[0] / n_samples
+            sum_u += u[i]
+            sum_conjugates += u[i] * z[0] - value_loss(y[i], z) / n_samples
+        return sum_conjugates, sum_u
+
+    @jit(**jit_kwargs)
+    def dual_point(y, inner_products, u, u_in):
+        """With an intercept, u must sum to zero: the inner products are shifted by
+        values bracketing the root of the sum of the derivatives, and u is the
+        combination of the derivatives at both ends of the bracket summing to zero,
+        the conjugates being convex."""
+        sum_conjugates, sum_u = fenchel_young(y, inner_products, 0.0, u)
+        if not fit_intercept or sum_u == 0.0:
+            return sum_conjugates, True
+        # The sum of the derivatives is non-decreasing with the shift, shift_in is
+        # on the side of zero and shift_out on the other side of the root
+        direction = -1.0 if sum_u > 0.0 else 1.0
+        shift_in = 0.0
+        shift_out = direction
+        found = False
+        for _ in range(N_BRACKET):
+            _, sum_out = fenchel_young(y, inner_products, shift_out, u)
+            if sum_out * sum_u <= 0.0:
+                found = True
+                break
+            shift_in = shift_out
+            shift_out *= 2.0
+        if not found:
+            return 0.0, False
+        for _ in range(N_BISECT):
+            shift = 0.5 * (shift_in + shift_out)
+            _, sum_mid = fenchel_young(y, inner_products, shift, u)
+            if sum_mid * sum_u > 0.0:
+                shift_in = shift
+            else:
+                shift_out = shift
+        conjugates_in, sum_in = fenchel_young(y, inner_products, shift_in, u_in)
+        conjugates_out, sum_out = fenchel_young(y, inner_products, shift_out, u)
+        a = sum_out / (sum_out - sum_in)
+        for i in range(y.shape[0]):
+            u[i] = a * u_in[i] + (1.0 - a) * u[i]
+        return a * conjugates_in + (1.0 - a) * conjugates_out, True
+
+    return dual_point
+
+
+def duality_gap_factory(loss, fit_intercept, X_type):
+    """Returns the jit-compiled function duality_gap(X, y, weights, inner_products, u,
+    u_in, l1_strength, l2_strength) returning the primal objective and the duality
+    gap at the weights, for a penalization given by the l1 and l2sq strengths (one of
+    them at least must be positive).
+
+    Parameters
+    ----------
+    loss : Loss
+        The loss of the goodness-of-fit.
+
+    fit_intercept : bool
+        If True, the first weight is the intercept, which is not penalized.
+
+    X_type : {'csc', 'dense'}
+        The type of the features matrix.
+
+    Returns
+    -------
+    output : function
+        The function duality_gap, where u and u_in are arrays of shape (n_samples,)
+        used as scratch space.
+    """
+    value_loss = loss.value_factory()
+    dual_point = dual_point_factory(loss, fit_intercept)
+    col_dot, _ = column_kernels_factory(X_type)
+    int_fit_intercept = int(fit_intercept)
+
+    @jit(**jit_kwargs)
+    def duality_gap(
+        X, y, weights, inner_products, u, u_in, l1_strength, l2_strength
+    ):
+        n_samples, n_features = X.shape
+        sum_conjugates, found = dual_point(y, inner_products, u, u_in)
+        primal = 0.0
+        for i in range(n_samples):
+            primal += value_loss(y[i], inner_products[i])
+        primal /= n_samples
+        if not found:
+            return primal, np.inf
+        max_correlation = 0.0
+        conjugate_penalty = 0.0
+        for j in range(n_features):
+            w_j = weights[j + int_fit_intercept, 0]
+            primal += l1_strength * fabs(w_j) + 0.5 * l2_strength * w_j * w_j
+            correlation = fabs(col_dot(X, j, u))
+            max_correlation = max(max_correlation, correlation)
+            if l2_strength > 0.0 and correlation > l1_strength:
+                excess = correlation - l1_strength
+                conjugate_penalty += 0.5 * excess * excess / l2_strength
+        if l2_strength > 0.0:
+            dual = -sum_conjugates - conjugate_penalty
+        else:
+            # The conjugate of the l1 penalization is the indicator of the features
+            # with correlations below l1_strength: the dual point is scaled down
+            dual = -sum_conjugates / max(1.0, max_correlation / l1_strength)
+        return primal, max(primal - dual, 0.0)
+
+    return duality_gap
@@ -0,0 +1,213 @@
+# Authors: Stephane Gaiffas <stephane.gaiffas@gmail.com>
+#          Ibrahim Merad <imerad7@gmail.com>
+# License: BSD 3 clause
+
+"""
+This module contains the ``AGD`` class, for the accelerated proximal gradient descent
+solver (FISTA).
+
+Each iteration takes a proximal gradient step from the extrapolated point
+w_k + beta_k (w_k - w_{k-1}) of Nesterov's momentum. The momentum is restarted when
+the step goes against the momentum direction (gradient-based adaptive restart of
+O'Donoghue and Candes), which recovers the fast local convergence on strongly convex
+problems. With the ERM estimator, the learning rate is tuned by a backtracking line
+search on the goodness-of-fit, starting from a slightly larger learning rate than the
+one of the previous iteration. With the other estimators, the value of the
+goodness-of-fit is not estimated, so that the learning rate is fixed.
+
+``StateAGD`` is a place-holder for the AGD solver containing:
+
+    step : numpy.ndarray
+        A numpy array of shape (1,) containing the learning rate.
+
+    strength : float
+        The strength of the penalization.
+
+    t : numpy.ndarray
+        A numpy array of shape (1,) containing the momentum parameter of FISTA.
+
+    previous : numpy.ndarray
+        A numpy array of shape (n_weights, n_classes) containing the weights at the
+        previous iteration.
+
+    momentum : numpy.ndarray
+        A numpy array of shape (n_weights, n_classes) containing the extrapolated
+        point.
+
+    inner_products_momentum : numpy.ndarray
+        A numpy array of shape (n_samples, n_classes) containing the inner products
+        at the extrapolated point.
+"""
+
+from collections import namedtuple
+import numpy as np
+from math import fabs, sqrt
+from numba import jit
+
+from ._base import Solver, jit_kwargs
+from ..estimator import ERM
+from .._loss import decision_function_factory
+from .._utils import np_float, matrix_type
+
+
+StateAGD = namedtuple(
+    "StateAGD",
+    ["step", "strength", "t", "previous", "momentum", "inner_products_momentum"],
+)
+
+# Factors applied to the learning rate at the start of each iteration and at each
+# rejected step of the line search, and maximum number of rejected steps
+LINE_SEARCH_INCREASE = 1.1
+LINE_SEARCH_DECREASE = 0.5
+MAX_LINE_SEARCH = 50
+
+
+class AGD(Solver):
+    def __init__(
+        self,
+        X,
+        y,
+        loss,
+        n_classes,
+        fit_intercept,
+        estimator,
+        penalty,
+        max_iter,
+        tol,
+        step,
+        history,
+        stopping_rule="weights",
+        stopping_period=1,
+    ):
+        super(AGD, self).__init__(
+            X=X,
+            y=y,
+            loss=loss,
+            n_classes=n_classes,
+            fit_intercept=fit_intercept,
+            estimator=estimator,
+            penalty=penalty,
+            max_iter=max_iter,
+            tol=tol,
+            history=history,
+            stopping_rule=stopping_rule,
+            stopping_period=stopping_period,
+        )
+
+        # Automatic steps
+        self.step = step
+
+    def get_state(self):
+        """Returns the state of the AGD solver, which contains the learning rate, the
+        momentum parameter and the buffers used by the cycle.
+
+        Returns
+        -------
+        output : StateAGD
+            State of the AGD solver
+        """
+        return StateAGD(
+            step=np.array([self.step], dtype=np_float),
+            strength=self.penalty.strength,
+            t=np.ones(1, dtype=np_float),
+            previous=np.zeros(self.weights_shape, dtype=self.X.dtype),
+            momentum=np.empty(self.weights_shape, dtype=self.X.dtype),
+            inner_products_momentum=np.empty(
+                (self.n_samples, self.n_classes), dtype=self.X.dtype, order="F"
+            ),
+        )
+
+    def cycle_factory(self):
+        fit_intercept = self.fit_intercept
+        n_classes = self.n_classes
+        grad_estimator = self.estimator.grad_factory()
+        decision_function = decision_function_factory(
+            fit_intercept, matrix_type(self.X)
+        )
+        penalize = self.penalty.apply_one_unscaled_factory()
+        value_loss = self.loss.value_batch_factory()
+        # The line search needs the value of the goodness-of-fit
+        line_search = isinstance(self.estimator, ERM)
+
+        @jit(**jit_kwargs)
+        def cycle(
+            X, y, coordinates, weights, inner_products, state_estimator, state_solver
+        ):
+            n_samples = X.shape[0]
+            n_weights = weights.shape[0]
+            previous = state_solver.previous
+            momentum = state_solver.momentum
+            inner_products_momentum = state_solver.inner_products_momentum
+            strength = state_solver.strength
+            step = state_solver.step[0]
+            t = state_solver.t[0]
+            t_next = (1.0 + sqrt(1.0 + 4.0 * t * t)) / 2.0
+            beta = (t - 1.0) / t_next
+
+            # The extrapolated point, previous becomes the current weights
+            for j in range(n_weights):
+                for k in range(n_classes):
+                    momentum[j, k] = weights[j, k] + beta * (
+                        weights[j, k] - previous[j, k]
+                    )
+                    previous[j, k] = weights[j, k]
+
+            decision_function(X, momentum, inner_products_momentum)
+            sc_prods = n_samples + grad_estimator(
+                X, y, inner_products_momentum, state_estimator
+            )
+            grad = state_estimator.gradient
+
+            if line_search:
+                value_momentum = value_loss(y, inner_products_momentum)
+                step *= LINE_SEARCH_INCREASE
+
+            for _ in range(MAX_LINE_SEARCH):
+                # Proximal gradient step from the extrapolated point
+                for j in range(n_weights):
+                    for k in range(n_classes):
+                        w_jk = momentum[j, k] - step * grad[j, k]
+                        if fit_intercept and j == 0:
+                            weights[j, k] = w_jk
+                        else:
+                            weights[j, k] = penalize(w_jk, strength * step)
+                if not line_search:
+                    break
+                # The step is accepted if the goodness-of-fit is below its quadratic
+                # upper bound at the extrapolated point
+                decision_function(X, weights, inner_products)
+                sc_prods += n_samples
+                bound = value_momentum
+                for j in range(n_weights):
+                    for k in range(n_classes):
+                        delta = weights[j, k] - momentum[j, k]
+                        bound += grad[j, k] * delta + delta * delta / (2 * step)
+                if value_loss(y, inner_products) <= bound + 1e-12 * fabs(bound):
+                    break
+                step *= LINE_SEARCH_DECREASE
+
+            state_solver.step[0] = step
+
+            max_abs_delta = 0.0
+            max_abs_weight = 0.0
+            restart = 0.0
+            for j in range(n_weights):
+                for k in range(n_classes):
+                    delta = weights[j, k] - previous[j, k]
+                    restart += (momentum[j, k] - weights[j, k]) * delta
+                    abs_delta = fabs(delta)
+                    if abs_delta > max_abs_delta:
+                        max_abs_delta = abs_delta
+                    abs_weight = fabs(weights[j, k])
+                    if abs_weight > max_abs_weight:
+                        max_abs_weight = abs_weight
+
+            # The momentum is restarted when the step goes against it
+            if restart > 0.0:
+                state_solver.t[0] = 1.0
+            else:
+                state_solver.t[0] = t_next
+
+            return max_abs_delta, max_abs_weight, sc_prods
+
+        return cycle
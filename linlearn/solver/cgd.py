@@ -4,15 +4,59 @@
 
 """
 This module contains the ``CGD`` class, for the coordinate gradient descent solver.
+
+``StateCGD`` is a place-holder for the CGD solver containing:
+
+    steps : numpy.ndarray
+        A numpy array of shape (n_weights,) containing the learning rates of each
+        coordinate.
+
+    scaled_steps : numpy.ndarray
+        A numpy array of shape (n_weights,) containing the learning rates scaled by
+        the strength of the penalization.
+
+    coord_csum_probas : numpy.ndarray
+        A numpy array of shape (n_weights,) containing the cumulative probabilities
+        of the coordinates when using importance sampling (empty otherwise).
+
+With ``screening=True`` and an l1 or elasticnet penalization, the features that are
+zero at the optimum are discarded from the cycles every ``SCREENING_PERIOD``
+iterations. For the ERM estimator with a smooth loss and a single output, the
+Gap Safe rule is used: a dual point is built from the loss derivatives at the current
+inner products and the features whose correlation with any dual point in the sphere
+of radius given by the duality gap is below the penalization are provably zero. The
+l2sq part of the elasticnet penalization is handled as extra smooth samples. For
+other estimators, a heuristic rule discards the features whose weights remained zero
+between two screenings, and all features are visited again when the solver converges
+on the remaining ones, so that it does not stop while a discarded feature moves.
+
+With ``working_set=True`` and an l1 or elasticnet penalization, the cycles only visit
+a working set made of the intercept, the non-zero features and the features with the
+largest violations of the optimality conditions, namely the largest proximal gradient
+steps. When the solver converges on the working set, the violations of all the
+features are computed, and the solver stops if they are all below the tolerance, or
+otherwise goes on with a working set of doubled size (starting from
+``WORKING_SET_SIZE``).
 """
 
+from collections import namedtuple
 import numpy as np
-from math import fabs
+from math import fabs, sqrt
 from numpy.random import permutation
-from numba import jit
+from numba import jit, prange
+
+from ._base import Solver, jit_kwargs, jit_parallel_kwargs
+from ._duality import column_kernels_factory, dual_point_factory
+from ..estimator import ERM
+from .._utils import rand_choice_nb, np_float, matrix_type, sum_sq, get_kernel
+
 
-from ._base import Solver, jit_kwargs
-from .._utils import rand_choice_nb
+StateCGD = namedtuple("StateCGD", ["steps", "scaled_steps", "coord_csum_probas"])
+
+# Number of iterations between two screenings of the features
+SCREENING_PERIOD = 10
+# Initial size of the working set
+WORKING_SET_SIZE = 10
 
 
 class CGD(Solver):
@@ -30,6 +74,11 @@ class CGD(Solver):
         steps,
         history,
         importance_sampling=False,
+        parallel=False,
+        screening=False,
+        working_set=False,
+        stopping_rule="weights",
+        stopping_period=1,
     ):
         super(CGD, self).__init__(
             X=X,
@@ -42,56 +91,143 @@ class CGD(Solver):
             max_iter=max_iter,
             tol=tol,
             history=history,
+            stopping_rule=stopping_rule,
+            stopping_period=stopping_period,
         )
 
         # Automatic steps
         self.steps = steps
         self.importance_sampling = importance_sampling
-
-    def cycle_factory(self):
-
-        X = self.X
-        fit_intercept = self.fit_intercept
-        n_samples = self.estimator.n_samples
-        n_features = self.n_features
-        n_classes = self.n_classes
-        weights_dim1 = self.weights_shape[0]
-        partial_deriv_estimator = self.estimator.partial_deriv_factory()
-        penalize = self.penalty.apply_one_unscaled_factory()
-        steps = self.steps
-
+        self.parallel = parallel
+        if screening and importance_sampling:
+            raise ValueError(
+                "screening cannot be used with importance sampling of the coordinates"
+            )
+        if screening and working_set:
+            raise ValueError("screening and working_set cannot be used together")
+        if working_set and importance_sampling:
+            raise ValueError(
+                "working_set cannot be used with importance sampling of the coordinates"
+            )
+        self.screening = screening
+        self.working_set = working_set
+
+    def get_state(self):
+        """Returns the state of the CGD solver, which contains the learning rates
+        used by the cycle.
+
+        Returns
+        -------
+        output : StateCGD
+            State of the CGD solver
+        """
         # The learning rates scaled by the strength of the penalization (we use the
         # apply_one_unscaled penalization function)
         scaled_steps = self.steps.copy()
         scaled_steps *= self.penalty.strength
-
         if self.importance_sampling:
             coord_csum_probas = np.cumsum(1 / self.steps)
             coord_csum_probas /= coord_csum_probas[-1]
+        else:
+            coord_csum_probas = np.empty(0, dtype=np_float)
+        return StateCGD(
+            steps=self.steps,
+            scaled_steps=scaled_steps,
+            coord_csum_probas=coord_csum_probas,
+        )
+
+    def prepare_coordinates_factory(self):
+        """Returns a jit-compiled function filling the coordinates visited by a
+        cycle: a random permutation, or a sample from the importance sampling
+        distribution of the coordinates."""
+        if self.importance_sampling:
+
             @jit(**jit_kwargs)
-            def prepare_coordinates(coords):
-                rand_choice_nb(weights_dim1, coord_csum_probas, coords)
+            def prepare_coordinates(coords, coord_csum_probas):
+                rand_choice_nb(coords.shape[0], coord_csum_probas, coords)
 
         else:
 
             @jit(**jit_kwargs)
-            def prepare_coordinates(coords):
+            def prepare_coordinates(coords, coord_csum_probas):
                 np.random.shuffle(coords)
 
+        return prepare_coordinates
+
+    def cycle_factory(self):
+        prepare_coordinates = self.prepare_coordinates_factory()
+        sweep = self.sweep_factory()
+
+        @jit(**jit_kwargs)
+        def cycle(
+            X, y, coordinates, weights, inner_products, state_estimator, state_solver
+        ):
+            prepare_coordinates(coordinates, state_solver.coord_csum_probas)
+            return sweep(
+                X,
+                y,
+                coordinates,
+                weights,
+                inner_products,
+                state_estimator,
+                state_solver,
+            )
+
+        return cycle
+
+    def sweep_factory(self):
+        """Returns a jit-compiled function updating the given coordinates in turn,
+        which returns the maximum absolute update and the maximum absolute weight of
+        the updated coordinates, together with the number of scalar products used.
+        """
+        fit_intercept = self.fit_intercept
+        n_classes = self.n_classes
+        partial_deriv_estimator = self.estimator.partial_deriv_factory()
+        penalize = self.penalty.apply_one_unscaled_factory()
+
+        # The updates of the inner products run in parallel in parallel mode
+        kernel_kwargs = jit_parallel_kwargs if self.parallel else jit_kwargs
+
+        if matrix_type(self.X) == "csc":
+            # Only the non-zero entries of the column are used
+            @jit(**kernel_kwargs)
+            def update_inner_products(X, j, delta_j, inner_products, k):
+                indices, data = X.indices, X.data
+                start, end = X.indptr[j], X.indptr[j + 1]
+                for idx in prange(start, end):
+                    inner_products[indices[idx], k] += delta_j * data[idx]
+
+        else:
+
+            @jit(**kernel_kwargs)
+            def update_inner_products(X, j, delta_j, inner_products, k):
+                for i in prange(X.shape[0]):
+                    inner_products[i, k] += delta_j * X[i, j]
+
+        @jit(**kernel_kwargs)
+        def shift_inner_products(delta_j, inner_products, k):
+            for i in prange(inner_products.shape[0]):
+                inner_products[i, k] += delta_j
+
         if self.estimator == "llm":
             @jit(**jit_kwargs)
-            def step_scaler(state):
+            def step_scaler(state, n_features):
                 return 1 / np.sqrt(1 + state.n_pderiv_calls/n_features)
         else:
             @jit(**jit_kwargs)
-            def step_scaler(state):
+            def step_scaler(state, n_features):
                 return 1
 
 
         if fit_intercept:
 
             @jit(**jit_kwargs)
-            def cycle(coordinates, weights, inner_products, state_estimator):
+            def sweep(
+                X, y, coordinates, weights, inner_products, state_estimator, state_solver
+            ):
+                n_samples, n_features = X.shape
+                steps = state_solver.steps
+                scaled_steps = state_solver.scaled_steps
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
 
@@ -99,15 +235,13 @@ class CGD(Solver):
                 # inner_products = state_cgd.inner_products
                 # for idx in range(n_weights):
                 #     coordinates[idx] = idx
-                prepare_coordinates(coordinates)
-                # np.random.shuffle(coordinates)
-                step_scale = step_scaler(state_estimator)
+                step_scale = step_scaler(state_estimator, n_features)
 
                 w_j_new = state_estimator.loss_derivative
                 delta_j = state_estimator.partial_derivative
 
                 for j in coordinates:
-                    partial_deriv_estimator(j, inner_products, state_estimator)
+                    partial_deriv_estimator(X, y, j, inner_products, state_estimator)
                     for k in range(n_classes):
                         w_j_new[k] = weights[j, k] - steps[j] * step_scale * delta_j[k]
                     if j != 0:
@@ -129,38 +263,45 @@ class CGD(Solver):
                         if abs_w_j_new > max_abs_weight:
                             max_abs_weight = abs_w_j_new
 
+                        # The inner products (and the loss derivatives cached by the
+                        # estimator) are left untouched by zero updates
+                        if delta_j[k] == 0.0:
+                            continue
                         if j == 0:
-                            for i in range(n_samples):
-                                inner_products[i, k] += delta_j[k]
+                            shift_inner_products(delta_j[k], inner_products, k)
                         else:
-                            for i in range(n_samples):
-                                inner_products[i, k] += delta_j[k] * X[i, j - 1]
+                            update_inner_products(
+                                X, j - 1, delta_j[k], inner_products, k
+                            )
 
                     for k in range(n_classes):
                         weights[j, k] = w_j_new[k]
 
                 return max_abs_delta, max_abs_weight, n_samples
 
-            return cycle
+            return sweep
 
         else:
             # There is no intercept, so the code changes slightly
             @jit(**jit_kwargs)
-            def cycle(coordinates, weights, inner_products, state_estimator):
+            def sweep(
+                X, y, coordinates, weights, inner_products, state_estimator, state_solver
+            ):
+                n_samples, n_features = X.shape
+                steps = state_solver.steps
+                scaled_steps = state_solver.scaled_steps
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
                 # for idx in range(n_weights):
                 #     coordinates[idx] = idx
-                prepare_coordinates(coordinates)
-                # np.random.shuffle(coordinates)
-                step_scale = step_scaler(state_estimator)
+                step_scale = step_scaler(state_estimator, n_features)
 
                 # use available place holders in estimator state to avoid allocation
                 w_j_new = state_estimator.loss_derivative
                 delta_j = state_estimator.partial_derivative
                 for j in coordinates:
 
-                    partial_deriv_estimator(j, inner_products, state_estimator)
+                    partial_deriv_estimator(X, y, j, inner_products, state_estimator)
                     for k in range(n_classes):
                         w_j_new[k] = weights[j, k] - steps[j] * step_scale * delta_j[k]
                         w_j_new[k] = penalize(w_j_new[k], scaled_steps[j] * step_scale)
@@ -177,10 +318,258 @@ class CGD(Solver):
                         if abs_w_j_new > max_abs_weight:
                             max_abs_weight = abs_w_j_new
 
-                        for i in range(n_samples):
-                            inner_products[i, k] += delta_j[k] * X[i, j]
+                        if delta_j[k] != 0.0:
+                            update_inner_products(X, j, delta_j[k], inner_products, k)
 
                         weights[j, k] = w_j_new[k]
                 return max_abs_delta, max_abs_weight, n_samples
 
-            return cycle
+            return sweep
+
+    def screening_factory(self):
+        """Returns the function screening the features or selecting the working set,
+        or None if both are off or if the penalization does not involve an l1 part."""
+        if self.penalty.scale_l1 * self.penalty.strength <= 0.0:
+            return None
+        elif self.working_set:
+            return self._working_set_factory()
+        elif not self.screening:
+            return None
+        elif (
+            isinstance(self.estimator, ERM)
+            and self.n_classes == 1
+            and np.isfinite(self.loss.lip)
+        ):
+            return self._gap_safe_screening_factory()
+        else:
+            return self._heuristic_screening_factory()
+
+    def _gap_safe_screening_factory(self):
+        """Returns the function screening the features with the Gap Safe rule, which
+        is used for the ERM estimator with a smooth loss and a single output.
+
+        Returns
+        -------
+        output : function
+            A function discarding the features that are provably zero at the
+            optimum, and setting their weights to zero.
+        """
+        fit_intercept = self.fit_intercept
+        value_loss = self.loss.value_factory()
+        n_samples = self.n_samples
+        penalty = self.penalty
+        l1_strength = penalty.strength * penalty.scale_l1
+        l2_strength = penalty.strength * penalty.scale_l2sq
+        # Smoothness of the loss of each sample in the goodness-of-fit, which is also
+        # the one of the extra samples giving the l2sq part of the penalization
+        smoothness = self.loss.lip / n_samples
+        # Norms of the columns, with the entries of the extra samples
+        col_norms = np.sqrt(sum_sq(self.X, 0) + l2_strength / smoothness)
+
+        col_dot, col_axpy = column_kernels_factory(matrix_type(self.X))
+        dual_point = dual_point_factory(self.loss, fit_intercept)
+
+        @jit(**jit_kwargs)
+        def screen_features(
+            X,
+            y,
+            coordinates,
+            weights,
+            inner_products,
+            col_norms,
+            correlations,
+            u,
+            u_in,
+            l1_strength,
+            l2_strength,
+            smoothness,
+        ):
+            n_samples = y.shape[0]
+            n_coordinates = coordinates.shape[0]
+            sum_conjugates, found = dual_point(y, inner_products, u, u_in)
+            if not found:
+                return n_coordinates
+            primal = 0.0
+            for i in range(n_samples):
+                primal += value_loss(y[i], inner_products[i])
+            primal /= n_samples
+            # Correlations of the features with the dual point, given by the partial
+            # derivatives of the smooth part of the objective
+            max_correlation = 0.0
+            penalty_l1 = 0.0
+            penalty_l2sq = 0.0
+            for idx in range(n_coordinates):
+                j = coordinates[idx]
+                if fit_intercept and j == 0:
+                    continue
+                w_j = weights[j, 0]
+                correlations[j] = (
+                    col_dot(X, j - int(fit_intercept), u) + l2_strength * w_j
+                )
+                max_correlation = max(max_correlation, fabs(correlations[j]))
+                penalty_l1 += l1_strength * fabs(w_j)
+                penalty_l2sq += 0.5 * l2_strength * w_j * w_j
+            # The dual point is scaled to be feasible
+            scale = max(1.0, max_correlation / l1_strength)
+            # Conjugates are zero at zero (losses have zero infimum) so that they are
+            # bounded by convexity on the segment from zero to u
+            dual = -(sum_conjugates + penalty_l2sq) / scale
+            gap = max(primal + penalty_l1 + penalty_l2sq - dual, 0.0)
+            radius = sqrt(2.0 * gap * smoothness) / l1_strength
+            n_active = 0
+            for idx in range(n_coordinates):
+                j = coordinates[idx]
+                if not (fit_intercept and j == 0):
+                    col = j - int(fit_intercept)
+                    bound = fabs(correlations[j]) / (scale * l1_strength)
+                    if bound + radius * col_norms[col] < 1.0:
+                        # The feature is zero at the optimum and is discarded
+                        if weights[j, 0] != 0.0:
+                            col_axpy(X, col, -weights[j, 0], inner_products)
+                            weights[j, 0] = 0.0
+                        continue
+                coordinates[n_active] = j
+                n_active += 1
+            return n_active
+
+        screen_features = get_kernel(screen_features)
+        correlations = np.empty(self.weights_shape[0], dtype=np_float)
+        u = np.empty(n_samples, dtype=np_float)
+        u_in = np.empty(n_samples, dtype=np_float)
+
+        def screen(n_iter, X, y, coordinates, weights, inner_products, converged):
+            if converged or n_iter == 0 or n_iter % SCREENING_PERIOD != 0:
+                return coordinates, converged
+            n_active = screen_features(
+                X,
+                y,
+                coordinates,
+                weights,
+                inner_products,
+                col_norms,
+                correlations,
+                u,
+                u_in,
+                l1_strength,
+                l2_strength,
+                smoothness,
+            )
+            return coordinates[:n_active], converged
+
+        return screen
+
+    def _heuristic_screening_factory(self):
+        """Returns the function screening the features with a heuristic rule, which
+        discards the features whose weights remained zero between two screenings.
+        When the solver converges with discarded features, all features are visited
+        again and screening stops.
+
+        Returns
+        -------
+        output : function
+            A function discarding the features whose weights remained zero.
+        """
+        fit_intercept = self.fit_intercept
+        n_coordinates = self.weights_shape[0]
+        # Features with zero weights at the last screening
+        zero_before = np.zeros(n_coordinates, dtype=np.bool_)
+        # Whether all features were visited again after convergence
+        checked = [False]
+
+        def screen(n_iter, X, y, coordinates, weights, inner_products, converged):
+            if checked[0]:
+                return coordinates, converged
+            elif converged:
+                if coordinates.shape[0] < n_coordinates:
+                    checked[0] = True
+                    return np.arange(n_coordinates, dtype=np.intp), False
+                return coordinates, converged
+            elif n_iter == 0 or n_iter % SCREENING_PERIOD != 0:
+                return coordinates, converged
+            is_zero = np.all(weights == 0.0, axis=1)
+            if fit_intercept:
+                is_zero[0] = False
+            discard = is_zero[coordinates] & zero_before[coordinates]
+            zero_before[:] = is_zero
+            return coordinates[~discard], converged
+
+        return screen
+
+    def _working_set_factory(self):
+        """Returns the function selecting the working set of the coordinates visited
+        by the cycles. The working set is selected before the first iteration and
+        each time the solver converges on it, with a doubled size if some
+        coordinates outside of it violate the optimality conditions.
+
+        Returns
+        -------
+        output : function
+            A function returning the working set and whether the solver converged
+            on all the coordinates.
+        """
+        fit_intercept = self.fit_intercept
+        n_classes = self.n_classes
+        n_coordinates = self.weights_shape[0]
+        tol = self.tol
+        partial_deriv_estimator = self.estimator.partial_deriv_factory()
+        penalize = self.penalty.apply_one_unscaled_factory()
+
+        @jit(**jit_kwargs)
+        def compute_violations(
+            X,
+            y,
+            weights,
+            inner_products,
+            state_estimator,
+            steps,
+            scaled_steps,
+            violations,
+        ):
+            # The violation of a coordinate is the size of its proximal gradient step
+            delta_j = state_estimator.partial_derivative
+            for j in range(weights.shape[0]):
+                violations[j] = 0.0
+                if fit_intercept and j == 0:
+                    continue
+                partial_deriv_estimator(X, y, j, inner_products, state_estimator)
+                for k in range(n_classes):
+                    w_j_new = penalize(
+                        weights[j, k] - steps[j] * delta_j[k], scaled_steps[j]
+                    )
+                    violations[j] = max(violations[j], fabs(w_j_new - weights[j, k]))
+
+        compute_violations = get_kernel(compute_violations)
+        # The cycles use their own estimator state, so the violations use another one
+        state_estimator = self.estimator.get_state()
+        state_cgd = CGD.get_state(self)
+        violations = np.empty(n_coordinates, dtype=np_float)
+        size = [WORKING_SET_SIZE]
+
+        def select(n_iter, X, y, coordinates, weights, inner_products, converged):
+            if n_iter > 0 and (not converged or coordinates.shape[0] == n_coordinates):
+                return coordinates, converged
+            compute_violations(
+                X,
+                y,
+                weights,
+                inner_products,
+                state_estimator,
+                state_cgd.steps,
+                state_cgd.scaled_steps,
+                violations,
+            )
+            if n_iter > 0:
+                if violations.max() <= tol * np.abs(weights).max():
+                    return coordinates, True
+                size[0] *= 2
+            # The intercept and the non-zero features are always in the working set
+            priorities = violations.copy()
+            is_active = np.any(weights != 0.0, axis=1)
+            if fit_intercept:
+                is_active[0] = True
+            priorities[is_active] = np.inf
+            size[0] = min(max(size[0], 2 * int(is_active.sum())), n_coordinates)
+            working_set = np.argsort(-priorities, kind="stable")[: size[0]]
+            return np.sort(working_set).astype(np.intp), False
+
+        return select
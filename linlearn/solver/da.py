@@ -4,8 +4,20 @@
 
 """
 This module contains the ``GD`` class, for gradient descent solver.
+
+``StateDA`` is a place-holder for the DA solver containing:
+
+    step : float
+        The learning rate.
+
+    p : float
+        The exponent of the distance generating function.
+
+    dgf_factor : float
+        The factor of the distance generating function.
 """
 
+from collections import namedtuple
 import numpy as np
 from math import fabs
 from warnings import warn
@@ -13,7 +25,10 @@ from numba import jit
 
 from ._base import Solver, OptimizationResult, jit_kwargs
 from .._loss import decision_function_factory
-from .._utils import np_float, hardthresh, prox
+from .._utils import np_float, hardthresh, prox, get_kernel
+
+
+StateDA = namedtuple("StateDA", ["step", "p", "dgf_factor"])
 
 
 # @jit(**jit_kwargs)
@@ -91,20 +106,25 @@ class DA(Solver):
 
         self.step = step
 
+    def get_state(self):
+        """Returns the state of the DA solver, which contains the learning rate and
+        the parameters of the distance generating function used by the cycle.
+
+        Returns
+        -------
+        output : StateDA
+            State of the DA solver
+        """
+        return StateDA(step=self.step, p=self.p, dgf_factor=self.dgf_factor)
+
     def cycle_factory(self):
 
-        X = self.X
         fit_intercept = self.fit_intercept
 
-        n_features = self.n_features
-        n_samples = self.n_samples
         n_classes = self.n_classes
         grad_estimator = self.estimator.grad_factory()
-        decision_function = decision_function_factory(X, fit_intercept)
+        decision_function = decision_function_factory(fit_intercept)
         R = self.R
-        p = self.p
-        C = self.dgf_factor
-        step = self.step
 
         if self.estimator == "llm":
             @jit(**jit_kwargs)
@@ -118,13 +138,27 @@ class DA(Solver):
         if fit_intercept:
 
             @jit(**jit_kwargs)
-            def cycle(w0, weights, inner_products, state_estimator, s_t, t):
+            def cycle(
+                X,
+                y,
+                w0,
+                weights,
+                inner_products,
+                state_estimator,
+                state_solver,
+                s_t,
+                t,
+            ):
+                n_features = X.shape[1]
+                step = state_solver.step
+                p = state_solver.p
+                C = state_solver.dgf_factor
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
 
-                decision_function(weights, inner_products)
+                decision_function(X, weights, inner_products)
 
-                grad_estimator(inner_products, state_estimator)
+                grad_estimator(X, y, inner_products, state_estimator)
 
                 grad = state_estimator.gradient
                 # TODO : allocate w_new somewhere ?
@@ -163,12 +197,26 @@ class DA(Solver):
         else:
             # There is no intercept, so the code changes slightly
             @jit(**jit_kwargs)
-            def cycle(w0, weights, inner_products, state_estimator, s_t, t):
+            def cycle(
+                X,
+                y,
+                w0,
+                weights,
+                inner_products,
+                state_estimator,
+                state_solver,
+                s_t,
+                t,
+            ):
+                n_features = X.shape[1]
+                step = state_solver.step
+                p = state_solver.p
+                C = state_solver.dgf_factor
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
-                decision_function(weights, inner_products)
+                decision_function(X, weights, inner_products)
 
-                grad_estimator(inner_products, state_estimator)
+                grad_estimator(X, y, inner_products, state_estimator)
                 grad = state_estimator.gradient
                 # TODO : allocate w_new somewhere ?
 
@@ -197,9 +245,10 @@ class DA(Solver):
 
     def solve(self, w0=None, dummy_first_step=False):
         X = self.X
+        y = self.y
         fit_intercept = self.fit_intercept
-        inner_products = np.empty((self.n_samples, self.n_classes), dtype=np_float)
-        weights = np.empty(self.weights_shape, dtype=np_float)
+        inner_products = np.empty((self.n_samples, self.n_classes), dtype=self.X.dtype)
+        weights = np.empty(self.weights_shape, dtype=self.X.dtype)
         sample_indices = np.arange(self.n_samples, dtype=np.uintp)
         tol = self.tol
         max_iter = self.max_iter
@@ -213,25 +262,28 @@ class DA(Solver):
             weights.fill(0.0)
 
         # Computation of the initial inner products
-        decision_function = decision_function_factory(X, fit_intercept)
-        decision_function(weights, inner_products)
+        decision_function = decision_function_factory(fit_intercept)
+        decision_function(X, weights, inner_products)
 
             # Get the cycle function
-        cycle = self.cycle_factory()
+        cycle = get_kernel(self.cycle_factory())
         # Get the estimator state (a place-holder for the estimator's internal
         # computations)
         state_estimator = self.estimator.get_state()
+        state_solver = self.get_state()
 
         # TODO: First value for tolerance is 1.0 or NaN
         # history.update(epoch=0, obj=obj, tol=1.0, update_bar=True)
         s_t = np.zeros_like(weights)
         if dummy_first_step:
-            cycle(w0, weights, inner_products, state_estimator, s_t, 0)
+            cycle(
+                X, y, w0, weights, inner_products, state_estimator, state_solver, s_t, 0
+            )
             if w0 is not None:
                 weights[:] = w0
             else:
                 weights.fill(0.0)
-            decision_function(weights, inner_products)
+            decision_function(X, weights, inner_products)
 
         history.update(weights, 0)
         s_t.fill(0.0)
@@ -242,7 +294,15 @@ class DA(Solver):
             for t in range(stage_length):
 
                 max_abs_delta, max_abs_weight = cycle(
-                    w0, weights, inner_products, state_estimator, s_t, t
+                    X,
+                    y,
+                    w0,
+                    weights,
+                    inner_products,
+                    state_estimator,
+                    state_solver,
+                    s_t,
+                    t,
                 )
                 # Compute the new value of objective
                 # obj = objective(weights, inner_products)
@@ -4,8 +4,17 @@
 
 """
 This module contains the ``GD`` class, for gradient descent solver.
+
+``StateGD`` is a place-holder for the GD solver containing:
+
+    step : float
+        The learning rate.
+
+    scaled_step : float
+        The learning rate scaled by the strength of the penalization.
 """
 
+from collections import namedtuple
 import numpy as np
 from math import fabs
 from warnings import warn
@@ -13,7 +22,10 @@ from numba import jit
 
 from ._base import Solver, OptimizationResult, jit_kwargs
 from .._loss import decision_function_factory, batch_decision_function_factory
-from .._utils import np_float
+from .._utils import np_float, get_kernel
+
+
+StateGD = namedtuple("StateGD", ["step", "scaled_step"])
 
 
 class GD(Solver):
@@ -30,6 +42,8 @@ class GD(Solver):
         tol,
         step,
         history,
+        stopping_rule="weights",
+        stopping_period=1,
     ):
         super(GD, self).__init__(
             X=X,
@@ -42,24 +56,35 @@ class GD(Solver):
             max_iter=max_iter,
             tol=tol,
             history=history,
+            stopping_rule=stopping_rule,
+            stopping_period=stopping_period,
         )
 
         # Automatic steps
         self.step = step
 
+    def get_state(self):
+        """Returns the state of the solver, which contains the learning rate used
+        by the cycle.
+
+        Returns
+        -------
+        output : StateGD
+            State of the solver
+        """
+        # The learning rate scaled by the strength of the penalization (we use the
+        # apply_one_unscaled penalization function)
+        return StateGD(step=self.step, scaled_step=self.penalty.strength * self.step)
+
     def cycle_factory(self):
 
-        X = self.X
         fit_intercept = self.fit_intercept
 
-        n_features = self.n_features
-        n_samples = self.n_samples
         n_classes = self.n_classes
         grad_estimator = self.estimator.grad_factory()
-        decision_function = decision_function_factory(X, fit_intercept)
+        decision_function = decision_function_factory(fit_intercept)
 
         penalize = self.penalty.apply_one_unscaled_factory()
-        step = self.step
 
         if self.estimator == "llm":
             @jit(**jit_kwargs)
@@ -70,25 +95,26 @@ class GD(Solver):
             def step_scaler(state):
                 return 1.0
 
-        # The learning rates scaled by the strength of the penalization (we use the
-        # apply_one_unscaled penalization function)
-        scaled_step = self.penalty.strength * self.step
-
         if fit_intercept:
 
             @jit(**jit_kwargs)
-            def cycle(coordinates, weights, inner_products, state_estimator):
+            def cycle(
+                X, y, coordinates, weights, inner_products, state_estimator, state_solver
+            ):
+                n_samples, n_features = X.shape
+                step = state_solver.step
+                scaled_step = state_solver.scaled_step
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
 
-                decision_function(weights, inner_products)
+                decision_function(X, weights, inner_products)
                 # for k in range(n_classes):
                 #     for i in range(n_samples):
                 #         inner_products[i, k] = weights[0,k]
                 #         for j in range(n_features):
                 #             inner_products[i, k] += X[i, j] * weights[j+1, k]
 
-                grad_estim_sc_prods = grad_estimator(inner_products, state_estimator)
+                grad_estim_sc_prods = grad_estimator(X, y, inner_products, state_estimator)
 
                 grad = state_estimator.gradient
                 # TODO : allocate w_new somewhere ?
@@ -127,12 +153,17 @@ class GD(Solver):
         else:
             # There is no intercept, so the code changes slightly
             @jit(**jit_kwargs)
-            def cycle(coordinates, weights, inner_products, state_estimator):
+            def cycle(
+                X, y, coordinates, weights, inner_products, state_estimator, state_solver
+            ):
+                n_samples, n_features = X.shape
+                step = state_solver.step
+                scaled_step = state_solver.scaled_step
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
-                decision_function(weights, inner_products)
+                decision_function(X, weights, inner_products)
 
-                grad_estim_sc_prods = grad_estimator(inner_products, state_estimator)
+                grad_estim_sc_prods = grad_estimator(X, y, inner_products, state_estimator)
                 grad = state_estimator.gradient
                 # TODO : allocate w_new somewhere ?
                 w_new = weights - step * step_scaler(state_estimator) * grad
@@ -173,6 +204,8 @@ class batch_GD(Solver):
         step,
         history,
         batch_size=1.0,
+        stopping_rule="weights",
+        stopping_period=1,
     ):
         super(batch_GD, self).__init__(
             X=X,
@@ -185,41 +218,53 @@ class batch_GD(Solver):
             max_iter=max_iter,
             tol=tol,
             history=history,
+            stopping_rule=stopping_rule,
+            stopping_period=stopping_period,
         )
 
         # Automatic steps
         self.step = step
         self.batch_size = batch_size
 
+    def get_state(self):
+        """Returns the state of the solver, which contains the learning rate used
+        by the cycle.
+
+        Returns
+        -------
+        output : StateGD
+            State of the solver
+        """
+        # The learning rate scaled by the strength of the penalization (we use the
+        # apply_one_unscaled penalization function)
+        return StateGD(step=self.step, scaled_step=self.penalty.strength * self.step)
+
     def cycle_factory(self):
 
-        X = self.X
-        y = self.y
         fit_intercept = self.fit_intercept
-        n_samples = self.estimator.n_samples
         n_classes = self.n_classes
-        n_features = self.n_features
         deriv_loss = self.loss.deriv_factory()
-        decision_function = batch_decision_function_factory(X, fit_intercept, n_classes, n_features)
+        decision_function = batch_decision_function_factory(fit_intercept, n_classes)
 
         penalize = self.penalty.apply_one_unscaled_factory()
-        step = self.step
-        n_samples_batch = int(self.batch_size * n_samples)
-
-        # The learning rates scaled by the strength of the penalization (we use the
-        # apply_one_unscaled penalization function)
-        scaled_step = self.penalty.strength * self.step
+        batch_size = self.batch_size
 
         if fit_intercept:
 
             @jit(**jit_kwargs)
-            def cycle(sample_indices, weights, inner_products, state_estimator):
+            def cycle(
+                X, y, sample_indices, weights, inner_products, state_estimator, state_solver
+            ):
+                n_samples, n_features = X.shape
+                n_samples_batch = int(batch_size * n_samples)
+                step = state_solver.step
+                scaled_step = state_solver.scaled_step
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
 
                 np.random.shuffle(sample_indices)
 
-                decision_function(weights, inner_products, sample_indices[:n_samples_batch])
+                decision_function(X, weights, inner_products, sample_indices[:n_samples_batch])
 
                 grad = state_estimator.gradient
                 deriv = state_estimator.loss_derivative
@@ -273,13 +318,19 @@ class batch_GD(Solver):
         else:
             # There is no intercept, so the code changes slightly
             @jit(**jit_kwargs)
-            def cycle(sample_indices, weights, inner_products, state_estimator):
+            def cycle(
+                X, y, sample_indices, weights, inner_products, state_estimator, state_solver
+            ):
+                n_samples, n_features = X.shape
+                n_samples_batch = int(batch_size * n_samples)
+                step = state_solver.step
+                scaled_step = state_solver.scaled_step
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
                 np.random.shuffle(sample_indices)
 
-                # decision_function(weights, inner_products)
-                decision_function(weights, inner_products, sample_indices[:n_samples_batch])
+                # decision_function(X, weights, inner_products)
+                decision_function(X, weights, inner_products, sample_indices[:n_samples_batch])
 
                 grad = state_estimator.gradient
                 deriv = state_estimator.loss_derivative
@@ -319,9 +370,10 @@ class batch_GD(Solver):
 
     def solve(self, w0=None, dummy_first_step=False):
         X = self.X
+        y = self.y
         fit_intercept = self.fit_intercept
-        inner_products = np.empty((self.n_samples, self.n_classes), dtype=np_float)
-        weights = np.empty(self.weights_shape, dtype=np_float)
+        inner_products = np.empty((self.n_samples, self.n_classes), dtype=self.X.dtype)
+        weights = np.empty(self.weights_shape, dtype=self.X.dtype)
         sample_indices = np.arange(self.n_samples, dtype=np.uintp)
         tol = self.tol
         max_iter = self.max_iter
@@ -332,8 +384,8 @@ class batch_GD(Solver):
             weights.fill(0.0)
 
         # Computation of the initial inner products
-        decision_function = decision_function_factory(X, fit_intercept)
-        decision_function(weights, inner_products)
+        decision_function = decision_function_factory(fit_intercept)
+        decision_function(X, weights, inner_products)
 
         # random_state = self.random_state
         # if random_state is not None:
@@ -345,7 +397,9 @@ class batch_GD(Solver):
         #     numba_seed_numpy(random_state)
 
         # Get the cycle function
-        cycle = self.cycle_factory()
+        cycle = get_kernel(self.cycle_factory())
+        # Get the function deciding if the solver stops
+        stop = self.stopping_factory()
         # Get the objective function
         # objective = self.objective_factory()
         # # Compute the first value of the objective
@@ -353,35 +407,46 @@ class batch_GD(Solver):
         # Get the estimator state (a place-holder for the estimator's internal
         # computations)
         state_estimator = self.estimator.get_state()
+        # Get the solver state (containing the learning rate)
+        state_solver = self.get_state()
 
         # TODO: First value for tolerance is 1.0 or NaN
         # history.update(epoch=0, obj=obj, tol=1.0, update_bar=True)
         if dummy_first_step:
-            cycle(sample_indices, weights, inner_products, state_estimator)
+            cycle(
+                X,
+                y,
+                sample_indices,
+                weights,
+                inner_products,
+                state_estimator,
+                state_solver,
+            )
             if w0 is not None:
                 weights[:] = w0
             else:
                 weights.fill(0.0)
-            decision_function(weights, inner_products)
+            decision_function(X, weights, inner_products)
 
         history.update(weights, 0)
 
         for n_iter in range(1, max_iter + 1):
             max_abs_delta, max_abs_weight, sc_prods = cycle(
-                sample_indices, weights, inner_products, state_estimator
+                X,
+                y,
+                sample_indices,
+                weights,
+                inner_products,
+                state_estimator,
+                state_solver,
             )
             # Compute the new value of objective
             # obj = objective(weights, inner_products)
-            if max_abs_weight == 0.0:
-                current_tol = 0.0
-            else:
-                current_tol = max_abs_delta / max_abs_weight
-
             # TODO: tester tous les cas "max_abs_weight == 0.0" etc..
             # history.update(epoch=n_iter, obj=obj, tol=current_tol, update_bar=True)
             history.update(weights, sc_prods)
 
-            if current_tol < tol:
+            if stop(n_iter, weights, max_abs_delta, max_abs_weight):
                 history.close_bar()
                 return OptimizationResult(
                     w=weights, n_iter=n_iter, success=True, tol=tol, message=None
@@ -19,38 +19,150 @@ with warnings.catch_warnings():
 
 
 class Record(object):
-    def __init__(self, shape, capacity, name):
+    """Records the values given to ``update`` in an array of given capacity. When
+    ``ring`` is True, the record keeps only the last ``capacity`` values, overwriting
+    the oldest ones, otherwise it can hold at most ``capacity`` values.
+
+    The ``record`` attribute is the raw storage and ``iterations`` contains the
+    iteration numbers of the stored values, iterating over the record gives the stored
+    values in chronological order.
+    """
+
+    def __init__(self, shape, capacity, name, dtype=np.float64, ring=False):
         self.record = (
-            np.zeros(capacity)
+            np.zeros(capacity, dtype=dtype)
             if shape == 1
-            else np.zeros(tuple([capacity] + list(shape)))
+            else np.zeros(tuple([capacity] + list(shape)), dtype=dtype)
         )
+        self.iterations = np.zeros(capacity, dtype=np.intp)
         self.name = name
+        self.ring = ring
         self.cursor = 0
 
-    def update(self, value):
-        self.record[self.cursor] = value
+    def update(self, value, iteration=None):
+        if iteration is None:
+            iteration = self.cursor
+        position = self.cursor % len(self) if self.ring else self.cursor
+        self.record[position] = value
+        self.iterations[position] = iteration
         self.cursor += 1
 
     def clear(self):
         self.cursor = 0
 
+    def _order(self):
+        if self.ring and self.cursor > len(self):
+            start = self.cursor % len(self)
+            return np.roll(np.arange(len(self)), -start)
+        else:
+            return np.arange(min(self.cursor, len(self)))
+
+    def stored_iterations(self):
+        """Iteration numbers of the stored values, in chronological order"""
+        return self.iterations[self._order()]
+
+    def values(self):
+        """Stored values, in chronological order"""
+        return self.record[self._order()]
+
+    def __iter__(self):
+        for position in self._order():
+            yield self.record[position]
+
     def __len__(self):
         return self.record.shape[0]
 
 
+class DeltaRecord(object):
+    """Records the values given to ``update`` by storing only the entries that changed
+    since the previous update, which is cheap for iterates that change few
+    coordinates at a time. Iterating over the record rebuilds the stored values in
+    chronological order, one at a time.
+    """
+
+    def __init__(self, shape, name, dtype=np.float64):
+        self.last = np.zeros(shape, dtype=dtype)
+        self.iterations = []
+        self.changed_indices = []
+        self.changed_values = []
+        self.name = name
+        self.cursor = 0
+
+    def update(self, value, iteration=None):
+        if iteration is None:
+            iteration = self.cursor
+        # The first update stores all the entries
+        value = np.asarray(value, dtype=self.last.dtype).ravel()
+        last = self.last.ravel()
+        if self.cursor == 0:
+            indices = np.arange(value.shape[0])
+        else:
+            indices = np.flatnonzero(value != last)
+        self.changed_indices.append(indices)
+        self.changed_values.append(value[indices])
+        self.iterations.append(iteration)
+        last[indices] = value[indices]
+        self.cursor += 1
+
+    def clear(self):
+        self.last.fill(0)
+        self.iterations = []
+        self.changed_indices = []
+        self.changed_values = []
+        self.cursor = 0
+
+    def stored_iterations(self):
+        """Iteration numbers of the stored values, in chronological order"""
+        return np.array(self.iterations, dtype=np.intp)
+
+    def values(self):
+        """Stored values, in chronological order"""
+        return np.array(list(self), dtype=self.last.dtype).reshape(
+            tuple([self.cursor] + list(self.last.shape))
+        )
+
+    @property
+    def record(self):
+        return self.values()
+
+    def __iter__(self):
+        value = np.zeros(self.last.shape, dtype=self.last.dtype)
+        flat_value = value.ravel()
+        for indices, changed in zip(self.changed_indices, self.changed_values):
+            flat_value[indices] = changed
+            yield value.copy()
+
+
 class History(object):
-    """"""
+    """Records the iterates of a solver, the time and the cumulated number of inner
+    products at each iteration.
+
+    The ``record`` policy decides which iterations are recorded: ``"all"`` records
+    every iteration, ``"off"`` none of them, an integer ``k`` records every ``k``
+    iterations and ``"delta"`` records every iteration but only stores the entries of
+    the iterates that changed since the previous one. When ``record_size`` is an
+    integer, only the last ``record_size`` recorded iterations are kept.
+    """
 
-    def __init__(self, title, max_iter, verbose):
+    def __init__(self, title, max_iter, verbose, record="all", record_size=None):
+        if record_size is not None and record == "delta":
+            raise ValueError(
+                "record_size cannot be used with record='delta'; "
+                "got (record_size=%r)" % record_size
+            )
         self.max_iter = max_iter
         self.verbose = verbose
+        self.record = record
+        self.record_size = record_size
         self.keys = None
         self.values = defaultdict(list)
         self.title = title
         self.records = []
         self.record_ind = {}
         self.n_updates = 0
+        self.n_sc_prods = 0
+        self.start_time = None
+        self.end_time = None
         # TODO: List all possible keys
         print_style = defaultdict(lambda: "%.2e")
         print_style.update(
@@ -77,9 +189,18 @@ class History(object):
         else:
             self.bar = None
 
+    def _is_recorded(self, iteration):
+        if self.record == "off":
+            return False
+        elif self.record in ["all", "delta"]:
+            return True
+        else:
+            return iteration % self.record == 0
+
     def update(self, current_iterate, sc_prods, update_bar=True, **kwargs):
         # Total number of calls to update must be smaller than max_iter + 1
         if self.max_iter >= self.n_updates:
+            iteration = self.n_updates
             self.n_updates += 1
         else:
             raise ValueError(
@@ -118,16 +239,36 @@ class History(object):
             self.bar.set_postfix_str(postfix)
             self.bar.update(1)
 
-        self.record_nm("weights").update(current_iterate)
-        self.record_nm("time").update(time.time())
-        self.record_nm("sc_prods").update(sc_prods)
+        current_time = time.time()
+        if self.start_time is None:
+            self.start_time = current_time
+        self.end_time = current_time
+        self.n_sc_prods += sc_prods
 
-        # self.records[0].update(current_iterate)
-        # self.records[1].update(time.time())
+        if self._is_recorded(iteration):
+            self.record_nm("weights").update(current_iterate, iteration)
+            self.record_nm("time").update(current_time, iteration)
+            self.record_nm("sc_prods").update(self.n_sc_prods, iteration)
 
-    def allocate_record(self, shape, name):
+    def allocate_record(self, shape, name, dtype=np.float64, capacity=None):
+        """Allocates a record following the record policy of the history, or a plain
+        record of given capacity if capacity is not None"""
         self.record_ind[name] = len(self.records)
-        self.records.append(Record(shape, self.max_iter + 1, name))
+        if capacity is not None:
+            record = Record(shape, capacity, name, dtype=dtype)
+        elif self.record == "delta" and shape != 1:
+            record = DeltaRecord(shape, name, dtype=dtype)
+        elif self.record == "off":
+            record = Record(shape, 0, name, dtype=dtype)
+        else:
+            # Number of iterations recorded when all max_iter + 1 updates are done
+            step = 1 if self.record in ["all", "delta"] else self.record
+            capacity = self.max_iter // step + 1
+            if self.record_size is not None and self.record_size < capacity:
+                record = Record(shape, self.record_size, name, dtype=dtype, ring=True)
+            else:
+                record = Record(shape, capacity, name, dtype=dtype)
+        self.records.append(record)
 
     def record_nm(self, name):
         return self.records[self.record_ind[name]]
@@ -141,6 +282,9 @@ class History(object):
         self.values = defaultdict(list)
         self.keys = None
         self.n_updates = 0
+        self.n_sc_prods = 0
+        self.start_time = None
+        self.end_time = None
         for rec in self.records:
             rec.clear()
 
@@ -0,0 +1,541 @@
+# Authors: Stephane Gaiffas <stephane.gaiffas@gmail.com>
+#          Ibrahim Merad <imerad7@gmail.com>
+# License: BSD 3 clause
+
+"""
+This module contains the ``LBFGS`` class, for the limited-memory quasi-Newton solver
+L-BFGS, and its OWL-QN variant for the penalizations with an l1 part.
+
+The smooth part of the objective is the goodness-of-fit of the ERM estimator plus the
+l2sq part of the penalization. Each iteration builds a search direction from the last
+``memory`` pairs of weights and gradients changes (two-loop recursion), and the
+learning rate along it is found by a line search. Since the inner products are linear
+in the weights, the inner products of the direction are computed once per iteration,
+and those of the trial points are obtained from them, so that each trial point only
+costs the pass over the samples of the goodness-of-fit gradient.
+
+Without an l1 part, the line search enforces the strong Wolfe conditions, which keep
+the curvature pairs positive. With an l1 part, the OWL-QN iteration of Andrew and Gao
+is used: the gradient is replaced by the pseudo-gradient of the objective, the trial
+points are projected on the orthant of the current weights, and the line search is a
+backtracking one. The direction is only made to agree in sign with minus the
+pseudo-gradient on the zero weights (which chooses their orthant), since zeroing it on
+the other weights as well spoils the quasi-Newton direction on ill-conditioned
+problems, while the projection of the trial points already keeps them in the orthant.
+The inner products of a trial point are computed again when the projection clips some
+weights.
+
+Both need the value of the goodness-of-fit, so that only the ERM estimator can be
+used, together with a smooth loss.
+
+``StateLBFGS`` is a place-holder for the LBFGS solver containing:
+
+    step : numpy.ndarray
+        A numpy array of shape (1,) containing the learning rate used along the
+        pseudo-gradient when no curvature pair is available.
+
+    value : numpy.ndarray
+        A numpy array of shape (1,) containing the objective at the weights.
+
+    initialized : numpy.ndarray
+        A numpy array of shape (1,) equal to 1 once the objective and the gradient at
+        the weights are computed.
+
+    n_pairs : numpy.ndarray
+        A numpy array of shape (1,) containing the number of curvature pairs stored.
+
+    head : numpy.ndarray
+        A numpy array of shape (1,) containing the index where the next curvature pair
+        is stored.
+
+    grad : numpy.ndarray
+        A numpy array of shape (n_weights, n_classes) containing the gradient of the
+        smooth part of the objective at the weights.
+
+    pseudo_grad : numpy.ndarray
+        A numpy array of shape (n_weights, n_classes) containing the pseudo-gradient of
+        the objective at the weights.
+
+    direction : numpy.ndarray
+        A numpy array of shape (n_weights, n_classes) containing the search direction.
+
+    trial : numpy.ndarray
+        A numpy array of shape (n_weights, n_classes) containing the trial point of the
+        line search.
+
+    grad_trial : numpy.ndarray
+        A numpy array of shape (n_weights, n_classes) containing the gradient of the
+        smooth part of the objective at the trial point.
+
+    inner_products_direction : numpy.ndarray
+        A numpy array of shape (n_samples, n_classes) containing the inner products of
+        the search direction.
+
+    inner_products_trial : numpy.ndarray
+        A numpy array of shape (n_samples, n_classes) containing the inner products at
+        the trial point.
+
+    s : numpy.ndarray
+        A numpy array of shape (memory, n_weights, n_classes) containing the changes of
+        the weights of the curvature pairs.
+
+    y : numpy.ndarray
+        A numpy array of shape (memory, n_weights, n_classes) containing the changes of
+        the gradients of the curvature pairs.
+
+    rho : numpy.ndarray
+        A numpy array of shape (memory,) containing the inverses of the inner products
+        of the curvature pairs.
+
+    alpha : numpy.ndarray
+        A numpy array of shape (memory,) used by the two-loop recursion.
+"""
+
+from collections import namedtuple
+import numpy as np
+from math import fabs
+from numba import jit
+
+from ._base import Solver, jit_kwargs
+from ..estimator import ERM
+from .._loss import decision_function_factory
+from .._utils import np_float, matrix_type
+
+
+StateLBFGS = namedtuple(
+    "StateLBFGS",
+    [
+        "step",
+        "value",
+        "initialized",
+        "n_pairs",
+        "head",
+        "grad",
+        "pseudo_grad",
+        "direction",
+        "trial",
+        "grad_trial",
+        "inner_products_direction",
+        "inner_products_trial",
+        "s",
+        "y",
+        "rho",
+        "alpha",
+    ],
+)
+
+# Constants of the sufficient decrease and of the curvature conditions, and maximum
+# number of trial points of the line search
+ARMIJO = 1e-4
+WOLFE = 0.9
+MAX_LINE_SEARCH = 50
+
+
+class LBFGS(Solver):
+    def __init__(
+        self,
+        X,
+        y,
+        loss,
+        n_classes,
+        fit_intercept,
+        estimator,
+        penalty,
+        max_iter,
+        tol,
+        step,
+        history,
+        memory=10,
+        stopping_rule="weights",
+        stopping_period=1,
+    ):
+        if not isinstance(estimator, ERM):
+            raise ValueError("The LBFGS solver can only be used with the ERM estimator")
+        if not np.isfinite(loss.lip):
+            raise ValueError("The LBFGS solver needs a smooth loss")
+        if not isinstance(memory, int) or memory < 1:
+            raise ValueError(
+                "memory must be a positive integer; got (memory=%r)" % memory
+            )
+        super(LBFGS, self).__init__(
+            X=X,
+            y=y,
+            loss=loss,
+            n_classes=n_classes,
+            fit_intercept=fit_intercept,
+            estimator=estimator,
+            penalty=penalty,
+            max_iter=max_iter,
+            tol=tol,
+            history=history,
+            stopping_rule=stopping_rule,
+            stopping_period=stopping_period,
+        )
+
+        # Automatic steps
+        self.step = step
+        self.memory = memory
+
+    def get_state(self):
+        """Returns the state of the LBFGS solver, which contains the curvature pairs
+        and the buffers used by the cycle.
+
+        Returns
+        -------
+        output : StateLBFGS
+            State of the LBFGS solver
+        """
+        dtype = self.X.dtype
+        weights_shape = self.weights_shape
+        memory_shape = (self.memory,) + weights_shape
+        inner_products_shape = (self.n_samples, self.n_classes)
+        return StateLBFGS(
+            step=np.array([self.step], dtype=np_float),
+            value=np.zeros(1, dtype=np_float),
+            initialized=np.zeros(1, dtype=np.intp),
+            n_pairs=np.zeros(1, dtype=np.intp),
+            head=np.zeros(1, dtype=np.intp),
+            grad=np.zeros(weights_shape, dtype=dtype),
+            pseudo_grad=np.zeros(weights_shape, dtype=dtype),
+            direction=np.zeros(weights_shape, dtype=dtype),
+            trial=np.zeros(weights_shape, dtype=dtype),
+            grad_trial=np.zeros(weights_shape, dtype=dtype),
+            inner_products_direction=np.empty(
+                inner_products_shape, dtype=dtype, order="F"
+            ),
+            inner_products_trial=np.empty(inner_products_shape, dtype=dtype, order="F"),
+            s=np.zeros(memory_shape, dtype=dtype),
+            y=np.zeros(memory_shape, dtype=dtype),
+            rho=np.zeros(self.memory, dtype=np_float),
+            alpha=np.zeros(self.memory, dtype=np_float),
+        )
+
+    def cycle_factory(self):
+        n_classes = self.n_classes
+        memory = self.memory
+        int_fit_intercept = int(self.fit_intercept)
+        grad_estimator = self.estimator.grad_factory()
+        value_loss = self.loss.value_batch_factory()
+        decision_function = decision_function_factory(
+            self.fit_intercept, matrix_type(self.X)
+        )
+        penalty = self.penalty
+        l1_strength = penalty.strength * penalty.scale_l1
+        l2_strength = penalty.strength * penalty.scale_l2sq
+        orthant_wise = l1_strength > 0.0
+
+        @jit(**jit_kwargs)
+        def dot(a, b):
+            out = 0.0
+            for j in range(a.shape[0]):
+                for k in range(n_classes):
+                    out += a[j, k] * b[j, k]
+            return out
+
+        @jit(**jit_kwargs)
+        def objective(y, weights, inner_products):
+            """Objective at the weights, the intercept being not penalized."""
+            out = 0.0
+            for j in range(int_fit_intercept, weights.shape[0]):
+                for k in range(n_classes):
+                    w_jk = weights[j, k]
+                    out += l1_strength * fabs(w_jk) + 0.5 * l2_strength * w_jk * w_jk
+            return value_loss(y, inner_products) + out
+
+        @jit(**jit_kwargs)
+        def smooth_grad(X, y, weights, inner_products, state_estimator, out):
+            """Gradient of the goodness-of-fit plus the l2sq part of the
+            penalization."""
+            grad_estimator(X, y, inner_products, state_estimator)
+            gradient = state_estimator.gradient
+            for j in range(weights.shape[0]):
+                for k in range(n_classes):
+                    out[j, k] = gradient[j, k]
+                    if j >= int_fit_intercept:
+                        out[j, k] += l2_strength * weights[j, k]
+
+        @jit(**jit_kwargs)
+        def pseudo_gradient(weights, grad, out):
+            """Minimum norm subgradient of the objective."""
+            for j in range(weights.shape[0]):
+                for k in range(n_classes):
+                    g = grad[j, k]
+                    if j < int_fit_intercept or not orthant_wise:
+                        out[j, k] = g
+                    elif weights[j, k] > 0.0:
+                        out[j, k] = g + l1_strength
+                    elif weights[j, k] < 0.0:
+                        out[j, k] = g - l1_strength
+                    elif g + l1_strength < 0.0:
+                        out[j, k] = g + l1_strength
+                    elif g - l1_strength > 0.0:
+                        out[j, k] = g - l1_strength
+                    else:
+                        out[j, k] = 0.0
+
+        @jit(**jit_kwargs)
+        def search_direction(weights, state_solver):
+            """Two-loop recursion applied to minus the pseudo-gradient, which is scaled
+            by the learning rate when no curvature pair is available. With an l1 part,
+            the direction of the zero weights must agree in sign with minus the
+            pseudo-gradient."""
+            pseudo_grad = state_solver.pseudo_grad
+            direction = state_solver.direction
+            s = state_solver.s
+            y = state_solver.y
+            rho = state_solver.rho
+            alpha = state_solver.alpha
+            n_pairs = state_solver.n_pairs[0]
+            head = state_solver.head[0]
+            n_weights = direction.shape[0]
+            for j in range(n_weights):
+                for k in range(n_classes):
+                    direction[j, k] = -pseudo_grad[j, k]
+            if n_pairs == 0:
+                gamma = state_solver.step[0]
+            else:
+                for idx in range(n_pairs):
+                    i = (head - 1 - idx + memory) % memory
+                    alpha[i] = rho[i] * dot(s[i], direction)
+                    for j in range(n_weights):
+                        for k in range(n_classes):
+                            direction[j, k] -= alpha[i] * y[i, j, k]
+                newest = (head - 1 + memory) % memory
+                gamma = 1.0 / (rho[newest] * dot(y[newest], y[newest]))
+            for j in range(n_weights):
+                for k in range(n_classes):
+                    direction[j, k] *= gamma
+            for idx in range(n_pairs - 1, -1, -1):
+                i = (head - 1 - idx + memory) % memory
+                beta = rho[i] * dot(y[i], direction)
+                for j in range(n_weights):
+                    for k in range(n_classes):
+                        direction[j, k] += (alpha[i] - beta) * s[i, j, k]
+            if orthant_wise:
+                for j in range(int_fit_intercept, n_weights):
+                    for k in range(n_classes):
+                        if (
+                            weights[j, k] == 0.0
+                            and direction[j, k] * pseudo_grad[j, k] >= 0.0
+                        ):
+                            direction[j, k] = 0.0
+            return dot(pseudo_grad, direction)
+
+        @jit(**jit_kwargs)
+        def evaluate(X, y, a, weights, inner_products, state_solver):
+            """Computes the trial point at the learning rate a together with its inner
+            products, and returns the objective at the trial point and the number of
+            passes over the samples."""
+            direction = state_solver.direction
+            pseudo_grad = state_solver.pseudo_grad
+            trial = state_solver.trial
+            inner_products_trial = state_solver.inner_products_trial
+            inner_products_direction = state_solver.inner_products_direction
+            clipped = False
+            for j in range(weights.shape[0]):
+                for k in range(n_classes):
+                    w_jk = weights[j, k]
+                    t_jk = w_jk + a * direction[j, k]
+                    if orthant_wise and j >= int_fit_intercept:
+                        # Projection on the orthant of the weights, which is given by
+                        # the pseudo-gradient for zero weights
+                        if w_jk != 0.0:
+                            orthant = w_jk
+                        else:
+                            orthant = -pseudo_grad[j, k]
+                        if t_jk * orthant <= 0.0 and t_jk != 0.0:
+                            t_jk = 0.0
+                            clipped = True
+                    trial[j, k] = t_jk
+            if clipped:
+                decision_function(X, trial, inner_products_trial)
+                n_passes = 1
+            else:
+                for i in range(inner_products.shape[0]):
+                    for k in range(n_classes):
+                        inner_products_trial[i, k] = (
+                            inner_products[i, k] + a * inner_products_direction[i, k]
+                        )
+                n_passes = 0
+            return objective(y, trial, inner_products_trial), n_passes
+
+        @jit(**jit_kwargs)
+        def wolfe_search(
+            X, y, weights, inner_products, state_estimator, state_solver, value, slope
+        ):
+            """Line search enforcing the strong Wolfe conditions, which brackets a
+            learning rate by doubling it and then reduces the bracket by safeguarded
+            quadratic interpolation (algorithms 3.5 and 3.6 of Nocedal and Wright).
+            The trial points violating the sufficient decrease condition do not need
+            their gradient."""
+            direction = state_solver.direction
+            grad_trial = state_solver.grad_trial
+            trial = state_solver.trial
+            inner_products_trial = state_solver.inner_products_trial
+            n_passes = 0
+            a_lo, value_lo, slope_lo = 0.0, value, slope
+            a_hi, value_hi = 0.0, value
+            bracketed = False
+            a = 1.0
+            for _ in range(MAX_LINE_SEARCH):
+                value_a, n = evaluate(X, y, a, weights, inner_products, state_solver)
+                n_passes += n
+                if value_a > value + ARMIJO * a * slope or value_a >= value_lo:
+                    a_hi, value_hi = a, value_a
+                    bracketed = True
+                else:
+                    smooth_grad(
+                        X, y, trial, inner_products_trial, state_estimator, grad_trial
+                    )
+                    n_passes += 1
+                    slope_a = dot(grad_trial, direction)
+                    if fabs(slope_a) <= -WOLFE * slope:
+                        return True, value_a, n_passes
+                    if (not bracketed and slope_a >= 0.0) or (
+                        bracketed and slope_a * (a_hi - a_lo) >= 0.0
+                    ):
+                        a_hi, value_hi = a_lo, value_lo
+                        bracketed = True
+                    a_lo, value_lo, slope_lo = a, value_a, slope_a
+                if not bracketed:
+                    a = 2.0 * a_lo
+                    continue
+                delta = a_hi - a_lo
+                if fabs(delta) <= 1e-12 * max(a_lo, a_hi):
+                    break
+                curvature = 2.0 * (value_hi - value_lo - slope_lo * delta)
+                if curvature > 0.0:
+                    a = a_lo - slope_lo * delta * delta / curvature
+                else:
+                    a = a_lo + 0.5 * delta
+                bound_lo = a_lo + 0.1 * delta
+                bound_hi = a_hi - 0.1 * delta
+                a = min(max(a, min(bound_lo, bound_hi)), max(bound_lo, bound_hi))
+
+            # The curvature condition could not be met: the last learning rate giving
+            # a sufficient decrease is used
+            if a_lo == 0.0:
+                return False, value, n_passes
+            value_a, n = evaluate(X, y, a_lo, weights, inner_products, state_solver)
+            smooth_grad(X, y, trial, inner_products_trial, state_estimator, grad_trial)
+            return True, value_a, n_passes + n + 1
+
+        @jit(**jit_kwargs)
+        def backtracking_search(
+            X, y, weights, inner_products, state_estimator, state_solver, value
+        ):
+            """Backtracking line search along the projected path of OWL-QN, with the
+            sufficient decrease condition given by the pseudo-gradient."""
+            pseudo_grad = state_solver.pseudo_grad
+            grad_trial = state_solver.grad_trial
+            trial = state_solver.trial
+            inner_products_trial = state_solver.inner_products_trial
+            n_passes = 0
+            a = 1.0
+            for _ in range(MAX_LINE_SEARCH):
+                value_a, n = evaluate(X, y, a, weights, inner_products, state_solver)
+                n_passes += n
+                decrease = 0.0
+                for j in range(weights.shape[0]):
+                    for k in range(n_classes):
+                        decrease += pseudo_grad[j, k] * (trial[j, k] - weights[j, k])
+                if value_a <= value + ARMIJO * decrease:
+                    smooth_grad(
+                        X, y, trial, inner_products_trial, state_estimator, grad_trial
+                    )
+                    return True, value_a, n_passes + 1
+                a *= 0.5
+            return False, value, n_passes
+
+        @jit(**jit_kwargs)
+        def cycle(
+            X, y, coordinates, weights, inner_products, state_estimator, state_solver
+        ):
+            n_samples = X.shape[0]
+            n_weights = weights.shape[0]
+            grad = state_solver.grad
+            grad_trial = state_solver.grad_trial
+            trial = state_solver.trial
+            inner_products_trial = state_solver.inner_products_trial
+            sc_prods = 0
+            if state_solver.initialized[0] == 0:
+                state_solver.value[0] = objective(y, weights, inner_products)
+                smooth_grad(X, y, weights, inner_products, state_estimator, grad)
+                sc_prods += n_samples
+                state_solver.initialized[0] = 1
+            value = state_solver.value[0]
+            pseudo_gradient(weights, grad, state_solver.pseudo_grad)
+
+            accepted = False
+            value_new = value
+            # When the quasi-Newton direction fails, the curvature pairs are dropped
+            # and the iteration is done again along the pseudo-gradient
+            for _ in range(2):
+                slope = search_direction(weights, state_solver)
+                if slope < 0.0:
+                    decision_function(
+                        X, state_solver.direction, state_solver.inner_products_direction
+                    )
+                    sc_prods += n_samples
+                    if orthant_wise:
+                        accepted, value_new, n_passes = backtracking_search(
+                            X, y, weights, inner_products, state_estimator,
+                            state_solver, value,
+                        )
+                    else:
+                        accepted, value_new, n_passes = wolfe_search(
+                            X, y, weights, inner_products, state_estimator,
+                            state_solver, value, slope,
+                        )
+                    sc_prods += n_passes * n_samples
+                if accepted or state_solver.n_pairs[0] == 0:
+                    break
+                state_solver.n_pairs[0] = 0
+
+            max_abs_delta = 0.0
+            max_abs_weight = 0.0
+            if not accepted:
+                # No descent direction was found, the weights are left unchanged
+                for j in range(n_weights):
+                    for k in range(n_classes):
+                        max_abs_weight = max(max_abs_weight, fabs(weights[j, k]))
+                return max_abs_delta, max_abs_weight, sc_prods
+
+            # The new curvature pair is stored if it is positive enough, in place of
+            # the oldest one when the memory is full
+            sy = 0.0
+            yy = 0.0
+            for j in range(n_weights):
+                for k in range(n_classes):
+                    s_jk = trial[j, k] - weights[j, k]
+                    y_jk = grad_trial[j, k] - grad[j, k]
+                    sy += s_jk * y_jk
+                    yy += y_jk * y_jk
+            if sy > 1e-10 * yy and yy > 0.0:
+                head = state_solver.head[0]
+                for j in range(n_weights):
+                    for k in range(n_classes):
+                        state_solver.s[head, j, k] = trial[j, k] - weights[j, k]
+                        state_solver.y[head, j, k] = grad_trial[j, k] - grad[j, k]
+                state_solver.rho[head] = 1.0 / sy
+                state_solver.head[0] = (head + 1) % memory
+                state_solver.n_pairs[0] = min(state_solver.n_pairs[0] + 1, memory)
+
+            for j in range(n_weights):
+                for k in range(n_classes):
+                    abs_delta = fabs(trial[j, k] - weights[j, k])
+                    if abs_delta > max_abs_delta:
+                        max_abs_delta = abs_delta
+                    weights[j, k] = trial[j, k]
+                    grad[j, k] = grad_trial[j, k]
+                    abs_weight = fabs(weights[j, k])
+                    if abs_weight > max_abs_weight:
+                        max_abs_weight = abs_weight
+            for i in range(n_samples):
+                for k in range(n_classes):
+                    inner_products[i, k] = inner_products_trial[i, k]
+            state_solver.value[0] = value_new
+
+            return max_abs_delta, max_abs_weight, sc_prods
+
+        return cycle
@@ -4,8 +4,14 @@
 
 """
 This module contains the ``GD`` class, for gradient descent solver.
+
+``StateLLC19`` is a place-holder for the LLC19 solver containing:
+
+    step : float
+        The learning rate.
 """
 
+from collections import namedtuple
 import numpy as np
 from math import fabs
 from warnings import warn
@@ -13,7 +19,10 @@ from numba import jit
 
 from ._base import Solver, OptimizationResult, jit_kwargs
 from .._loss import decision_function_factory, batch_decision_function_factory
-from .._utils import np_float, hardthresh
+from .._utils import np_float, hardthresh, get_kernel
+
+
+StateLLC19 = namedtuple("StateLLC19", ["step"])
 
 
 class LLC19(Solver):
@@ -48,18 +57,25 @@ class LLC19(Solver):
         self.step = step
         self.sparsity_ub = sparsity_ub or int(X.shape[1] / 100)
 
+    def get_state(self):
+        """Returns the state of the LLC19 solver, which contains the learning rate
+        used by the cycle.
+
+        Returns
+        -------
+        output : StateLLC19
+            State of the LLC19 solver
+        """
+        return StateLLC19(step=self.step)
+
     def cycle_factory(self):
 
-        X = self.X
         fit_intercept = self.fit_intercept
 
-        n_features = self.n_features
-        n_samples = self.n_samples
         n_classes = self.n_classes
         grad_estimator = self.estimator.grad_factory()
-        decision_function = decision_function_factory(X, fit_intercept)
+        decision_function = decision_function_factory(fit_intercept)
 
-        step = self.step
         sparsity_ub = self.sparsity_ub
 
         # The learning rates scaled by the strength of the penalization (we use the
@@ -68,13 +84,17 @@ class LLC19(Solver):
         if fit_intercept:
 
             @jit(**jit_kwargs)
-            def cycle(coordinates, weights, inner_products, state_estimator):
+            def cycle(
+                X, y, coordinates, weights, inner_products, state_estimator, state_solver
+            ):
+                n_samples, n_features = X.shape
+                step = state_solver.step
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
 
-                decision_function(weights, inner_products)
+                decision_function(X, weights, inner_products)
 
-                grad_estimator(inner_products, state_estimator)
+                grad_estimator(X, y, inner_products, state_estimator)
 
                 grad = state_estimator.gradient
                 # TODO : allocate w_new somewhere ?
@@ -111,12 +131,16 @@ class LLC19(Solver):
         else:
             # There is no intercept, so the code changes slightly
             @jit(**jit_kwargs)
-            def cycle(coordinates, weights, inner_products, state_estimator):
+            def cycle(
+                X, y, coordinates, weights, inner_products, state_estimator, state_solver
+            ):
+                n_samples, n_features = X.shape
+                step = state_solver.step
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
-                decision_function(weights, inner_products)
+                decision_function(X, weights, inner_products)
 
-                grad_estimator(inner_products, state_estimator)
+                grad_estimator(X, y, inner_products, state_estimator)
                 grad = state_estimator.gradient
                 # TODO : allocate w_new somewhere ?
                 w_new = weights - step * grad
@@ -141,10 +165,11 @@ class LLC19(Solver):
 
     def solve(self, w0=None, dummy_first_step=False):
         X = self.X
+        y = self.y
         fit_intercept = self.fit_intercept
-        inner_products = np.empty((self.n_samples, self.n_classes), dtype=np_float, order="F")
+        inner_products = np.empty((self.n_samples, self.n_classes), dtype=self.X.dtype, order="F")
         coordinates = np.arange(self.weights_shape[0], dtype=np.intp)
-        weights = np.empty(self.weights_shape, dtype=np_float)
+        weights = np.empty(self.weights_shape, dtype=self.X.dtype)
         tol = self.tol
         max_iter = self.max_iter
         history = self.history
@@ -154,28 +179,37 @@ class LLC19(Solver):
             weights.fill(0.0)
 
         # Computation of the initial inner products
-        decision_function = decision_function_factory(X, fit_intercept)
-        decision_function(weights, inner_products)
+        decision_function = decision_function_factory(fit_intercept)
+        decision_function(X, weights, inner_products)
 
         # Get the cycle function
-        cycle = self.cycle_factory()
+        cycle = get_kernel(self.cycle_factory())
         state_estimator = self.estimator.get_state()
+        state_solver = self.get_state()
 
         # TODO: First value for tolerance is 1.0 or NaN
         # history.update(epoch=0, obj=obj, tol=1.0, update_bar=True)
         if dummy_first_step:
-            cycle(coordinates, weights, inner_products, state_estimator)
+            cycle(
+                X,
+                y,
+                coordinates,
+                weights,
+                inner_products,
+                state_estimator,
+                state_solver,
+            )
             if w0 is not None:
                 weights[:] = w0
             else:
                 weights.fill(0.0)
-            decision_function(weights, inner_products)
+            decision_function(X, weights, inner_products)
 
         history.update(weights, 0)
 
         for n_iter in range(1, max_iter + 1):
             max_abs_delta, max_abs_weight, sc_prods = cycle(
-                coordinates, weights, inner_products, state_estimator
+                X, y, coordinates, weights, inner_products, state_estimator, state_solver
             )
             # Compute the new value of objective
             # obj = objective(weights, inner_products)
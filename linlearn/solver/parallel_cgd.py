@@ -0,0 +1,166 @@
+# Authors: Stephane Gaiffas <stephane.gaiffas@gmail.com>
+#          Ibrahim Merad <imerad7@gmail.com>
+# License: BSD 3 clause
+
+"""
+This module contains the ``ParallelCGD`` class, for the asynchronous parallel
+coordinate gradient descent solver (Shotgun / Hogwild-style).
+
+At each cycle, the random permutation of the coordinates is split in ``n_workers``
+contiguous parts, and each part is swept by a worker thread running the nogil
+jit-compiled sweep of ``CGD``, the threads being started once by ``solve``. The
+workers update the shared weights (each coordinate belongs to a single worker during
+a cycle) and the shared inner products without locks, so that a worker can compute a
+partial derivative from inner products missing the updates in flight in the other
+workers: the staleness is bounded by the ``n_workers - 1`` coordinates updated
+concurrently.
+
+Concurrent updates of the inner products of a same sample can also be lost, which is
+the approximation accepted within a cycle: the partial derivatives computed during a
+cycle can use such inner products. The inner products are computed again from the
+weights at the end of each cycle, before the cycle returns, so that the stopping rule
+and the history of ``solve`` always see the inner products of the current weights.
+
+``StateParallelCGD`` is a place-holder for the ParallelCGD solver containing:
+
+    state_cgd : StateCGD
+        The state of the CGD solver, which contains the learning rates used by the
+        workers.
+
+    worker_states : tuple
+        The states of the estimator used by the workers other than the first one
+        (which uses the state given to the cycle), since the estimators use their
+        state as scratch space.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from .cgd import CGD
+from .._loss import decision_function_factory
+from .._utils import get_kernel, matrix_type
+
+
+StateParallelCGD = namedtuple("StateParallelCGD", ["state_cgd", "worker_states"])
+
+
+class ParallelCGD(CGD):
+    def __init__(
+        self,
+        X,
+        y,
+        loss,
+        n_classes,
+        fit_intercept,
+        estimator,
+        penalty,
+        max_iter,
+        tol,
+        steps,
+        history,
+        n_workers=1,
+        importance_sampling=False,
+        screening=False,
+        working_set=False,
+        stopping_rule="weights",
+        stopping_period=1,
+    ):
+        super(ParallelCGD, self).__init__(
+            X=X,
+            y=y,
+            loss=loss,
+            n_classes=n_classes,
+            fit_intercept=fit_intercept,
+            estimator=estimator,
+            penalty=penalty,
+            max_iter=max_iter,
+            tol=tol,
+            steps=steps,
+            history=history,
+            importance_sampling=importance_sampling,
+            screening=screening,
+            working_set=working_set,
+            stopping_rule=stopping_rule,
+            stopping_period=stopping_period,
+        )
+        if not isinstance(n_workers, int) or n_workers < 1:
+            raise ValueError(
+                "n_workers must be a positive integer; got (n_workers=%r)" % n_workers
+            )
+        # Coordinates sampled with replacement could be updated by several workers
+        if importance_sampling:
+            raise ValueError(
+                "importance sampling of the coordinates cannot be used with the "
+                "parallel_cgd solver"
+            )
+        self.n_workers = n_workers
+        # The pool of worker threads, which exists only during solve
+        self._executor = None
+
+    def get_state(self):
+        """Returns the state of the ParallelCGD solver, which contains the learning
+        rates and the estimator states of the workers.
+
+        Returns
+        -------
+        output : StateParallelCGD
+            State of the ParallelCGD solver
+        """
+        return StateParallelCGD(
+            state_cgd=super(ParallelCGD, self).get_state(),
+            worker_states=tuple(
+                self.estimator.get_state() for _ in range(self.n_workers - 1)
+            ),
+        )
+
+    def solve(self, w0=None, dummy_first_step=False):
+        # The worker threads are started once and used by all the cycles
+        with ThreadPoolExecutor(max_workers=max(self.n_workers - 1, 1)) as executor:
+            self._executor = executor
+            try:
+                return super(ParallelCGD, self).solve(
+                    w0=w0, dummy_first_step=dummy_first_step
+                )
+            finally:
+                self._executor = None
+
+    def cycle_factory(self):
+        n_workers = self.n_workers
+        executor = self._executor
+        prepare_coordinates = get_kernel(self.prepare_coordinates_factory())
+        sweep = get_kernel(self.sweep_factory())
+        decision_function = decision_function_factory(
+            self.fit_intercept, matrix_type(self.X)
+        )
+
+        def cycle(
+            X, y, coordinates, weights, inner_products, state_estimator, state_solver
+        ):
+            state_cgd = state_solver.state_cgd
+            prepare_coordinates(coordinates, state_cgd.coord_csum_probas)
+            parts = np.array_split(coordinates, n_workers)
+            states = (state_estimator,) + state_solver.worker_states
+            # The sweep releases the GIL, the first part is swept by the calling
+            # thread
+            futures = [
+                executor.submit(
+                    sweep, X, y, part, weights, inner_products, state, state_cgd
+                )
+                for part, state in zip(parts[1:], states[1:])
+            ]
+            max_abs_delta, max_abs_weight, n_samples = sweep(
+                X, y, parts[0], weights, inner_products, states[0], state_cgd
+            )
+            for future in futures:
+                abs_delta, abs_weight, _ = future.result()
+                max_abs_delta = max(max_abs_delta, abs_delta)
+                max_abs_weight = max(max_abs_weight, abs_weight)
+
+            if n_workers > 1:
+                # Updates of the inner products lost by concurrent writes are
+                # recovered before the stopping rule and the history use them
+                decision_function(X, weights, inner_products)
+            return max_abs_delta, max_abs_weight, n_samples
+
+        return cycle
@@ -5,8 +5,17 @@
 """
 This module contains the ``SAGA`` class, a variant of variance-reduced stochastic
 gradient descent.
+
+``StateSAGA`` is a place-holder for the SAGA solver containing:
+
+    step : float
+        The learning rate.
+
+    scaled_step : float
+        The learning rate scaled by the strength of the penalization.
 """
 
+from collections import namedtuple
 import numpy as np
 from math import fabs
 from warnings import warn
@@ -15,7 +24,10 @@ from numba import jit
 
 from ._base import Solver, OptimizationResult, jit_kwargs
 from .._loss import decision_function_factory
-from .._utils import np_float
+from .._utils import np_float, get_kernel, matrix_type, kernel_matrix
+
+
+StateSAGA = namedtuple("StateSAGA", ["step", "scaled_step"])
 
 
 class SAGA(Solver):
@@ -32,6 +44,8 @@ class SAGA(Solver):
         tol,
         step,
         history,
+        stopping_rule="weights",
+        stopping_period=1,
     ):
         super(SAGA, self).__init__(
             X=X,
@@ -44,41 +58,167 @@ class SAGA(Solver):
             max_iter=max_iter,
             tol=tol,
             history=history,
+            stopping_rule=stopping_rule,
+            stopping_period=stopping_period,
         )
 
         # Automatic steps
         self.step = step
 
+    def get_state(self):
+        """Returns the state of the SAGA solver, which contains the learning rate used
+        by the cycle.
+
+        Returns
+        -------
+        output : StateSAGA
+            State of the SAGA solver
+        """
+        step = self.step / self.n_samples
+        # The learning rate scaled by the strength of the penalization (we use the
+        # apply_one_unscaled penalization function)
+        return StateSAGA(step=step, scaled_step=self.penalty.strength * step)
+
     def cycle_factory(self):
 
-        X = self.X
-        y = self.y
         fit_intercept = self.fit_intercept
-        n_samples = X.shape[0]
-        n_weights = self.n_weights
-        n_features = self.n_features
         n_classes = self.n_classes
 
         deriv_loss = self.loss.deriv_factory()
         penalize = self.penalty.apply_one_unscaled_factory()
-        step = self.step / n_samples
 
-        # The learning rates scaled by the strength of the penalization (we use the
-        # apply_one_unscaled penalization function)
-        scaled_step = self.penalty.strength * step
+        if matrix_type(self.X) == "csr":
+            penalize_lazy = self.penalty.apply_one_unscaled_lazy_factory()
+
+            @jit(**jit_kwargs)
+            def cycle(
+                X,
+                y,
+                weights,
+                inner_products,
+                state_solver,
+                mean_grad,
+                grad_update,
+                loss_derivative,
+                inner_prod,
+                init,
+            ):
+                n_samples, n_features = X.shape
+                indptr, indices, data = X.indptr, X.indices, X.data
+                step = state_solver.step
+                scaled_step = state_solver.scaled_step
+                max_abs_delta = 0.0
+                max_abs_weight = 0.0
+
+                if init:
+                    for k in range(n_classes):
+                        for j in range(n_features + int(fit_intercept)):
+                            mean_grad[j, k] = 0.0
+                    for i in range(n_samples):
+                        deriv_loss(y[i], inner_products[i], loss_derivative)
+                        for k in range(n_classes):
+                            if fit_intercept:
+                                mean_grad[0, k] += loss_derivative[k]
+                            for idx in range(indptr[i], indptr[i + 1]):
+                                mean_grad[indices[idx] + int(fit_intercept), k] += (
+                                    data[idx] * loss_derivative[k]
+                                )
+                    for k in range(n_classes):
+                        for j in range(n_features + int(fit_intercept)):
+                            mean_grad[j, k] /= n_samples
+
+                w_new = weights.copy()
+                # The coordinates outside of the sampled rows keep the same average
+                # gradient, so that we catch up lazily with their updates when they
+                # are next needed. This contains the next iteration to be applied to
+                # each coordinate.
+                last_update = np.zeros(n_features, dtype=np.intp)
+                for i in range(n_samples):
+                    ind = np.random.randint(n_samples)
+                    row_start, row_end = indptr[ind], indptr[ind + 1]
+                    for idx in range(row_start, row_end):
+                        j = indices[idx]
+                        jj = j + int(fit_intercept)
+                        n_steps = i - last_update[j]
+                        if n_steps > 0:
+                            for k in range(n_classes):
+                                w_new[jj, k] = penalize_lazy(
+                                    w_new[jj, k], step * mean_grad[jj, k], scaled_step, n_steps
+                                )
+
+                    for k in range(n_classes):
+                        if fit_intercept:
+                            inner_prod[k] = w_new[0, k]
+                        else:
+                            inner_prod[k] = 0.0
+                        for idx in range(row_start, row_end):
+                            inner_prod[k] += (
+                                data[idx] * w_new[indices[idx] + int(fit_intercept), k]
+                            )
+
+                    deriv_loss(y[ind], inner_prod, grad_update[0])
+                    deriv_loss(y[ind], inner_products[ind], loss_derivative)
+
+                    for k in range(n_classes):
+                        delta_k = grad_update[0, k] - loss_derivative[k]
+                        if fit_intercept:
+                            w_new[0, k] -= step * (delta_k + mean_grad[0, k])
+                            mean_grad[0, k] += delta_k / n_samples
+                        for idx in range(row_start, row_end):
+                            jj = indices[idx] + int(fit_intercept)
+                            grad_update_j = delta_k * data[idx]
+                            w_new[jj, k] -= step * (grad_update_j + mean_grad[jj, k])
+                            w_new[jj, k] = penalize(w_new[jj, k], scaled_step)
+                            mean_grad[jj, k] += grad_update_j / n_samples
+
+                        inner_products[ind, k] = inner_prod[k]
+                    for idx in range(row_start, row_end):
+                        last_update[indices[idx]] = i + 1
+
+                for j in range(n_features):
+                    jj = j + int(fit_intercept)
+                    n_steps = n_samples - last_update[j]
+                    if n_steps > 0:
+                        for k in range(n_classes):
+                            w_new[jj, k] = penalize_lazy(
+                                w_new[jj, k], step * mean_grad[jj, k], scaled_step, n_steps
+                            )
+
+                for k in range(n_classes):
+                    for j in range(n_features + int(fit_intercept)):
+                        # Update the maximum update change
+                        abs_delta_j = fabs(w_new[j, k] - weights[j, k])
+                        if abs_delta_j > max_abs_delta:
+                            max_abs_delta = abs_delta_j
+                        # Update the maximum weight
+                        abs_w_j_new = fabs(w_new[j, k])
+                        if abs_w_j_new > max_abs_weight:
+                            max_abs_weight = abs_w_j_new
 
-        if fit_intercept:
+                        weights[j, k] = w_new[j, k]
+
+                return max_abs_delta, max_abs_weight, n_samples
+
+            return cycle
+
+        elif fit_intercept:
 
             @jit(**jit_kwargs)
             def cycle(
+                X,
+                y,
                 weights,
                 inner_products,
+                state_solver,
                 mean_grad,
                 grad_update,
                 loss_derivative,
                 inner_prod,
                 init,
             ):
+                n_samples, n_features = X.shape
+                step = state_solver.step
+                scaled_step = state_solver.scaled_step
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
 
@@ -145,14 +285,20 @@ class SAGA(Solver):
             # There is no intercept, so the code changes slightly
             @jit(**jit_kwargs)
             def cycle(
+                X,
+                y,
                 weights,
                 inner_products,
+                state_solver,
                 mean_grad,
                 grad_update,
                 loss_derivative,
                 inner_prod,
                 init,
             ):
+                n_samples, n_features = X.shape
+                step = state_solver.step
+                scaled_step = state_solver.scaled_step
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
 
@@ -209,18 +355,19 @@ class SAGA(Solver):
             return cycle
 
     def solve(self, w0=None, dummy_first_step=False):
-        X = self.X
+        X = kernel_matrix(self.X)
+        y = self.y
         fit_intercept = self.fit_intercept
-        inner_products = np.empty((self.n_samples, self.n_classes), dtype=np_float)
+        inner_products = np.empty((self.n_samples, self.n_classes), dtype=self.X.dtype)
         # We use intp and not uintp since j-1 is np.float64 when j has type np.uintp
         # (namely np.uint64 on most machines), and this fails in nopython mode for
         # coverage analysis
 
-        weights = np.empty(self.weights_shape, dtype=np_float)
+        weights = np.empty(self.weights_shape, dtype=self.X.dtype)
         mean_grad = np.empty(self.weights_shape, dtype=np_float)
         grad_update = np.empty(self.weights_shape, dtype=np_float)
         loss_derivative = np.empty(self.n_classes, dtype=np_float)
-        inner_prod = np.empty(self.n_classes, dtype=np_float)
+        inner_prod = np.empty(self.n_classes, dtype=self.X.dtype)
         tol = self.tol
         max_iter = self.max_iter
         history = self.history
@@ -230,8 +377,10 @@ class SAGA(Solver):
             weights.fill(0.0)
 
         # Computation of the initial inner products
-        decision_function = decision_function_factory(X, fit_intercept)
-        decision_function(weights, inner_products)
+        decision_function = decision_function_factory(
+            fit_intercept, matrix_type(self.X)
+        )
+        decision_function(X, weights, inner_products)
 
         # random_state = self.random_state
         # if random_state is not None:
@@ -243,19 +392,24 @@ class SAGA(Solver):
         #     numba_seed_numpy(random_state)
 
         # Get the cycle function
-        cycle = self.cycle_factory()
+        cycle = get_kernel(self.cycle_factory())
+        # Get the function deciding if the solver stops
+        stop = self.stopping_factory()
         # Get the objective function
         # objective = self.objective_factory()
         # # Compute the first value of the objective
         # obj = objective(weights, inner_products)
 
-        # Get the estimator state (a place-holder for the estimator's internal
-        # computations)
+        # Get the solver state (containing the learning rate)
+        state_solver = self.get_state()
 
         if dummy_first_step:
             cycle(
+                X,
+                y,
                 weights,
                 inner_products,
+                state_solver,
                 mean_grad,
                 grad_update,
                 loss_derivative,
@@ -266,7 +420,7 @@ class SAGA(Solver):
                 weights[:] = w0
             else:
                 weights.fill(0.0)
-            decision_function(weights, inner_products)
+            decision_function(X, weights, inner_products)
 
         # TODO: First value for tolerance is 1.0 or NaN
         # history.update(epoch=0, obj=obj, tol=1.0, update_bar=True)
@@ -275,8 +429,11 @@ class SAGA(Solver):
 
         for n_iter in range(1, max_iter + 1):
             max_abs_delta, max_abs_weight, sc_prods = cycle(
+                X,
+                y,
                 weights,
                 inner_products,
+                state_solver,
                 mean_grad,
                 grad_update,
                 loss_derivative,
@@ -286,16 +443,11 @@ class SAGA(Solver):
             init = False
             # Compute the new value of objective
             # obj = objective(weights, inner_products)
-            if max_abs_weight == 0.0:
-                current_tol = 0.0
-            else:
-                current_tol = max_abs_delta / max_abs_weight
-
             # TODO: tester tous les cas "max_abs_weight == 0.0" etc..
             # history.update(epoch=n_iter, obj=obj, tol=current_tol, update_bar=True)
             history.update(weights, sc_prods)
 
-            if current_tol < tol:
+            if stop(n_iter, weights, max_abs_delta, max_abs_weight):
                 history.close_bar()
                 return OptimizationResult(
                     w=weights, n_iter=n_iter, success=True, tol=tol, message=None
@@ -4,15 +4,27 @@
 
 """
 This module contains the ``SAGA`` class, for stochastic gradient descent solver.
+
+``StateSGD`` is a place-holder for the SGD solver containing:
+
+    step : float
+        The learning rate.
+
+    penalty_strength : float
+        The strength of the penalization.
 """
 
+from collections import namedtuple
 import numpy as np
-from math import fabs
+from math import fabs, copysign
 from warnings import warn
 from numba import jit
 
 from ._base import Solver, OptimizationResult, jit_kwargs
-from .._utils import np_float
+from .._utils import np_float, get_kernel, matrix_type, kernel_matrix
+
+
+StateSGD = namedtuple("StateSGD", ["step", "penalty_strength"])
 
 
 class SGD(Solver):
@@ -30,6 +42,8 @@ class SGD(Solver):
         step,
         history,
         exponent=0.5,
+        stopping_rule="weights",
+        stopping_period=1,
     ):
         super(SGD, self).__init__(
             X=X,
@@ -42,35 +56,147 @@ class SGD(Solver):
             max_iter=max_iter,
             tol=tol,
             history=history,
+            stopping_rule=stopping_rule,
+            stopping_period=stopping_period,
         )
 
         # Automatic steps
         self.step = step
         self.exponent = exponent
 
+    def get_state(self):
+        """Returns the state of the SGD solver, which contains the learning rate used
+        by the cycle.
+
+        Returns
+        -------
+        output : StateSGD
+            State of the SGD solver
+        """
+        # The learning rates are scaled by the strength of the penalization (we use
+        # the apply_one_unscaled penalization function)
+        return StateSGD(step=self.step, penalty_strength=self.penalty.strength)
+
     def cycle_factory(self):
 
-        X = self.X
-        y = self.y
         fit_intercept = self.fit_intercept
-        n_samples = self.estimator.n_samples
-        n_features = self.n_features
         n_classes = self.n_classes
-        n_weights = self.n_weights
         exponent = self.exponent
         loss = self.loss
         deriv_loss = loss.deriv_factory()
 
         penalize = self.penalty.apply_one_unscaled_factory()
-        step = self.step  # / n_samples
 
-        # The learning rates scaled by the strength of the penalization (we use the
-        # apply_one_unscaled penalization function)
-        penalty_strength = self.penalty.strength
-        if fit_intercept:
+        if matrix_type(self.X) == "csr":
+            scale_l1 = self.penalty.scale_l1
+            scale_l2sq = self.penalty.scale_l2sq
 
             @jit(**jit_kwargs)
-            def cycle(weights, epoch, state_estimator, inner_prod):
+            def catch_up(w, cumprod_l2sq, cumsum_l1, start, end):
+                # Applies the penalization of iterations start, ..., end - 1
+                abs_w = fabs(w) * cumprod_l2sq[start] - (
+                    cumsum_l1[end] - cumsum_l1[start]
+                )
+                return copysign(max(abs_w, 0.0) / cumprod_l2sq[end], w)
+
+            @jit(**jit_kwargs)
+            def cycle(X, y, weights, epoch, state_estimator, state_solver, inner_prod):
+                n_samples, n_features = X.shape
+                indptr, indices, data = X.indptr, X.indices, X.data
+                step = state_solver.step  # / n_samples
+                penalty_strength = state_solver.penalty_strength
+                max_abs_delta = 0.0
+                max_abs_weight = 0.0
+                derivative = state_estimator.loss_derivative
+                w_new = weights.copy()
+
+                # The coordinates outside of the sampled rows are only penalized, so
+                # that we catch up lazily with their penalizations when they are next
+                # updated, using the cumulative products of the l2sq shrinkages and
+                # the cumulative (rescaled) l1 thresholds of the iterations
+                cumprod_l2sq = np.empty(n_samples + 1, dtype=np_float)
+                cumsum_l1 = np.empty(n_samples + 1, dtype=np_float)
+                cumprod_l2sq[0] = 1.0
+                cumsum_l1[0] = 0.0
+                for i in range(n_samples):
+                    iter_step = step / max(
+                        n_samples, (1 + epoch * n_samples + i) ** exponent
+                    )
+                    scaled_iter_step = iter_step * penalty_strength
+                    cumsum_l1[i + 1] = (
+                        cumsum_l1[i] + scale_l1 * scaled_iter_step * cumprod_l2sq[i]
+                    )
+                    cumprod_l2sq[i + 1] = cumprod_l2sq[i] * (
+                        1.0 + scale_l2sq * scaled_iter_step
+                    )
+                # Next iteration to be applied to each coordinate
+                last_update = np.zeros(n_features, dtype=np.intp)
+
+                for i in range(n_samples):
+                    ind = np.random.randint(n_samples)
+                    iter_step = step / max(
+                        n_samples, (1 + epoch * n_samples + i) ** exponent
+                    )
+                    scaled_iter_step = iter_step * penalty_strength
+                    row_start, row_end = indptr[ind], indptr[ind + 1]
+
+                    for k in range(n_classes):
+                        if fit_intercept:
+                            inner_prod[k] = weights[0, k]
+                        else:
+                            inner_prod[k] = 0.0
+                        for idx in range(row_start, row_end):
+                            inner_prod[k] += (
+                                data[idx] * weights[indices[idx] + int(fit_intercept), k]
+                            )
+
+                    deriv_loss(y[ind], inner_prod, derivative)
+
+                    for k in range(n_classes):
+                        if fit_intercept:
+                            w_new[0, k] -= iter_step * derivative[k]
+                        for idx in range(row_start, row_end):
+                            j = indices[idx]
+                            jj = j + int(fit_intercept)
+                            w_new[jj, k] = catch_up(
+                                w_new[jj, k], cumprod_l2sq, cumsum_l1, last_update[j], i
+                            )
+                            w_new[jj, k] -= iter_step * data[idx] * derivative[k]
+                            w_new[jj, k] = penalize(w_new[jj, k], scaled_iter_step)
+                    for idx in range(row_start, row_end):
+                        last_update[indices[idx]] = i + 1
+
+                for j in range(n_features):
+                    for k in range(n_classes):
+                        jj = j + int(fit_intercept)
+                        w_new[jj, k] = catch_up(
+                            w_new[jj, k], cumprod_l2sq, cumsum_l1, last_update[j], n_samples
+                        )
+
+                for k in range(n_classes):
+                    for j in range(n_features + int(fit_intercept)):
+                        # Update the maximum update change
+                        abs_delta_j = fabs(w_new[j, k] - weights[j, k])
+                        if abs_delta_j > max_abs_delta:
+                            max_abs_delta = abs_delta_j
+                        # Update the maximum weight
+                        abs_w_j_new = fabs(w_new[j, k])
+                        if abs_w_j_new > max_abs_weight:
+                            max_abs_weight = abs_w_j_new
+
+                        weights[j, k] = w_new[j, k]
+
+                return max_abs_delta, max_abs_weight, n_samples
+
+            return cycle
+
+        elif fit_intercept:
+
+            @jit(**jit_kwargs)
+            def cycle(X, y, weights, epoch, state_estimator, state_solver, inner_prod):
+                n_samples, n_features = X.shape
+                step = state_solver.step  # / n_samples
+                penalty_strength = state_solver.penalty_strength
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
                 # grad = state_estimator.gradient
@@ -129,7 +255,10 @@ class SGD(Solver):
         else:
             # There is no intercept, so the code changes slightly
             @jit(**jit_kwargs)
-            def cycle(weights, epoch, state_estimator, inner_prod):
+            def cycle(X, y, weights, epoch, state_estimator, state_solver, inner_prod):
+                n_samples, n_features = X.shape
+                step = state_solver.step  # / n_samples
+                penalty_strength = state_solver.penalty_strength
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
                 # grad = state_estimator.gradient
@@ -172,11 +301,12 @@ class SGD(Solver):
             return cycle
 
     def solve(self, w0=None, dummy_first_step=False):
-
-        weights = np.empty(self.weights_shape, dtype=np_float)
+        X = kernel_matrix(self.X)
+        y = self.y
+        weights = np.empty(self.weights_shape, dtype=self.X.dtype)
         tol = self.tol
         max_iter = self.max_iter
-        inner_prod = np.empty(self.n_classes, dtype=np_float)
+        inner_prod = np.empty(self.n_classes, dtype=self.X.dtype)
         history = self.history
         if w0 is not None:
             weights[:] = w0
@@ -193,16 +323,20 @@ class SGD(Solver):
         #     numba_seed_numpy(random_state)
 
         # Get the cycle function
-        cycle = self.cycle_factory()
+        cycle = get_kernel(self.cycle_factory())
+        # Get the function deciding if the solver stops
+        stop = self.stopping_factory()
 
         # Get the estimator state (a place-holder for the estimator's internal
         # computations)
         state_estimator = self.estimator.get_state()
+        # Get the solver state (containing the learning rate)
+        state_solver = self.get_state()
 
         # TODO: First value for tolerance is 1.0 or NaN
         # history.update(epoch=0, obj=obj, tol=1.0, update_bar=True)
         if dummy_first_step:
-            cycle(weights, 0, state_estimator, inner_prod)
+            cycle(X, y, weights, 0, state_estimator, state_solver, inner_prod)
             if w0 is not None:
                 weights[:] = w0
             else:
@@ -212,18 +346,13 @@ class SGD(Solver):
 
         for epoch in range(1, max_iter + 1):
             max_abs_delta, max_abs_weight, sc_prods = cycle(
-                weights, epoch, state_estimator, inner_prod
+                X, y, weights, epoch, state_estimator, state_solver, inner_prod
             )
-            if max_abs_weight == 0.0:
-                current_tol = 0.0
-            else:
-                current_tol = max_abs_delta / max_abs_weight
-
             # TODO: tester tous les cas "max_abs_weight == 0.0" etc..
             # history.update(epoch=n_iter, obj=obj, tol=current_tol, update_bar=True)
             history.update(weights, sc_prods)
 
-            if current_tol < tol:
+            if stop(epoch, weights, max_abs_delta, max_abs_weight):
                 history.close_bar()
                 return OptimizationResult(
                     w=weights, n_iter=epoch, success=True, tol=tol, message=None
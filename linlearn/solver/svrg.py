@@ -5,8 +5,31 @@
 """
 This module contains the ``SVRG`` class, a variant of variance-reduced stochastic
 gradient descent.
+
+``StateSVRG`` is a place-holder for the SVRG solver containing:
+
+    step : float
+        The learning rate.
+
+    scaled_step : float
+        The learning rate scaled by the strength of the penalization.
+
+    sample_blocks : numpy.ndarray
+        A numpy array of shape (n_samples,) of zeros, all the samples being in the
+        same block for the full gradient with dense features (empty otherwise).
+
+    deriv_samples : numpy.ndarray
+        A numpy array of shape (n_samples, n_classes) containing the loss derivatives
+        of the samples, used for the full gradient with dense features (empty
+        otherwise).
+
+    gradient_transposed : numpy.ndarray
+        A numpy array of shape (1, n_classes, n_features) containing the products of
+        the features with the loss derivatives, used for the full gradient with dense
+        features.
 """
 
+from collections import namedtuple
 import numpy as np
 from math import fabs
 from numba import jit
@@ -14,7 +37,13 @@ from warnings import warn
 
 from ._base import Solver, OptimizationResult, jit_kwargs
 from .._loss import decision_function_factory
-from .._utils import np_float
+from .._utils import np_float, get_kernel, matrix_type, kernel_matrix, xt_dot_factory
+
+
+StateSVRG = namedtuple(
+    "StateSVRG",
+    ["step", "scaled_step", "sample_blocks", "deriv_samples", "gradient_transposed"],
+)
 
 
 class SVRG(Solver):
@@ -31,6 +60,8 @@ class SVRG(Solver):
         tol,
         step,
         history,
+        stopping_rule="weights",
+        stopping_period=1,
     ):
         super(SVRG, self).__init__(
             X=X,
@@ -43,56 +74,203 @@ class SVRG(Solver):
             max_iter=max_iter,
             tol=tol,
             history=history,
+            stopping_rule=stopping_rule,
+            stopping_period=stopping_period,
         )
 
         # Automatic steps
         self.step = step
 
+    def get_state(self):
+        """Returns the state of the SVRG solver, which contains the learning rate used
+        by the cycle.
+
+        Returns
+        -------
+        output : StateSVRG
+            State of the SVRG solver
+        """
+        step = self.step / self.n_samples
+        # The place-holders of the full gradient are only used with dense features
+        n_dense = self.n_samples if matrix_type(self.X) != "csr" else 0
+        # The learning rate scaled by the strength of the penalization (we use the
+        # apply_one_unscaled penalization function)
+        return StateSVRG(
+            step=step,
+            scaled_step=self.penalty.strength * step,
+            sample_blocks=np.zeros(n_dense, dtype=np.uintp),
+            deriv_samples=np.empty((n_dense, self.n_classes), dtype=self.X.dtype),
+            gradient_transposed=np.empty(
+                (1, self.n_classes, self.n_features), dtype=np_float
+            ),
+        )
+
     def cycle_factory(self):
 
-        X = self.X
-        y = self.y
         fit_intercept = self.fit_intercept
-        n_samples = self.estimator.n_samples
-        n_features = self.n_features
         loss = self.loss
         n_classes = self.n_classes
         deriv_loss = loss.deriv_factory()
-        decision_function = decision_function_factory(X, fit_intercept)
+        decision_function = decision_function_factory(
+            fit_intercept, matrix_type(self.X)
+        )
         penalize = self.penalty.apply_one_unscaled_factory()
-        step = self.step / n_samples
+        # Used by the full gradient with dense features
+        xt_dot = xt_dot_factory(self.X)
 
-        # The learning rates scaled by the strength of the penalization (we use the
-        # apply_one_unscaled penalization function)
-        scaled_step = self.penalty.strength * self.step / n_samples
+        if matrix_type(self.X) == "csr":
+            penalize_lazy = self.penalty.apply_one_unscaled_lazy_factory()
+
+            @jit(**jit_kwargs)
+            def cycle(
+                X,
+                y,
+                weights,
+                inner_products,
+                state_estimator,
+                state_solver,
+                inner_prod1,
+                inner_prod2,
+            ):
+                n_samples, n_features = X.shape
+                indptr, indices, data = X.indptr, X.indices, X.data
+                step = state_solver.step
+                scaled_step = state_solver.scaled_step
+                max_abs_delta = 0.0
+                max_abs_weight = 0.0
+                mu = state_estimator.gradient
+                deriv_new = state_estimator.loss_derivative
+                deriv_tilde = state_estimator.partial_derivative
+                w_new = weights.copy()
+
+                decision_function(X, weights, inner_products)
+                for k in range(n_classes):
+                    for j in range(n_features + int(fit_intercept)):
+                        mu[j, k] = 0.0
+                for i in range(n_samples):
+                    deriv_loss(y[i], inner_products[i], deriv_new)
+                    for k in range(n_classes):
+                        if fit_intercept:
+                            mu[0, k] += deriv_new[k]
+                        for idx in range(indptr[i], indptr[i + 1]):
+                            mu[indices[idx] + int(fit_intercept), k] += (
+                                data[idx] * deriv_new[k]
+                            )
+                for k in range(n_classes):
+                    for j in range(n_features + int(fit_intercept)):
+                        mu[j, k] /= n_samples
+
+                # The full gradient mu is fixed during the epoch, so that we catch up
+                # lazily with the updates of the coordinates outside of the sampled
+                # rows when they are next needed. This contains the next iteration to
+                # be applied to each coordinate.
+                last_update = np.zeros(n_features, dtype=np.intp)
+                for i in range(n_samples):
+                    ind = np.random.randint(n_samples)
+                    row_start, row_end = indptr[ind], indptr[ind + 1]
+                    for idx in range(row_start, row_end):
+                        j = indices[idx]
+                        jj = j + int(fit_intercept)
+                        n_steps = i - last_update[j]
+                        if n_steps > 0:
+                            for k in range(n_classes):
+                                w_new[jj, k] = penalize_lazy(
+                                    w_new[jj, k], step * mu[jj, k], scaled_step, n_steps
+                                )
+
+                    for k in range(n_classes):
+                        if fit_intercept:
+                            inner_prod1[k] = w_new[0, k]
+                            inner_prod2[k] = weights[0, k]
+                        else:
+                            inner_prod1[k] = 0.0
+                            inner_prod2[k] = 0.0
+                        for idx in range(row_start, row_end):
+                            jj = indices[idx] + int(fit_intercept)
+                            inner_prod1[k] += data[idx] * w_new[jj, k]
+                            inner_prod2[k] += data[idx] * weights[jj, k]
+
+                    deriv_loss(y[ind], inner_prod1, deriv_new)
+                    deriv_loss(y[ind], inner_prod2, deriv_tilde)
+
+                    for k in range(n_classes):
+                        deriv_new[k] -= deriv_tilde[k]
+                        if fit_intercept:
+                            w_new[0, k] -= step * (deriv_new[k] + mu[0, k])
+                        for idx in range(row_start, row_end):
+                            jj = indices[idx] + int(fit_intercept)
+                            w_new[jj, k] -= step * (data[idx] * deriv_new[k] + mu[jj, k])
+                            w_new[jj, k] = penalize(w_new[jj, k], scaled_step)
+                    for idx in range(row_start, row_end):
+                        last_update[indices[idx]] = i + 1
+
+                for j in range(n_features):
+                    jj = j + int(fit_intercept)
+                    n_steps = n_samples - last_update[j]
+                    if n_steps > 0:
+                        for k in range(n_classes):
+                            w_new[jj, k] = penalize_lazy(
+                                w_new[jj, k], step * mu[jj, k], scaled_step, n_steps
+                            )
+
+                for k in range(n_classes):
+                    for j in range(n_features + int(fit_intercept)):
+                        # Update the maximum update change
+                        abs_delta_j = fabs(w_new[j, k] - weights[j, k])
+                        if abs_delta_j > max_abs_delta:
+                            max_abs_delta = abs_delta_j
+                        # Update the maximum weight
+                        abs_w_j_new = fabs(w_new[j, k])
+                        if abs_w_j_new > max_abs_weight:
+                            max_abs_weight = abs_w_j_new
+
+                        weights[j, k] = w_new[j, k]
 
-        if fit_intercept:
+                return max_abs_delta, max_abs_weight, 3 * n_samples
+
+            return cycle
+
+        elif fit_intercept:
 
             @jit(**jit_kwargs)
             def cycle(
-                weights, inner_products, state_estimator, inner_prod1, inner_prod2
+                X,
+                y,
+                weights,
+                inner_products,
+                state_estimator,
+                state_solver,
+                inner_prod1,
+                inner_prod2,
             ):
+                n_samples, n_features = X.shape
+                step = state_solver.step
+                scaled_step = state_solver.scaled_step
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
                 derivative = state_estimator.loss_derivative
                 deriv_tilde = state_estimator.partial_derivative
 
                 mu = state_estimator.gradient
+                deriv_samples = state_solver.deriv_samples
+                gradient_transposed = state_solver.gradient_transposed
                 for k in range(n_classes):
-                    for j in range(n_features + 1):
-                        mu[j, k] = 0.0
+                    mu[0, k] = 0.0
                 w_new = weights.copy()
-                decision_function(weights, inner_products)
+                decision_function(X, weights, inner_products)
 
+                # The full gradient is X.T @ D / n_samples with D the loss derivatives
                 for i in range(n_samples):
-                    deriv_loss(y[i], inner_products[i], derivative)
+                    deriv_loss(y[i], inner_products[i], deriv_samples[i])
                     for k in range(n_classes):
-                        mu[0, k] += derivative[k]
-                        for j in range(n_features):
-                            mu[j + 1, k] += X[i, j] * derivative[k]
+                        mu[0, k] += deriv_samples[i, k]
+                xt_dot(
+                    X, deriv_samples, state_solver.sample_blocks, gradient_transposed
+                )
                 for k in range(n_classes):
-                    for j in range(n_features + 1):
-                        mu[j, k] /= n_samples
+                    mu[0, k] /= n_samples
+                    for j in range(n_features):
+                        mu[j + 1, k] = gradient_transposed[0, k, j] / n_samples
 
                 deriv_new = derivative  # renaming
                 for i in range(n_samples):
@@ -101,8 +279,8 @@ class SVRG(Solver):
                         inner_prod1[k] = w_new[0, k]
                         inner_prod2[k] = weights[0, k]
                         for j in range(n_features):
-                            inner_prod1[k] += X[ind, j] * w_new[j, k]
-                            inner_prod2[k] += X[ind, j] * weights[j, k]
+                            inner_prod1[k] += X[ind, j] * w_new[j + 1, k]
+                            inner_prod2[k] += X[ind, j] * weights[j + 1, k]
 
                     deriv_loss(y[ind], inner_prod1, deriv_new)
                     deriv_loss(y[ind], inner_prod2, deriv_tilde)
@@ -137,8 +315,18 @@ class SVRG(Solver):
             # There is no intercept, so the code changes slightly
             @jit(**jit_kwargs)
             def cycle(
-                weights, inner_products, state_estimator, inner_prod1, inner_prod2
+                X,
+                y,
+                weights,
+                inner_products,
+                state_estimator,
+                state_solver,
+                inner_prod1,
+                inner_prod2,
             ):
+                n_samples, n_features = X.shape
+                step = state_solver.step
+                scaled_step = state_solver.scaled_step
                 max_abs_delta = 0.0
                 max_abs_weight = 0.0
                 mu = state_estimator.gradient
@@ -146,20 +334,18 @@ class SVRG(Solver):
                 deriv_tilde = state_estimator.partial_derivative
                 w_new = weights.copy()
 
-                decision_function(weights, inner_products)
-                for k in range(n_classes):
-                    for j in range(n_features):
-                        mu[j, k] = 0.0
+                decision_function(X, weights, inner_products)
+                # The full gradient is X.T @ D / n_samples with D the loss derivatives
+                deriv_samples = state_solver.deriv_samples
+                gradient_transposed = state_solver.gradient_transposed
                 for i in range(n_samples):
-                    deriv_loss(y[i], inner_products[i], loss_derivative)
-                    for k in range(n_classes):
-                        for j in range(n_features):
-                            mu[j, k] += (
-                                X[i, j] * loss_derivative[k]
-                            )  # np.outer(X[i], loss_derivative)
+                    deriv_loss(y[i], inner_products[i], deriv_samples[i])
+                xt_dot(
+                    X, deriv_samples, state_solver.sample_blocks, gradient_transposed
+                )
                 for k in range(n_classes):
                     for j in range(n_features):
-                        mu[j, k] /= n_samples
+                        mu[j, k] = gradient_transposed[0, k, j] / n_samples
 
                 deriv_new = loss_derivative  # renaming
                 for i in range(n_samples):
@@ -198,12 +384,13 @@ class SVRG(Solver):
             return cycle
 
     def solve(self, w0=None, dummy_first_step=False):
-        X = self.X
+        X = kernel_matrix(self.X)
+        y = self.y
         fit_intercept = self.fit_intercept
-        inner_products = np.empty((self.n_samples, self.n_classes), dtype=np_float)
-        inner_prod1 = np.empty(self.n_classes, dtype=np_float)
-        inner_prod2 = np.empty(self.n_classes, dtype=np_float)
-        weights = np.empty(self.weights_shape, dtype=np_float)
+        inner_products = np.empty((self.n_samples, self.n_classes), dtype=self.X.dtype)
+        inner_prod1 = np.empty(self.n_classes, dtype=self.X.dtype)
+        inner_prod2 = np.empty(self.n_classes, dtype=self.X.dtype)
+        weights = np.empty(self.weights_shape, dtype=self.X.dtype)
         tol = self.tol
         max_iter = self.max_iter
         history = self.history
@@ -213,8 +400,10 @@ class SVRG(Solver):
             weights.fill(0.0)
 
         # Computation of the initial inner products
-        decision_function = decision_function_factory(X, fit_intercept)
-        decision_function(weights, inner_products)
+        decision_function = decision_function_factory(
+            fit_intercept, matrix_type(self.X)
+        )
+        decision_function(X, weights, inner_products)
 
         # random_state = self.random_state
         # if random_state is not None:
@@ -226,7 +415,9 @@ class SVRG(Solver):
         #     numba_seed_numpy(random_state)
 
         # Get the cycle function
-        cycle = self.cycle_factory()
+        cycle = get_kernel(self.cycle_factory())
+        # Get the function deciding if the solver stops
+        stop = self.stopping_factory()
         # Get the objective function
         # objective = self.objective_factory()
         # # Compute the first value of the objective
@@ -234,35 +425,48 @@ class SVRG(Solver):
         # Get the estimator state (a place-holder for the estimator's internal
         # computations)
         state_estimator = self.estimator.get_state()
+        # Get the solver state (containing the learning rate)
+        state_solver = self.get_state()
 
         # TODO: First value for tolerance is 1.0 or NaN
         # history.update(epoch=0, obj=obj, tol=1.0, update_bar=True)
         if dummy_first_step:
-            cycle(weights, inner_products, state_estimator, inner_prod1, inner_prod2)
+            cycle(
+                X,
+                y,
+                weights,
+                inner_products,
+                state_estimator,
+                state_solver,
+                inner_prod1,
+                inner_prod2,
+            )
             if w0 is not None:
                 weights[:] = w0
             else:
                 weights.fill(0.0)
-            decision_function(weights, inner_products)
+            decision_function(X, weights, inner_products)
 
         history.update(weights, 0)
 
         for n_iter in range(1, max_iter + 1):
             max_abs_delta, max_abs_weight, sc_prods = cycle(
-                weights, inner_products, state_estimator, inner_prod1, inner_prod2
+                X,
+                y,
+                weights,
+                inner_products,
+                state_estimator,
+                state_solver,
+                inner_prod1,
+                inner_prod2,
             )
             # Compute the new value of objective
             # obj = objective(weights, inner_products)
-            if max_abs_weight == 0.0:
-                current_tol = 0.0
-            else:
-                current_tol = max_abs_delta / max_abs_weight
-
             # TODO: tester tous les cas "max_abs_weight == 0.0" etc..
             # history.update(epoch=n_iter, obj=obj, tol=current_tol, update_bar=True)
             history.update(weights, sc_prods)
 
-            if current_tol < tol:
+            if stop(n_iter, weights, max_abs_delta, max_abs_weight):
                 history.close_bar()
                 return OptimizationResult(
                     w=weights, n_iter=n_iter, success=True, tol=tol, message=None
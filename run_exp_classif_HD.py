@@ -178,8 +178,8 @@ def set_dataloader(dataset_name):
 
 def compute_binary_classif_history(model, X_train, y_train, X_test, y_test, seed):
     total_iter = model.history_.records[0].cursor
-    train_decision_function = decision_function_factory(X_train, model.fit_intercept)
-    test_decision_function = decision_function_factory(X_test, model.fit_intercept)
+    train_decision_function = decision_function_factory(model.fit_intercept)
+    test_decision_function = decision_function_factory(model.fit_intercept)
     train_inner_prods = np.empty((X_train.shape[0], model.n_classes), dtype=np_float)
     test_inner_prods = np.empty((X_test.shape[0], model.n_classes), dtype=np_float)
 
@@ -203,8 +203,8 @@ def compute_binary_classif_history(model, X_train, y_train, X_test, y_test, seed
     sc_prods_record = model.history_.record_nm("sc_prods").record
 
     for i in range(total_iter):
-        train_decision_function(weights_record[i], train_inner_prods)
-        test_decision_function(weights_record[i], test_inner_prods)
+        train_decision_function(X_train, weights_record[i], train_inner_prods)
+        test_decision_function(X_test, weights_record[i], test_inner_prods)
 
         y_scores = expit(test_inner_prods)
         y_scores_train = expit(train_inner_prods)
@@ -247,8 +247,8 @@ def compute_binary_classif_history(model, X_train, y_train, X_test, y_test, seed
 
 def compute_multi_classif_history(model, X_train, y_train, X_test, y_test, seed):
     total_iter = model.history_.records[0].cursor
-    train_decision_function = decision_function_factory(X_train, model.fit_intercept)
-    test_decision_function = decision_function_factory(X_test, model.fit_intercept)
+    train_decision_function = decision_function_factory(model.fit_intercept)
+    test_decision_function = decision_function_factory(model.fit_intercept)
     train_inner_prods = np.empty((X_train.shape[0], model.n_classes), dtype=np_float)
     test_inner_prods = np.empty((X_test.shape[0], model.n_classes), dtype=np_float)
 
@@ -280,8 +280,8 @@ def compute_multi_classif_history(model, X_train, y_train, X_test, y_test, seed)
     sc_prods_record = model.history_.record_nm("sc_prods").record
 
     for i in range(total_iter):
-        train_decision_function(weights_record[i], train_inner_prods)
-        test_decision_function(weights_record[i], test_inner_prods)
+        train_decision_function(X_train, weights_record[i], train_inner_prods)
+        test_decision_function(X_test, weights_record[i], test_inner_prods)
 
         y_scores = softmax(test_inner_prods, axis=1)
         y_scores_train = softmax(train_inner_prods, axis=1)
@@ -362,10 +362,8 @@ def compute_regression_history(model, X_train, y_train, X_test, y_test, seed):
     else:
 
         total_iter = model.history_.records[0].cursor
-        train_decision_function = decision_function_factory(
-            X_train, model.fit_intercept
-        )
-        test_decision_function = decision_function_factory(X_test, model.fit_intercept)
+        train_decision_function = decision_function_factory(model.fit_intercept)
+        test_decision_function = decision_function_factory(model.fit_intercept)
         train_inner_prods = np.empty(
             (X_train.shape[0], model.n_classes), dtype=np_float
         )
@@ -380,8 +378,8 @@ def compute_regression_history(model, X_train, y_train, X_test, y_test, seed):
         sc_prods_record = model.history_.record_nm("sc_prods").record
 
         for i in range(total_iter):
-            train_decision_function(weights_record[i], train_inner_prods)
-            test_decision_function(weights_record[i], test_inner_prods)
+            train_decision_function(X_train, weights_record[i], train_inner_prods)
+            test_decision_function(X_test, weights_record[i], test_inner_prods)
 
             y_scores = test_inner_prods
             y_scores_train = train_inner_prods
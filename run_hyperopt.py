@@ -206,8 +206,8 @@ def set_dataloader(dataset_name):
 
 def compute_binary_classif_history(model, X_train, y_train, X_test, y_test, seed):
     total_iter = model.history_.records[0].cursor
-    train_decision_function = decision_function_factory(X_train, model.fit_intercept)
-    test_decision_function = decision_function_factory(X_test, model.fit_intercept)
+    train_decision_function = decision_function_factory(model.fit_intercept)
+    test_decision_function = decision_function_factory(model.fit_intercept)
     train_inner_prods = np.empty((X_train.shape[0], model.n_classes), dtype=np_float)
     test_inner_prods = np.empty((X_test.shape[0], model.n_classes), dtype=np_float)
 
@@ -231,8 +231,8 @@ def compute_binary_classif_history(model, X_train, y_train, X_test, y_test, seed
     sc_prods_record = model.history_.record_nm("sc_prods").record
 
     for i in range(total_iter):
-        train_decision_function(weights_record[i], train_inner_prods)
-        test_decision_function(weights_record[i], test_inner_prods)
+        train_decision_function(X_train, weights_record[i], train_inner_prods)
+        test_decision_function(X_test, weights_record[i], test_inner_prods)
 
         y_scores = expit(test_inner_prods)
         y_scores_train = expit(train_inner_prods)
@@ -275,8 +275,8 @@ def compute_binary_classif_history(model, X_train, y_train, X_test, y_test, seed
 
 def compute_multi_classif_history(model, X_train, y_train, X_test, y_test, seed):
     total_iter = model.history_.records[0].cursor
-    train_decision_function = decision_function_factory(X_train, model.fit_intercept)
-    test_decision_function = decision_function_factory(X_test, model.fit_intercept)
+    train_decision_function = decision_function_factory(model.fit_intercept)
+    test_decision_function = decision_function_factory(model.fit_intercept)
     train_inner_prods = np.empty((X_train.shape[0], model.n_classes), dtype=np_float)
     test_inner_prods = np.empty((X_test.shape[0], model.n_classes), dtype=np_float)
 
@@ -308,8 +308,8 @@ def compute_multi_classif_history(model, X_train, y_train, X_test, y_test, seed)
     sc_prods_record = model.history_.record_nm("sc_prods").record
 
     for i in range(total_iter):
-        train_decision_function(weights_record[i], train_inner_prods)
-        test_decision_function(weights_record[i], test_inner_prods)
+        train_decision_function(X_train, weights_record[i], train_inner_prods)
+        test_decision_function(X_test, weights_record[i], test_inner_prods)
 
         y_scores = softmax(test_inner_prods, axis=1)
         y_scores_train = softmax(train_inner_prods, axis=1)
@@ -390,8 +390,8 @@ def compute_regression_history(model, X_train, y_train, X_test, y_test, seed):
     else:
 
         total_iter = model.history_.records[0].cursor
-        train_decision_function = decision_function_factory(X_train, model.fit_intercept)
-        test_decision_function = decision_function_factory(X_test, model.fit_intercept)
+        train_decision_function = decision_function_factory(model.fit_intercept)
+        test_decision_function = decision_function_factory(model.fit_intercept)
         train_inner_prods = np.empty((X_train.shape[0], model.n_classes), dtype=np_float)
         test_inner_prods = np.empty((X_test.shape[0], model.n_classes), dtype=np_float)
 
@@ -404,8 +404,8 @@ def compute_regression_history(model, X_train, y_train, X_test, y_test, seed):
         sc_prods_record = model.history_.record_nm("sc_prods").record
 
         for i in range(total_iter):
-            train_decision_function(weights_record[i], train_inner_prods)
-            test_decision_function(weights_record[i], test_inner_prods)
+            train_decision_function(X_train, weights_record[i], train_inner_prods)
+            test_decision_function(X_test, weights_record[i], test_inner_prods)
 
             y_scores = test_inner_prods
             y_scores_train = train_inner_prods
@@ -8,12 +8,14 @@ This module contains unittests for the estimators. Can be run using
     > pytest -v
 """
 
+import numpy as np
 import pytest
+from scipy.sparse import random as sparse_random
 
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import roc_auc_score
 
-from linlearn import Classifier
+from linlearn import Classifier, Regressor
 from .utils import simulate_true_logistic
 
 
@@ -55,3 +57,255 @@ def test_estimators_on_simple_data(estimator, solver, fit_intercept):
     assert roc_auc_score(y_test, y_score) >= 0.8
     assert coef0 == pytest.approx(clf.coef_.ravel(), abs=0.5, rel=0.5)
     assert intercept0 == pytest.approx(clf.intercept_, abs=0.5, rel=0.5)
+
+
+@pytest.mark.parametrize("estimator", ("erm", "mom", "tmean", "ch"))
+@pytest.mark.parametrize("fit_intercept", (False, True))
+def test_cgd_sparse_same_as_dense(estimator, fit_intercept):
+    n_samples, n_features = 200, 20
+    X = sparse_random(
+        n_samples, n_features, density=0.1, format="csc", random_state=1
+    )
+    rng = np.random.RandomState(1)
+    y = X.dot(rng.randn(n_features)) + 0.1 * rng.randn(n_samples)
+    kwargs = {
+        "estimator": estimator,
+        "solver": "cgd",
+        "loss": "leastsquares",
+        "fit_intercept": fit_intercept,
+        "max_iter": 20,
+        "tol": 0.0,
+        "block_size": 0.1,
+    }
+    if estimator == "mom":
+        # The blocks are drawn differently for sparse features, so we use a single
+        # block and let both fits converge
+        kwargs.update(max_iter=200, block_size=1.0)
+    reg_dense = Regressor(random_state=1, **kwargs).fit(X.toarray(), y)
+    reg_sparse = Regressor(random_state=1, **kwargs).fit(X, y)
+    np.testing.assert_allclose(reg_sparse.coef_, reg_dense.coef_, atol=1e-10)
+    np.testing.assert_allclose(
+        reg_sparse.intercept_, reg_dense.intercept_, atol=1e-10
+    )
+    np.testing.assert_allclose(reg_sparse.predict(X), reg_dense.predict(X), atol=1e-10)
+
+
+@pytest.mark.parametrize("sparse", (False, True))
+@pytest.mark.parametrize("penalty", ("l2", "l1"))
+@pytest.mark.parametrize("fit_intercept", (False, True))
+def test_erm_cached_derivatives(sparse, penalty, fit_intercept, monkeypatch):
+    from linlearn._loss import MultiLogistic
+
+    n_samples, n_features, n_classes = 300, 10, 3
+    X = sparse_random(
+        n_samples, n_features, density=0.3, format="csc", random_state=1
+    )
+    rng = np.random.RandomState(1)
+    y = np.argmax(X.dot(rng.randn(n_features, n_classes)), axis=1)
+    if not sparse:
+        X = X.toarray()
+    kwargs = {
+        "loss": "multilogistic",
+        "penalty": penalty,
+        "C": 10.0 if penalty == "l2" else 0.5,
+        "fit_intercept": fit_intercept,
+        "max_iter": 30,
+        "tol": 0.0,
+        "random_state": 1,
+    }
+    clf_cached = Classifier(**kwargs).fit(X, y)
+    monkeypatch.setattr(MultiLogistic, "costly_deriv", False)
+    clf = Classifier(**kwargs).fit(X, y)
+    np.testing.assert_allclose(clf_cached.coef_, clf.coef_, atol=1e-12)
+    np.testing.assert_allclose(clf_cached.intercept_, clf.intercept_, atol=1e-12)
+
+
+@pytest.mark.parametrize("dtype", (np.float32, np.float64))
+def test_erm_grad_state(dtype):
+    from linlearn._loss import LeastSquares
+    from linlearn.estimator import ERM
+
+    rng = np.random.RandomState(1)
+    X = rng.randn(100, 5).astype(dtype)
+    y = X.dot(rng.randn(5)).astype(dtype)
+    inner_products = X.dot(np.ones(5)).astype(dtype)[:, np.newaxis]
+    estimator = ERM(X, y, LeastSquares(), 1, False)
+    # The place-holders of grad are only allocated once grad_factory is called
+    state = estimator.get_state()
+    assert state.deriv_samples.shape[0] == state.sample_blocks.shape[0] == 0
+    grad = estimator.grad_factory()
+    with pytest.raises(ValueError, match="must be obtained after calling grad_factory"):
+        grad(X, y, inner_products, state)
+    state = estimator.get_state()
+    assert state.deriv_samples.shape == (100, 1)
+    assert state.deriv_samples.dtype == dtype
+    grad(X, y, inner_products, state)
+    expected = X.T.dot(inner_products[:, 0] - y) / 100
+    np.testing.assert_allclose(state.gradient[:, 0], expected, rtol=1e-4)
+
+
+@pytest.mark.parametrize("block_resampling", ("epoch", 3))
+@pytest.mark.parametrize("fit_intercept", (False, True))
+def test_mom_block_resampling(block_resampling, fit_intercept):
+    n_samples, n_features = 300, 10
+    X = sparse_random(
+        n_samples, n_features, density=0.3, format="csc", random_state=1
+    )
+    rng = np.random.RandomState(1)
+    y = X.dot(rng.randn(n_features)) + 0.1 * rng.randn(n_samples)
+    kwargs = {
+        "estimator": "mom",
+        "solver": "cgd",
+        "loss": "leastsquares",
+        "fit_intercept": fit_intercept,
+        "block_size": 0.1,
+        "block_resampling": block_resampling,
+        "max_iter": 20,
+        "tol": 0.0,
+    }
+    # The blocks are drawn the same way for dense and sparse features
+    reg_dense = Regressor(random_state=1, **kwargs).fit(X.toarray(), y)
+    reg_sparse = Regressor(random_state=1, **kwargs).fit(X, y)
+    np.testing.assert_allclose(reg_sparse.coef_, reg_dense.coef_, atol=1e-10)
+    np.testing.assert_allclose(
+        reg_sparse.intercept_, reg_dense.intercept_, atol=1e-10
+    )
+    reg_coordinate = Regressor(
+        random_state=1, **dict(kwargs, block_resampling="coordinate", max_iter=200)
+    ).fit(X, y)
+    np.testing.assert_allclose(reg_dense.coef_, reg_coordinate.coef_, atol=0.2)
+
+    with pytest.raises(ValueError, match="block_resampling must be"):
+        Regressor(block_resampling=0)
+    with pytest.raises(ValueError, match="block_resampling must be"):
+        Regressor(block_resampling="block")
+
+
+def test_dkk_top_eigenvector():
+    from linlearn.estimator.dkk import top_eigenvector, dkk
+
+    rng = np.random.RandomState(2)
+    n_samples, d = 200, 6
+    vecs = rng.randn(n_samples, d) * np.arange(1, d + 1)
+    w = rng.uniform(size=n_samples)
+    w[:20] = 0.0
+    sum_w = w.sum()
+    mu = w.dot(vecs) / sum_w
+    centered = vecs - mu
+    sigma = centered.T.dot(w[:, np.newaxis] * centered) / sum_w
+    eigvals, eigvecs = np.linalg.eigh(sigma)
+
+    v = rng.randn(d)
+    eigenvalue = top_eigenvector(
+        vecs, mu, w, sum_w, v, np.empty(d), tol=1e-12, max_iter=1000
+    )
+    assert eigenvalue == pytest.approx(eigvals[-1], rel=1e-8)
+    np.testing.assert_allclose(np.abs(v.dot(eigvecs[:, -1])), 1.0, atol=1e-6)
+
+    # Corrupted samples along the first axis are removed from the mean
+    vecs = rng.randn(n_samples, d)
+    vecs[:10, 0] += 50.0
+    mu = dkk(np.asfortranarray(vecs), 0.1)
+    assert np.abs(mu).max() < 0.5
+    assert np.abs(vecs.mean(axis=0)[0]) > 2.0
+
+
+@pytest.mark.parametrize("n_classes", (1, 3))
+@pytest.mark.parametrize("fit_intercept", (False, True))
+def test_hg_rank_one_same_as_dense(n_classes, fit_intercept):
+    from linlearn.estimator.hg import alg2, alg2_rank_one
+
+    n_samples, n_features = 400, 6
+    rng = np.random.RandomState(3)
+    X = rng.randn(n_samples, n_features) * np.linspace(1.0, 3.0, n_features)
+    deriv_samples = rng.randn(n_samples, n_classes)
+    deriv_samples[:10] *= 30.0
+    if fit_intercept:
+        X_intercept = np.hstack((np.ones((n_samples, 1)), X))
+    else:
+        X_intercept = X
+    sample_gradients = (
+        X_intercept[:, :, np.newaxis] * deriv_samples[:, np.newaxis, :]
+    ).reshape((n_samples, -1))
+    np.testing.assert_allclose(
+        alg2_rank_one(X, deriv_samples, fit_intercept, 0.04, 0.01),
+        alg2(sample_gradients, 0.04, 0.01).ravel(),
+        atol=1e-12,
+    )
+
+
+@pytest.mark.parametrize("scale", (1e-3, 1.0, 100.0))
+def test_ch_warm_holland_catoni(scale):
+    from scipy.optimize import brentq
+    from linlearn.estimator.ch import warm_holland_catoni, khi, gud
+
+    eps = 1e-3
+    rng = np.random.RandomState(4)
+    n_samples = 500
+    x = scale * rng.standard_t(2, size=n_samples) + scale
+    # The roots of the equations defining the scale and the location
+    x_mean = x.mean()
+    sigma = brentq(lambda s: np.mean(khi((x - x_mean) / s)), 1e-12, 1e12)
+    s = sigma * np.sqrt(n_samples / np.log(1 / eps))
+    location = brentq(lambda m: np.mean(gud((x - m) / s)), x.min(), x.max())
+
+    estimate, sigma_cold = warm_holland_catoni(x, eps, 0.0, 0.0)
+    assert sigma_cold == pytest.approx(sigma, rel=1e-5)
+    assert estimate == pytest.approx(location, abs=1e-5 * scale)
+    # Warm-started from the estimate of slightly different samples
+    estimate_warm, sigma_warm = warm_holland_catoni(
+        x, eps, 1.1 * sigma_cold, estimate + 0.1 * scale
+    )
+    assert sigma_warm == pytest.approx(sigma, rel=1e-5)
+    assert estimate_warm == pytest.approx(location, abs=1e-5 * scale)
+    # Constant samples
+    assert warm_holland_catoni(np.full(10, 2.0), eps, 0.0, 0.0)[0] == 2.0
+
+
+@pytest.mark.parametrize("fit_intercept", (False, True))
+def test_ch_gd_same_as_cgd(fit_intercept):
+    rng = np.random.RandomState(5)
+    n_samples, n_features = 300, 40
+    X = rng.randn(n_samples, n_features)
+    y = X.dot(rng.randn(n_features)) + 0.5 * rng.standard_t(2, size=n_samples)
+    kwargs = dict(
+        estimator="ch",
+        loss="leastsquares",
+        penalty="l2",
+        C=10.0,
+        fit_intercept=fit_intercept,
+        max_iter=500,
+        tol=1e-7,
+    )
+    reg_gd = Regressor(solver="gd", **kwargs).fit(X, y)
+    reg_cgd = Regressor(solver="cgd", **kwargs).fit(X, y)
+    np.testing.assert_allclose(reg_gd.coef_, reg_cgd.coef_, atol=1e-3)
+    np.testing.assert_allclose(reg_gd.intercept_, reg_cgd.intercept_, atol=1e-3)
+
+
+def test_gmom_weiszfeld():
+    from linlearn.estimator.gmom import weiszfeld
+
+    rng = np.random.RandomState(6)
+    n_elem, n_dim = 30, 8
+    xs = rng.standard_t(2, size=(n_elem, n_dim))
+    inv_dists = np.empty(n_elem)
+    median_new = np.empty(n_dim)
+
+    median = np.empty(n_dim)
+    n_iter = weiszfeld(xs, median, inv_dists, median_new, False, 1e-12)
+    # The sum of the unit vectors from the geometric median to the points is zero
+    diffs = xs - median
+    units = diffs / np.linalg.norm(diffs, axis=1)[:, np.newaxis]
+    np.testing.assert_allclose(units.sum(axis=0), 0.0, atol=1e-8)
+
+    # Warm-started from the geometric median of slightly different points
+    median_warm = median + 1e-3
+    n_iter_warm = weiszfeld(xs, median_warm, inv_dists, median_new, True, 1e-12)
+    np.testing.assert_allclose(median_warm, median, atol=1e-10)
+    assert n_iter_warm < n_iter
+
+    # The geometric median is a point when most points are equal to it
+    xs[: n_elem // 2 + 1] = 1.0
+    weiszfeld(xs, median, inv_dists, median_new, False, 1e-12)
+    np.testing.assert_allclose(median, 1.0, atol=1e-8)
@@ -1,4 +1,6 @@
+from linlearn import Classifier, Regressor
 from linlearn.solver import History
+import numpy as np
 import pytest
 
 
@@ -28,3 +30,106 @@ def test_history():
     assert "'update' excepted the following keys:" in exc_info.value.args[0]
 
     # TODO: figure out how to test print()
+
+
+@pytest.mark.parametrize(
+    "record, record_size, iterations",
+    [
+        ("all", None, np.arange(10)),
+        ("off", None, np.arange(0)),
+        (3, None, np.array([0, 3, 6, 9])),
+        ("all", 4, np.array([6, 7, 8, 9])),
+        (2, 3, np.array([4, 6, 8])),
+        ("delta", None, np.arange(10)),
+    ],
+)
+def test_history_record_policies(record, record_size, iterations):
+    history = History("Truc", 9, False, record=record, record_size=record_size)
+    history.allocate_record((2, 3), "weights")
+    history.allocate_record(1, "time")
+    history.allocate_record(1, "sc_prods")
+    iterates = np.zeros((10, 2, 3))
+    for i in range(10):
+        # Only one entry changes at each iteration
+        iterates[i:, i % 2, i % 3] = i + 1.0
+        history.update(iterates[i], 2, n_iter=i)
+
+    weights = history.record_nm("weights")
+    np.testing.assert_array_equal(weights.stored_iterations(), iterations)
+    np.testing.assert_array_equal(weights.values(), iterates[iterations])
+    assert len(list(weights)) == iterations.shape[0]
+    for value, iteration in zip(weights, iterations):
+        np.testing.assert_array_equal(value, iterates[iteration])
+    sc_prods = history.record_nm("sc_prods")
+    np.testing.assert_array_equal(sc_prods.values(), 2 * (iterations + 1))
+    assert history.end_time >= history.start_time
+
+    with pytest.raises(ValueError, match="record_size cannot be used"):
+        History("Truc", 9, False, record="delta", record_size=3)
+
+
+def test_learner_history_record():
+    rng = np.random.RandomState(0)
+    X = rng.randn(100, 5)
+    y = X.dot(rng.randn(5))
+    kwargs = {"solver": "gd", "loss": "leastsquares", "max_iter": 10, "tol": 0.0}
+    reg = Regressor(**kwargs).fit(X, y)
+    reg.compute_objective_history(X, y)
+    objectives = reg.history_.record_nm("objective").values()
+
+    reg_every = Regressor(history_record=4, **kwargs).fit(X, y)
+    np.testing.assert_allclose(reg_every.coef_, reg.coef_)
+    reg_every.compute_objective_history(X, y)
+    np.testing.assert_array_equal(
+        reg_every.history_.record_nm("objective").stored_iterations(), [0, 4, 8]
+    )
+    np.testing.assert_allclose(
+        reg_every.history_.record_nm("objective").values(), objectives[[0, 4, 8]]
+    )
+
+    reg_off = Regressor(history_record="off", **kwargs).fit(X, y)
+    np.testing.assert_allclose(reg_off.coef_, reg.coef_)
+    assert len(reg_off.history_.record_nm("weights")) == 0
+    assert reg_off.fit_time() >= 0.0
+
+    with pytest.raises(ValueError, match="history_record must be"):
+        Regressor(history_record=0)
+    with pytest.raises(ValueError, match="history_size must be"):
+        Regressor(history_size="last")
+
+
+@pytest.mark.parametrize("chunk_size", (None, 3))
+def test_compute_objective_history(chunk_size):
+    rng = np.random.RandomState(0)
+    X, X_test = rng.randn(100, 5), rng.randn(50, 5)
+    coef = rng.randn(5)
+    y, y_test = X.dot(coef), X_test.dot(coef)
+    reg = Regressor(solver="gd", loss="leastsquares", max_iter=10, tol=0.0)
+    reg.fit(X, y)
+    reg.compute_objective_history(
+        X, y, X_test=X_test, y_test=y_test, chunk_size=chunk_size
+    )
+    for X_, y_, name in [(X, y, "objective"), (X_test, y_test, "objective_test")]:
+        objective = reg.objective_factory(y_)
+        expected = [
+            objective(y_, weights, X_.dot(weights[1:]) + weights[0])
+            for weights in reg.history_.record_nm("weights")
+        ]
+        np.testing.assert_allclose(
+            reg.history_.record_nm(name).values(), expected, rtol=1e-10
+        )
+
+
+@pytest.mark.parametrize("n_classes", (2, 3))
+def test_compute_misclassification_history(n_classes):
+    rng = np.random.RandomState(0)
+    X = rng.randn(200, 5)
+    y = np.array(["a", "b", "c"])[rng.randint(n_classes, size=200)]
+    loss = "squaredhinge" if n_classes == 2 else "multisquaredhinge"
+    clf = Classifier(solver="gd", loss=loss, max_iter=10, tol=0.0).fit(X, y)
+    clf.compute_objective_history(X, y, metric="misclassif_rate")
+    rates = clf.history_.record_nm("misclassif_rate").values()
+    assert rates[-1] == pytest.approx(1 - clf.score(X, y))
+
+    with pytest.raises(ValueError, match="Unknown metric"):
+        clf.compute_objective_history(X, y, metric="accuracy")
@@ -375,4 +375,43 @@ def test_fit_same_sklearn_simulated_multiclass(
 #             clf_linlearn.predict_log_proba(X), abs=abs_approx, rel=rel_approx
 #         )
 #         assert (clf_scikit.predict(X) == clf_linlearn.predict(X)).any()
-#         assert clf_scikit.score(X, y) == clf_linlearn.score(X, y)
\ No newline at end of file
+#         assert clf_scikit.score(X, y) == clf_linlearn.score(X, y)
+
+@pytest.mark.parametrize("fit_intercept", (False, True))
+@pytest.mark.parametrize("solver", ("cgd", "gd"))
+def test_ovr_same_as_binary_fits(fit_intercept, solver):
+    X, y = make_classification(
+        n_samples=300,
+        n_features=8,
+        n_informative=6,
+        n_classes=4,
+        random_state=random_state,
+    )
+    kwargs = {
+        "loss": "squaredhinge",
+        "solver": solver,
+        "fit_intercept": fit_intercept,
+        "max_iter": 50,
+        "random_state": random_state,
+    }
+    clf = Classifier(multi_class="ovr", n_jobs=2, **kwargs).fit(X, y)
+    assert clf.coef_.shape == (4, 8)
+    assert clf.intercept_.shape == (4,)
+    assert clf.n_iter_.shape == (4,)
+    assert len(clf.history_) == 4
+    for k in range(4):
+        clf_k = Classifier(**kwargs).fit(X, y == k)
+        np.testing.assert_allclose(clf.coef_[k], clf_k.coef_[0], atol=1e-10)
+        np.testing.assert_allclose(clf.intercept_[k], clf_k.intercept_[0], atol=1e-10)
+    scores = clf.decision_function(X)
+    np.testing.assert_array_equal(clf.predict(X), scores.argmax(axis=1))
+    # The fit time is the wall time over the binary problems
+    start_time = min(history.start_time for history in clf.history_)
+    end_time = max(history.end_time for history in clf.history_)
+    assert clf.fit_time() == end_time - start_time
+    assert clf.fit_time() >= 0.0
+
+
+def test_multi_class_is_checked():
+    with pytest.raises(ValueError, match="multi_class must be either"):
+        Classifier(multi_class="ovo")
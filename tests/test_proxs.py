@@ -1,3 +1,29 @@
+import numpy as np
+import pytest
+
+from linlearn._penalty import NoPen, L2Sq, L1, ElasticNet
+
+
+@pytest.mark.parametrize(
+    "penalty", [NoPen(1.0), L2Sq(1.0), L1(1.0), ElasticNet(1.0, 0.3)]
+)
+def test_apply_one_unscaled_lazy(penalty):
+    apply_one_unscaled = penalty.apply_one_unscaled_factory()
+    apply_one_unscaled_lazy = penalty.apply_one_unscaled_lazy_factory()
+    rng = np.random.RandomState(42)
+    for _ in range(500):
+        x = 3 * rng.randn()
+        drift = rng.choice([0.0, 1e-3, 0.1]) * rng.randn()
+        t = rng.choice([0.0, 1e-3, 0.1, 1.0]) * rng.rand()
+        n_steps = rng.randint(0, 100)
+        expected = x
+        for _ in range(n_steps):
+            expected = apply_one_unscaled(expected - drift, t)
+        assert apply_one_unscaled_lazy(x, drift, t, n_steps) == pytest.approx(
+            expected, abs=1e-10, rel=1e-8
+        )
+
+
 # import numpy as np
 # from numpy.linalg import norm
 # import pytest
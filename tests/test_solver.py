@@ -0,0 +1,427 @@
+# Authors: Stephane Gaiffas <stephane.gaiffas@gmail.com>
+#          Ibrahim Merad <imerad7@gmail.com>
+# License: BSD 3 clause
+
+"""
+This module contains unittests for the solvers. Can be run using
+
+    > pytest -v
+"""
+
+import numba
+import numpy as np
+import pytest
+from numba import jit, prange
+from scipy.sparse import random as sparse_random
+from scipy.sparse import csc_matrix
+
+from linlearn import Regressor, Classifier
+
+
+def n_running_threads():
+    """Number of threads which actually run the iterations of a parallel loop. The
+    fits with n_jobs > 1 are serial when this is 1 (n_jobs is clipped to the number
+    of threads of numba, and the threading layer can be limited to one thread)."""
+    if numba.config.NUMBA_NUM_THREADS < 2 or not hasattr(numba, "get_thread_id"):
+        return 1
+
+    @jit(nopython=True, parallel=True)
+    def thread_ids(n):
+        ids = np.empty(n, dtype=np.intp)
+        for i in prange(n):
+            ids[i] = numba.get_thread_id()
+        return ids
+
+    return np.unique(thread_ids(10000)).size
+
+
+requires_threads = pytest.mark.skipif(
+    n_running_threads() < 2,
+    reason="parallel fits need at least 2 running threads (see NUMBA_NUM_THREADS "
+    "and NUMBA_THREADING_LAYER)",
+)
+
+
+def simulate_sparse(n_samples, n_features, density, format, random_state=1):
+    X = sparse_random(
+        n_samples,
+        n_features,
+        density=density,
+        format=format,
+        random_state=random_state,
+    )
+    rng = np.random.RandomState(random_state)
+    y = X.dot(rng.randn(n_features)) + 0.1 * rng.randn(n_samples)
+    return X, y
+
+
+@pytest.mark.parametrize("solver", ("sgd", "saga", "svrg"))
+@pytest.mark.parametrize("penalty", ("none", "l2", "l1", "elasticnet"))
+@pytest.mark.parametrize("fit_intercept", (False, True))
+def test_lazy_updates_same_as_dense(solver, penalty, fit_intercept):
+    X, y = simulate_sparse(200, 30, density=0.1, format="csr")
+    kwargs = {
+        "solver": solver,
+        "loss": "leastsquares",
+        "penalty": penalty,
+        "C": 0.05,
+        "l1_ratio": 0.4,
+        "fit_intercept": fit_intercept,
+        "max_iter": 10,
+        "tol": 0.0,
+    }
+    reg_dense = Regressor(random_state=1, **kwargs).fit(X.toarray(), y)
+    reg_sparse = Regressor(random_state=1, **kwargs).fit(X, y)
+    np.testing.assert_allclose(reg_sparse.coef_, reg_dense.coef_, atol=1e-10)
+    np.testing.assert_allclose(
+        reg_sparse.intercept_, reg_dense.intercept_, atol=1e-10
+    )
+
+
+@pytest.mark.parametrize("penalty", ("l2", "l1"))
+def test_dense_svrg_same_solution_as_cgd(penalty):
+    # The intercept is non-zero, so that a shift between the coefficients and the
+    # columns of X in the dense SVRG updates would show
+    rng = np.random.RandomState(1)
+    X = rng.randn(200, 10)
+    y = X.dot(rng.randn(10)) + 0.1 * rng.randn(200) + 3.0
+    kwargs = {
+        "loss": "leastsquares",
+        "penalty": penalty,
+        "fit_intercept": True,
+        "tol": 1e-10,
+        "random_state": 1,
+    }
+    reg_cgd = Regressor(solver="cgd", max_iter=500, **kwargs).fit(X, y)
+    reg_svrg = Regressor(solver="svrg", max_iter=300, **kwargs).fit(X, y)
+    np.testing.assert_allclose(reg_svrg.coef_, reg_cgd.coef_, atol=1e-6)
+    np.testing.assert_allclose(reg_svrg.intercept_, reg_cgd.intercept_, atol=1e-6)
+
+
+@pytest.mark.parametrize(
+    "solver, estimator",
+    (("cgd", "erm"), ("cgd", "mom"), ("gd", "erm"), ("sgd", "erm"), ("saga", "erm")),
+)
+def test_float32_same_as_float64(solver, estimator):
+    rng = np.random.RandomState(2)
+    X = rng.randn(300, 10)
+    y = X.dot(rng.randn(10)) + 0.1 * rng.randn(300)
+    kwargs = {
+        "solver": solver,
+        "estimator": estimator,
+        "loss": "leastsquares",
+        "block_size": 1.0,
+        "max_iter": 50,
+        "random_state": 42,
+    }
+    reg64 = Regressor(**kwargs).fit(X, y)
+    reg32 = Regressor(dtype="float32", **kwargs).fit(X.astype(np.float32), y)
+    assert reg32.coef_.dtype == np.float32
+    assert reg32.intercept_.dtype == np.float32
+    assert reg32.history_.record_nm("weights").record.dtype == np.float32
+    np.testing.assert_allclose(reg32.coef_, reg64.coef_, atol=1e-3)
+    np.testing.assert_allclose(reg32.intercept_, reg64.intercept_, atol=1e-3)
+
+
+def test_dtype_is_checked():
+    with pytest.raises(ValueError, match="dtype must be either"):
+        Regressor(dtype="int32")
+    with pytest.raises(ValueError, match="dtype must be either"):
+        Regressor(dtype=None)
+
+
+@requires_threads
+@pytest.mark.parametrize("estimator", ("erm", "mom", "tmean"))
+@pytest.mark.parametrize("fit_intercept", (False, True))
+@pytest.mark.parametrize("sparse", (False, True))
+def test_parallel_cgd_same_as_serial(estimator, fit_intercept, sparse):
+    X, y = simulate_sparse(5000, 10, density=0.5, format="csc")
+    if not sparse:
+        X = X.toarray()
+    kwargs = {
+        "solver": "cgd",
+        "estimator": estimator,
+        "loss": "leastsquares",
+        "fit_intercept": fit_intercept,
+        "max_iter": 10,
+        "tol": 0.0,
+        "random_state": 1,
+    }
+    reg_serial = Regressor(**kwargs).fit(X, y)
+    reg_parallel = Regressor(n_jobs=2, **kwargs).fit(X, y)
+    # Partial sums are added in a fixed order, so that the results do not depend on
+    # the number of threads, for all the estimators
+    np.testing.assert_allclose(reg_parallel.coef_, reg_serial.coef_, atol=1e-10)
+    np.testing.assert_allclose(
+        reg_parallel.intercept_, reg_serial.intercept_, atol=1e-10
+    )
+
+
+def test_n_jobs_is_checked():
+    with pytest.raises(ValueError, match="n_jobs must be None or a non-zero integer"):
+        Regressor(n_jobs=0)
+    with pytest.raises(ValueError, match="n_jobs must be None or a non-zero integer"):
+        Regressor(n_jobs=1.5)
+
+
+@requires_threads
+@pytest.mark.parametrize("penalty", ("l2", "l1"))
+@pytest.mark.parametrize("fit_intercept", (False, True))
+@pytest.mark.parametrize("sparse", (False, True))
+def test_parallel_cgd_same_solution_as_cgd(penalty, fit_intercept, sparse):
+    X, y = simulate_sparse(300, 50, density=0.2, format="csc")
+    if not sparse:
+        X = X.toarray()
+    kwargs = {
+        "loss": "leastsquares",
+        "penalty": penalty,
+        "C": 1.0,
+        "fit_intercept": fit_intercept,
+        "max_iter": 500,
+        "tol": 1e-10,
+        "random_state": 1,
+    }
+    reg_cgd = Regressor(solver="cgd", **kwargs).fit(X, y)
+    reg_parallel = Regressor(solver="parallel_cgd", n_jobs=3, **kwargs).fit(X, y)
+    assert reg_parallel.optimization_result_.success
+    np.testing.assert_allclose(reg_parallel.coef_, reg_cgd.coef_, atol=1e-6)
+    np.testing.assert_allclose(reg_parallel.intercept_, reg_cgd.intercept_, atol=1e-6)
+
+
+def test_parallel_cgd_importance_sampling_is_checked():
+    X, y = simulate_sparse(50, 10, density=0.5, format="csc")
+    with pytest.raises(ValueError, match="importance sampling of the coordinates"):
+        Regressor(solver="parallel_cgd", n_jobs=2, cgd_IS=True).fit(X, y)
+
+
+@pytest.mark.parametrize("penalty", ("l2", "l1"))
+@pytest.mark.parametrize("fit_intercept", (False, True))
+def test_path_same_as_fits(penalty, fit_intercept):
+    X, y = simulate_sparse(200, 20, density=0.5, format="csc")
+    X = X.toarray()
+    kwargs = {
+        "loss": "leastsquares",
+        "penalty": penalty,
+        "fit_intercept": fit_intercept,
+        "max_iter": 500,
+        "tol": 1e-10,
+        "random_state": 1,
+    }
+    Cs = [1.0, 1e-3, 1e-1, 1e-2]
+    reg = Regressor(C=0.5, **kwargs)
+    coefs, intercepts = reg.path(X, y, Cs)
+    assert coefs.shape == (4, 1, 20)
+    assert intercepts.shape == (4, 1)
+    assert reg.C == 0.5
+    np.testing.assert_array_equal(reg.coef_, coefs[0])
+    for C, coef, intercept in zip(Cs, coefs, intercepts):
+        reg_C = Regressor(C=C, **kwargs).fit(X, y)
+        np.testing.assert_allclose(coef, reg_C.coef_, atol=1e-7)
+        np.testing.assert_allclose(intercept, reg_C.intercept_, atol=1e-7)
+    with pytest.raises(ValueError, match="Cs must be a non-empty sequence"):
+        reg.path(X, y, [1.0, -1.0])
+
+
+def test_warm_start():
+    X, y = simulate_sparse(200, 20, density=0.5, format="csc")
+    reg = Regressor(warm_start=True, max_iter=500, tol=1e-8).fit(X, y)
+    n_iter = reg.n_iter_[0]
+    coef = reg.coef_.copy()
+    reg.fit(X, y)
+    assert reg.n_iter_[0] < n_iter
+    np.testing.assert_allclose(reg.coef_, coef, atol=1e-6)
+
+
+@pytest.mark.parametrize("option", ("screening", "working_set"))
+@pytest.mark.parametrize("estimator", ("erm", "tmean"))
+@pytest.mark.parametrize("penalty", ("l1", "elasticnet"))
+@pytest.mark.parametrize("fit_intercept", (False, True))
+@pytest.mark.parametrize("sparse", (False, True))
+def test_screening_same_solution(option, estimator, penalty, fit_intercept, sparse):
+    if estimator == "tmean" and sparse:
+        pytest.skip("trimmed means of sparse columns are mostly zero")
+    rng = np.random.RandomState(1)
+    X = rng.randn(100, 300) * (rng.rand(100, 300) < 0.3)
+    y = X[:, :5].dot(rng.randn(5)) + 0.1 * rng.randn(100)
+    if sparse:
+        X = csc_matrix(X)
+    kwargs = {
+        "estimator": estimator,
+        "loss": "leastsquares",
+        "penalty": penalty,
+        "C": 0.1,
+        "l1_ratio": 0.7,
+        "fit_intercept": fit_intercept,
+        "max_iter": 500,
+        "tol": 1e-10,
+        "random_state": 1,
+    }
+    reg = Regressor(**kwargs).fit(X, y)
+    reg_screening = Regressor(**{option: True}, **kwargs).fit(X, y)
+    assert reg_screening.optimization_result_.success
+    np.testing.assert_allclose(reg_screening.coef_, reg.coef_, atol=1e-6)
+    np.testing.assert_allclose(reg_screening.intercept_, reg.intercept_, atol=1e-6)
+
+
+def test_screening_is_checked():
+    with pytest.raises(ValueError, match="screening must be a boolean"):
+        Regressor(screening=1)
+    X, y = simulate_sparse(50, 10, density=0.5, format="csc")
+    with pytest.raises(ValueError, match="screening cannot be used with importance"):
+        Regressor(penalty="l1", screening=True, cgd_IS=True).fit(X, y)
+
+
+def test_working_set_is_checked():
+    with pytest.raises(ValueError, match="working_set must be a boolean"):
+        Regressor(working_set=1)
+    X, y = simulate_sparse(50, 10, density=0.5, format="csc")
+    with pytest.raises(ValueError, match="working_set cannot be used with importance"):
+        Regressor(penalty="l1", working_set=True, cgd_IS=True).fit(X, y)
+    with pytest.raises(ValueError, match="screening and working_set cannot be used"):
+        Regressor(penalty="l1", screening=True, working_set=True).fit(X, y)
+
+
+@pytest.mark.parametrize("stopping_rule", ("objective", "gap", "gradient"))
+@pytest.mark.parametrize("solver", ("cgd", "gd"))
+@pytest.mark.parametrize("fit_intercept", (False, True))
+def test_stopping_rules(stopping_rule, solver, fit_intercept):
+    X, y = simulate_sparse(100, 20, density=0.5, format="csc")
+    if solver == "gd":
+        X = X.toarray()
+    kwargs = {
+        "solver": solver,
+        "loss": "leastsquares",
+        "penalty": "elasticnet",
+        "fit_intercept": fit_intercept,
+        "max_iter": 5000,
+        "random_state": 1,
+    }
+    reg = Regressor(tol=1e-14, **kwargs).fit(X, y)
+    reg_stopping = Regressor(
+        tol=1e-10, stopping_rule=stopping_rule, stopping_period=3, **kwargs
+    ).fit(X, y)
+    assert reg_stopping.optimization_result_.success
+    assert reg_stopping.n_iter_[0] % 3 == 0
+    np.testing.assert_allclose(reg_stopping.coef_, reg.coef_, atol=1e-3)
+
+
+def test_stopping_rule_is_checked():
+    with pytest.raises(ValueError, match="stopping_rule must be one of"):
+        Regressor(stopping_rule="loss")
+    with pytest.raises(ValueError, match="stopping_period must be a positive"):
+        Regressor(stopping_period=0)
+    X, y = simulate_sparse(50, 10, density=0.5, format="csc")
+    with pytest.raises(ValueError, match="can only be used with the 'erm' estimator"):
+        Regressor(estimator="mom", stopping_rule="gap").fit(X, y)
+    with pytest.raises(ValueError, match="cannot be used without penalization"):
+        Regressor(penalty="none", stopping_rule="gap").fit(X, y)
+    with pytest.raises(ValueError, match="needs a smooth loss"):
+        Regressor(loss="absolute", stopping_rule="gradient").fit(X, y)
+    with pytest.raises(ValueError, match="cannot be used with solver='md'"):
+        Regressor(solver="md", stopping_rule="objective").fit(X.toarray(), y)
+
+
+@pytest.mark.parametrize("penalty", ("l2", "l1", "elasticnet"))
+@pytest.mark.parametrize("fit_intercept", (False, True))
+def test_agd_same_solution_as_cgd(penalty, fit_intercept):
+    rng = np.random.RandomState(1)
+    cov = 0.9 ** np.abs(np.subtract.outer(np.arange(20), np.arange(20)))
+    X = rng.multivariate_normal(np.zeros(20), cov, 200)
+    y = X.dot(rng.randn(20)) + 0.1 * rng.randn(200) + 1.0
+    kwargs = {
+        "loss": "leastsquares",
+        "penalty": penalty,
+        "fit_intercept": fit_intercept,
+        "max_iter": 5000,
+        "tol": 1e-10,
+        "random_state": 1,
+    }
+    reg_cgd = Regressor(solver="cgd", **kwargs).fit(X, y)
+    reg_gd = Regressor(solver="gd", **kwargs).fit(X, y)
+    reg_agd = Regressor(solver="agd", **kwargs).fit(X, y)
+    assert reg_agd.optimization_result_.success
+    assert reg_agd.n_iter_[0] < reg_gd.n_iter_[0]
+    np.testing.assert_allclose(reg_agd.coef_, reg_cgd.coef_, atol=1e-6)
+    np.testing.assert_allclose(reg_agd.intercept_, reg_cgd.intercept_, atol=1e-6)
+
+
+def test_agd_robust_estimator():
+    rng = np.random.RandomState(1)
+    X = rng.randn(200, 10)
+    y = X.dot(rng.randn(10)) + 0.1 * rng.randn(200)
+    # The gradients of GMOM are noisy, so that the solvers do not converge
+    kwargs = {"estimator": "gmom", "penalty": "l2", "max_iter": 300, "tol": 1e-6}
+    reg_gd = Regressor(solver="gd", **kwargs).fit(X, y)
+    reg_agd = Regressor(solver="agd", **kwargs).fit(X, y)
+    np.testing.assert_allclose(reg_agd.coef_, reg_gd.coef_, atol=1e-2)
+
+
+def test_agd_dummy_first_step():
+    rng = np.random.RandomState(1)
+    X = rng.randn(200, 10)
+    y = X.dot(rng.randn(10)) + rng.standard_t(2, 200)
+    # The dummy step must leave neither the warm start of the Catoni-Holland
+    # estimator nor the momentum of the solver behind
+    kwargs = {
+        "solver": "agd",
+        "estimator": "ch",
+        "max_iter": 20,
+        "tol": 0.0,
+        "random_state": 1,
+    }
+    reg = Regressor(**kwargs).fit(X, y)
+    reg_dummy = Regressor(**kwargs).fit(X, y, dummy_first_step=True)
+    np.testing.assert_array_equal(reg_dummy.coef_, reg.coef_)
+    np.testing.assert_array_equal(reg_dummy.intercept_, reg.intercept_)
+
+
+@pytest.mark.parametrize("penalty", ("l2", "l1", "elasticnet"))
+@pytest.mark.parametrize("loss", ("leastsquares", "squaredhinge"))
+@pytest.mark.parametrize("fit_intercept", (False, True))
+def test_lbfgs_same_solution_as_cgd(penalty, loss, fit_intercept):
+    rng = np.random.RandomState(1)
+    cov = 0.9 ** np.abs(np.subtract.outer(np.arange(20), np.arange(20)))
+    X = rng.multivariate_normal(np.zeros(20), cov, 200)
+    y = X.dot(rng.randn(20)) + 0.1 * rng.randn(200) + 1.0
+    if loss == "squaredhinge":
+        learner = Classifier
+        y = np.sign(y)
+    else:
+        learner = Regressor
+    kwargs = {
+        "loss": loss,
+        "penalty": penalty,
+        "C": 0.1,
+        "fit_intercept": fit_intercept,
+        "max_iter": 5000,
+        "tol": 1e-10,
+    }
+    learner_cgd = learner(solver="cgd", **kwargs).fit(X, y)
+    learner_lbfgs = learner(solver="lbfgs", **kwargs).fit(X, y)
+    assert learner_lbfgs.optimization_result_.success
+    assert learner_lbfgs.n_iter_[0] < learner_cgd.n_iter_[0]
+    np.testing.assert_allclose(learner_lbfgs.coef_, learner_cgd.coef_, atol=1e-6)
+    np.testing.assert_allclose(
+        learner_lbfgs.intercept_, learner_cgd.intercept_, atol=1e-6
+    )
+
+
+def test_lbfgs_multiclass():
+    rng = np.random.RandomState(1)
+    X = rng.randn(300, 10)
+    y = np.digitize(X.dot(rng.randn(10)), [-1.0, 1.0])
+    kwargs = {"loss": "multimodifiedhuber", "penalty": "l2", "tol": 1e-10}
+    clf_cgd = Classifier(solver="cgd", max_iter=5000, **kwargs).fit(X, y)
+    clf_lbfgs = Classifier(solver="lbfgs", max_iter=500, **kwargs).fit(X, y)
+    assert clf_lbfgs.optimization_result_.success
+    np.testing.assert_allclose(clf_lbfgs.coef_, clf_cgd.coef_, atol=1e-6)
+
+
+def test_lbfgs_is_checked():
+    rng = np.random.RandomState(1)
+    X = rng.randn(50, 5)
+    y = X.dot(rng.randn(5))
+    with pytest.raises(ValueError, match="can only be used with the ERM estimator"):
+        Regressor(solver="lbfgs", estimator="gmom").fit(X, y)
+    with pytest.raises(ValueError, match="needs a smooth loss"):
+        Regressor(solver="lbfgs", loss="absolute").fit(X, y)
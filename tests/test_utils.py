@@ -10,8 +10,24 @@ import numpy as np
 from scipy.sparse import csr_matrix, csc_matrix
 
 import pytest
+from numba import jit
 
-from linlearn._utils import is_in_sorted, whereis_sorted, csr_get, matrix_type, sum_sq
+from linlearn._utils import (
+    is_in_sorted,
+    whereis_sorted,
+    csr_get,
+    matrix_type,
+    sum_sq,
+    spectral_norm_sq,
+    fast_trimmed_mean,
+    warm_trimmed_mean,
+    argmedian,
+    xt_dot_factory,
+    get_kernel,
+    _kernels,
+)
+from linlearn._loss import decision_function_factory
+from linlearn import Regressor
 
 
 @pytest.mark.parametrize(
@@ -118,3 +134,159 @@ def test_sum_sq(mtype, sparsify, axis):
     tol = 1e-12
     assert norms == pytest.approx(out, abs=tol, rel=tol)
     assert norms == pytest.approx(sum_sq(X, axis=axis), abs=tol, rel=tol)
+
+
+@pytest.mark.parametrize("mtype", ("c", "f", "csr", "csc"))
+@pytest.mark.parametrize("dtype", (np.float32, np.float64))
+def test_spectral_norm_sq(mtype, dtype):
+    n_samples, n_features = 200, 30
+    rng = np.random.RandomState(42)
+    X = rng.randn(n_samples, n_features) + 1.0
+    X[X < 0.0] = 0.0
+    X = X.astype(dtype)
+    norm_sq = np.linalg.norm(X.astype(np.float64), 2) ** 2
+    if mtype == "c":
+        X = np.ascontiguousarray(X)
+    elif mtype == "f":
+        X = np.asfortranarray(X)
+    elif mtype == "csc":
+        X = csc_matrix(X)
+    else:
+        X = csr_matrix(X)
+    # The residual of the iterations cannot be much smaller than the float precision
+    assert spectral_norm_sq(X, tol=1e-6, max_iter=1000) == pytest.approx(
+        norm_sq, rel=1e-5
+    )
+    assert norm_sq <= spectral_norm_sq(X) <= norm_sq * (1 + 1e-4)
+    assert spectral_norm_sq(np.zeros((3, 2))) == 0.0
+
+
+@pytest.mark.parametrize("gap", (1e-3, 1e-1))
+def test_spectral_norm_sq_small_gap(gap):
+    # Two leading singular values close to each other and slowly decaying other ones,
+    # for which power iterations converge slowly
+    n_samples, n_features = 300, 50
+    rng = np.random.RandomState(42)
+    U, _ = np.linalg.qr(rng.randn(n_samples, n_features))
+    V, _ = np.linalg.qr(rng.randn(n_features, n_features))
+    singular_values = np.linspace(1.0 - gap, 0.5, n_features)
+    singular_values[0] = 1.0
+    X = (U * singular_values).dot(V.T)
+    norm_sq = np.linalg.norm(X, 2) ** 2
+    for max_iter in (5, 100, 10000):
+        upper_bound = spectral_norm_sq(X, max_iter=max_iter)
+        assert norm_sq <= upper_bound <= (X ** 2).sum()
+    assert spectral_norm_sq(X, max_iter=10000) <= norm_sq * (1 + 1e-4)
+
+
+@pytest.mark.parametrize("many_ties", (False, True))
+def test_warm_trimmed_mean(many_ties):
+    n_samples, n_excluded_tails = 101, 10
+    rng = np.random.RandomState(42)
+    bounds = np.zeros(2)
+    widths = np.full(2, -1.0)
+    buffer = np.empty(n_samples)
+    x = rng.randn(n_samples)
+    for scale in [0.0] + 5 * [1e-3] + [1.0] + 5 * [1e-6]:
+        # Small moves use the previous bounds, large ones a full selection
+        x += scale * rng.randn(n_samples)
+        if many_ties:
+            x[::2] = 0.0
+        expected = fast_trimmed_mean(x.copy(), n_samples, n_excluded_tails)
+        result = warm_trimmed_mean(
+            x.copy(), n_samples, n_excluded_tails, bounds, widths, buffer, many_ties
+        )
+        assert result == pytest.approx(expected, abs=1e-12)
+        x_sorted = np.sort(x)
+        assert bounds[0] == x_sorted[n_excluded_tails]
+        assert bounds[1] == x_sorted[n_samples - n_excluded_tails - 1]
+        assert np.all(widths >= 0.0)
+
+
+@pytest.mark.parametrize("n", (1, 2, 7, 8, 50))
+@pytest.mark.parametrize("many_ties", (False, True))
+def test_argmedian(n, many_ties):
+    rng = np.random.RandomState(n)
+    indices = np.empty(n, dtype=np.uintp)
+    for _ in range(10):
+        if many_ties:
+            x = rng.randint(3, size=n).astype(np.float64)
+        else:
+            x = rng.randn(n)
+        x_copy = x.copy()
+        idx = argmedian(x, indices)
+        # The upper median for even lengths, x is not modified
+        assert x[idx] == np.sort(x)[n // 2]
+        np.testing.assert_array_equal(x, x_copy)
+
+
+@pytest.mark.parametrize("order", ("C", "F"))
+@pytest.mark.parametrize("n_classes", (1, 3))
+def test_xt_dot(order, n_classes):
+    n_samples, n_features, n_blocks = 50, 7, 4
+    rng = np.random.RandomState(order == "C")
+    X = np.array(rng.randn(n_samples, n_features), order=order)
+    D = rng.randn(n_samples, n_classes)
+    blocks = rng.randint(n_blocks, size=n_samples).astype(np.uintp)
+    out = np.empty((n_blocks, n_classes, n_features))
+    xt_dot_factory(X)(X, D, blocks, out)
+    for b in range(n_blocks):
+        block = blocks == b
+        np.testing.assert_allclose(out[b], D[block].T.dot(X[block]), atol=1e-12)
+
+
+def test_get_kernel():
+    X = np.random.randn(5, 3)
+    w = np.random.randn(4)
+    out1, out2 = np.empty(5), np.empty(5)
+    decision_function1 = decision_function_factory(True)
+    decision_function2 = decision_function_factory(True)
+    assert decision_function1 is decision_function2
+    assert decision_function_factory(False) is not decision_function1
+    decision_function1(X, w, out1)
+    decision_function2(X, w, out2)
+    np.testing.assert_allclose(out1, X.dot(w[1:]) + w[0])
+    np.testing.assert_allclose(out1, out2)
+
+    def factory(a):
+        @jit(nopython=True)
+        def f(x):
+            return a[0] * x
+
+        return f
+
+    # Kernels capturing arrays are returned unchanged
+    f = factory(np.ones(1))
+    assert get_kernel(f) is f
+    assert get_kernel(factory(np.ones(1))) is not f
+
+    def nested_factory(a):
+        @jit(nopython=True)
+        def g(x):
+            return a * x
+
+        @jit(nopython=True)
+        def h(x):
+            return g(x)
+
+        return h
+
+    h1 = get_kernel(nested_factory(1.0))
+    h2 = get_kernel(nested_factory(2.0))
+    assert get_kernel(nested_factory(1.0)) is h1
+    assert h1(3.0) == 3.0 and h2(3.0) == 6.0
+
+
+def test_get_kernel_reused_by_fits():
+    rng = np.random.RandomState(42)
+    X = rng.randn(100, 5)
+    y = X.dot(np.arange(1.0, 6.0)) + rng.randn(100)
+    kwargs = {"loss": "huber", "penalty": "l1", "estimator": "mom", "random_state": 0}
+    reg1 = Regressor(**kwargs).fit(X, y)
+    n_kernels = len(_kernels)
+    # A second fit with the same structural parameters compiles no new kernel
+    reg2 = Regressor(**kwargs).fit(X, y)
+    assert len(_kernels) == n_kernels
+    np.testing.assert_array_equal(reg2.coef_, reg1.coef_)
+    Regressor(**dict(kwargs, penalty="l2")).fit(X, y)
+    assert len(_kernels) > n_kernels